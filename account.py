@@ -1,9 +1,22 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 from firebase_config import (
     get_db, 
     get_pending_users, 
     approve_user, 
-    reject_user
+    reject_user,
+    get_recent_users,
+    backfill_total_value,
+    ALL_LOCATIONS,
+    DEFAULT_LOCATION,
+    list_locations,
+    get_inventory_summary,
+    migrate_legacy_inventory,
+    record_changes,
+    tenant_users,
+    get_read_allowance,
+    get_active_tenant,
+    DEFAULT_TENANT
 )
 from firebase_admin import firestore
 import pandas as pd
@@ -60,7 +73,9 @@ def app():
                             st.error("Passwords do not match!")
                             return
                     
-                    db.collection('users').document(user['id']).update(update_data)
+                    user_ref = db.collection('users').document(user['id'])
+                    user_ref.update(update_data)
+                    record_changes([('update', user_ref, update_data, False)])
                     st.success("Profile updated successfully!")
                     
                     # Update session state
@@ -79,137 +94,23 @@ def app():
         
         tab1, tab2, tab3 = st.tabs(["Pending Approvals", "User Management", "System Stats"])
         
+        # Both lists are loaded once per page run and patched locally after
+        # each write, which reruns only the affected fragment
+        st.session_state.pop('pending_users_view', None)
+        st.session_state.pop('users_view', None)
+        
         with tab1:
-            st.write("**Pending User Approvals:**")
-            
-            pending_users = get_pending_users()
-            
-            if pending_users:
-                for pending_user in pending_users:
-                    with st.expander(f"👤 {pending_user.get('full_name', 'N/A')} (@{pending_user.get('username', 'N/A')})"):
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            st.write(f"**Email:** {pending_user.get('email', 'N/A')}")
-                            st.write(f"**Department:** {pending_user.get('department', 'N/A')}")
-                            st.write(f"**Created:** {pending_user.get('created_at', 'N/A')}")
-                        
-                        with col2:
-                            st.write(f"**Username:** {pending_user.get('username', 'N/A')}")
-                            st.write(f"**Reason:** {pending_user.get('reason', 'No reason provided')}")
-                        
-                        col1, col2, col3 = st.columns([1, 1, 2])
-                        
-                        with col1:
-                            if st.button(f"✅ Approve", key=f"approve_{pending_user['id']}"):
-                                if approve_user(pending_user['id']):
-                                    st.success("User approved!")
-                                    st.rerun()
-                                else:
-                                    st.error("Failed to approve user")
-                        
-                        with col2:
-                            if st.button(f"❌ Reject", key=f"reject_{pending_user['id']}"):
-                                if reject_user(pending_user['id']):
-                                    st.success("User rejected!")
-                                    st.rerun()
-                                else:
-                                    st.error("Failed to reject user")
-            else:
-                st.info("No pending user approvals")
+            pending_approvals()
         
         with tab2:
-            st.write("**All Users:**")
-            try:
-                users = []
-                docs = db.collection('users').stream()
-                
-                for doc in docs:
-                    user_data = doc.to_dict()
-                    user_data['id'] = doc.id
-                    users.append({
-                        'Username': user_data.get('username'),
-                        'Full Name': user_data.get('full_name', 'N/A'),
-                        'Email': user_data.get('email'),
-                        'Role': user_data.get('role'),
-                        'Status': user_data.get('status', 'approved'),
-                        'ID': user_data['id']
-                    })
-                
-                if users:
-                    df = pd.DataFrame(users)
-                    st.dataframe(df, use_container_width=True)
-                    
-                    # Delete user functionality
-                    st.subheader("Delete User")
-                    user_to_delete = st.selectbox(
-                        "Select user to delete:",
-                        [""] + [f"{u['Username']} ({u['Email']})" for u in users if u['ID'] != user['id']]
-                    )
-                    
-                    if user_to_delete and st.button("🗑️ Delete User", type="secondary"):
-                        if st.checkbox("I confirm I want to delete this user"):
-                            try:
-                                # Extract user ID from selection
-                                selected_user = next(u for u in users if f"{u['Username']} ({u['Email']})" == user_to_delete)
-                                db.collection('users').document(selected_user['ID']).delete()
-                                st.success("User deleted successfully!")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Error deleting user: {e}")
-                    
-                    # Create new admin user
-                    st.subheader("Create Admin User")
-                    with st.form("create_admin"):
-                        admin_username = st.text_input("Admin Username")
-                        admin_email = st.text_input("Admin Email")
-                        admin_password = st.text_input("Admin Password", type="password")
-                        admin_full_name = st.text_input("Admin Full Name")
-                        
-                        if st.form_submit_button("Create Admin"):
-                            if admin_username and admin_email and admin_password and admin_full_name:
-                                try:
-                                    # Check if username or email already exists
-                                    from firebase_config import check_username_exists, check_email_exists
-                                    
-                                    if check_username_exists(admin_username):
-                                        st.error("Username already exists!")
-                                        return
-                                    
-                                    if check_email_exists(admin_email):
-                                        st.error("Email already exists!")
-                                        return
-                                    
-                                    # Create admin user directly (no approval needed)
-                                    admin_data = {
-                                        'username': admin_username,
-                                        'email': admin_email,
-                                        'full_name': admin_full_name,
-                                        'password': admin_password,
-                                        'role': 'admin',
-                                        'status': 'approved',
-                                        'created_at': firestore.SERVER_TIMESTAMP,
-                                        'created_by': user['id']
-                                    }
-                                    
-                                    db.collection('users').add(admin_data)
-                                    st.success("Admin user created successfully!")
-                                    st.rerun()
-                                    
-                                except Exception as e:
-                                    st.error(f"Error creating admin: {e}")
-                            else:
-                                st.error("Please fill all fields")
-                
-            except Exception as e:
-                st.error(f"Error loading users: {e}")
+            user_management(user)
         
         with tab3:
             st.write("**System Statistics:**")
             try:
-                # Get inventory stats
-                inventory_docs = list(db.collection('inventory').stream())
-                user_docs = list(db.collection('users').stream())
+                # Get inventory stats from the location summaries
+                inventory_summary = get_inventory_summary(ALL_LOCATIONS) or {'item_count': 0}
+                user_docs = list(tenant_users(db).stream())
                 pending_users = get_pending_users()
                 
                 col1, col2, col3, col4 = st.columns(4)
@@ -221,7 +122,7 @@ def app():
                     st.metric("Pending Approvals", len(pending_users))
                 
                 with col3:
-                    st.metric("Total Inventory Items", len(inventory_docs))
+                    st.metric("Total Inventory Items", inventory_summary['item_count'])
                 
                 with col4:
                     admin_count = sum(1 for doc in user_docs if doc.to_dict().get('role') == 'admin')
@@ -242,23 +143,35 @@ def app():
                 with col3:
                     st.metric("Rejected Users", status_counts.get('rejected', 0))
                 
+                # This organization's share of the Firestore reads
+                allowance = get_read_allowance()
+                reads_used, reads_budget = allowance['daily_used'], allowance['daily_budget']
+                st.subheader(f"Read Budget ({user['tenant']})")
+                st.progress(min(1.0, reads_used / reads_budget),
+                            text=f"{reads_used:,} of {reads_budget:,} reads used today on this server")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Organization Burst Reads Left", f"{allowance['tenant_available']:,}",
+                              help=f"Refills to {allowance['tenant_capacity']:,}")
+                with col2:
+                    st.metric("Session Reads Left", f"{allowance['session_available']:,}",
+                              help=f"Refills to {allowance['session_capacity']:,}")
+                with col3:
+                    st.metric("Cached Results Served", f"{allowance['stale_served']:,}",
+                              help="Reads answered from the last result because a limit was reached")
+                
                 # Recent registrations
                 st.subheader("Recent Registrations")
                 try:
-                    recent_users = []
-                    for doc in user_docs:
-                        user_data = doc.to_dict()
-                        if 'created_at' in user_data:
-                            recent_users.append({
-                                'Username': user_data.get('username'),
-                                'Full Name': user_data.get('full_name', 'N/A'),
-                                'Status': user_data.get('status', 'approved'),
-                                'Created': user_data.get('created_at', 'N/A')
-                            })
-                    
-                    # Sort by creation date (most recent first)
-                    # Note: This is a simplified sort, you might want to implement proper date sorting
-                    recent_users = recent_users[-10:]  # Show last 10 users
+                    recent_users = [
+                        {
+                            'Username': user_data.get('username'),
+                            'Full Name': user_data.get('full_name', 'N/A'),
+                            'Status': user_data.get('status', 'approved'),
+                            'Created': user_data.get('created_at', 'N/A')
+                        }
+                        for user_data in get_recent_users(10)
+                    ]
                     
                     if recent_users:
                         df_recent = pd.DataFrame(recent_users)
@@ -269,5 +182,206 @@ def app():
                 except Exception as e:
                     st.error(f"Error loading recent registrations: {e}")
                 
+                # Maintenance
+                st.subheader("Maintenance")
+                if st.button("🔁 Backfill Item Values"):
+                    updated = backfill_total_value()
+                    st.success(f"Updated total value on {updated} items")
+                
+                # Only the default tenant has items from before locations
+                if get_active_tenant() == DEFAULT_TENANT and st.button(f"📍 Move Unassigned Items to '{DEFAULT_LOCATION}'"):
+                    moved = migrate_legacy_inventory(DEFAULT_LOCATION)
+                    st.success(f"Moved {moved} items to {DEFAULT_LOCATION}")
+                
             except Exception as e:
                 st.error(f"Error loading system stats: {e}")
+
+def _flash(message):
+    """Show a success message after the fragment rerun that follows a write"""
+    st.session_state.account_flash = message
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        # The fragment is running as part of a full-app run
+        st.rerun()
+
+def _show_flash():
+    message = st.session_state.pop('account_flash', None)
+    if message:
+        st.success(message)
+
+@st.fragment
+def pending_approvals():
+    st.write("**Pending User Approvals:**")
+    _show_flash()
+    
+    if 'pending_users_view' not in st.session_state:
+        st.session_state.pending_users_view = get_pending_users()
+    pending_users = st.session_state.pending_users_view
+    
+    if pending_users:
+        for pending_user in pending_users:
+            with st.expander(f"👤 {pending_user.get('full_name', 'N/A')} (@{pending_user.get('username', 'N/A')})"):
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.write(f"**Email:** {pending_user.get('email', 'N/A')}")
+                    st.write(f"**Department:** {pending_user.get('department', 'N/A')}")
+                    st.write(f"**Created:** {pending_user.get('created_at', 'N/A')}")
+                
+                with col2:
+                    st.write(f"**Username:** {pending_user.get('username', 'N/A')}")
+                    st.write(f"**Reason:** {pending_user.get('reason', 'No reason provided')}")
+                
+                col1, col2, col3 = st.columns([1, 1, 2])
+                
+                with col1:
+                    if st.button(f"✅ Approve", key=f"approve_{pending_user['id']}"):
+                        if approve_user(pending_user['id']):
+                            pending_users.remove(pending_user)
+                            _flash("User approved!")
+                        else:
+                            st.error("Failed to approve user")
+                
+                with col2:
+                    if st.button(f"❌ Reject", key=f"reject_{pending_user['id']}"):
+                        if reject_user(pending_user['id']):
+                            pending_users.remove(pending_user)
+                            _flash("User rejected!")
+                        else:
+                            st.error("Failed to reject user")
+    else:
+        st.info("No pending user approvals")
+
+@st.fragment
+def user_management(user):
+    db = get_db()
+    st.write("**All Users:**")
+    _show_flash()
+    try:
+        if 'users_view' not in st.session_state:
+            users = []
+            docs = tenant_users(db).stream()
+            
+            for doc in docs:
+                user_data = doc.to_dict()
+                user_data['id'] = doc.id
+                users.append({
+                    'Username': user_data.get('username'),
+                    'Full Name': user_data.get('full_name', 'N/A'),
+                    'Email': user_data.get('email'),
+                    'Role': user_data.get('role'),
+                    'Status': user_data.get('status', 'approved'),
+                    'Location': user_data.get('location', DEFAULT_LOCATION),
+                    'ID': user_data['id']
+                })
+            st.session_state.users_view = users
+        users = st.session_state.users_view
+        
+        if users:
+            df = pd.DataFrame(users)
+            st.dataframe(df, use_container_width=True)
+            
+            # Delete user functionality
+            st.subheader("Delete User")
+            user_to_delete = st.selectbox(
+                "Select user to delete:",
+                [""] + [f"{u['Username']} ({u['Email']})" for u in users if u['ID'] != user['id']]
+            )
+            
+            if user_to_delete and st.button("🗑️ Delete User", type="secondary"):
+                if st.checkbox("I confirm I want to delete this user"):
+                    try:
+                        # Extract user ID from selection
+                        selected_user = next(u for u in users if f"{u['Username']} ({u['Email']})" == user_to_delete)
+                        user_ref = db.collection('users').document(selected_user['ID'])
+                        user_ref.delete()
+                        record_changes([('delete', user_ref, None, False)])
+                        users.remove(selected_user)
+                        _flash("User deleted successfully!")
+                    except Exception as e:
+                        st.error(f"Error deleting user: {e}")
+            
+            # Assign user location
+            st.subheader("Assign Location")
+            with st.form("assign_location"):
+                user_to_assign = st.selectbox(
+                    "User",
+                    [f"{u['Username']} ({u['Email']})" for u in users]
+                )
+                new_location = st.text_input("Location", value=DEFAULT_LOCATION,
+                                             help=f"Existing: {', '.join(list_locations()) or DEFAULT_LOCATION}")
+                
+                if st.form_submit_button("Assign"):
+                    if new_location:
+                        try:
+                            selected_user = next(u for u in users if f"{u['Username']} ({u['Email']})" == user_to_assign)
+                            user_ref = db.collection('users').document(selected_user['ID'])
+                            location_update = {
+                                'location': new_location,
+                                'last_updated': firestore.SERVER_TIMESTAMP
+                            }
+                            user_ref.update(location_update)
+                            record_changes([('update', user_ref, location_update, False)])
+                            selected_user['Location'] = new_location
+                            _flash(f"{selected_user['Username']} assigned to {new_location}")
+                        except Exception as e:
+                            st.error(f"Error assigning location: {e}")
+                    else:
+                        st.error("Location is required!")
+            
+            # Create new admin user
+            st.subheader("Create Admin User")
+            with st.form("create_admin"):
+                admin_username = st.text_input("Admin Username")
+                admin_email = st.text_input("Admin Email")
+                admin_password = st.text_input("Admin Password", type="password")
+                admin_full_name = st.text_input("Admin Full Name")
+                
+                if st.form_submit_button("Create Admin"):
+                    if admin_username and admin_email and admin_password and admin_full_name:
+                        try:
+                            # Check if username or email already exists
+                            from firebase_config import check_username_exists, check_email_exists
+                            
+                            if check_username_exists(admin_username):
+                                st.error("Username already exists!")
+                                return
+                            
+                            if check_email_exists(admin_email):
+                                st.error("Email already exists!")
+                                return
+                            
+                            # Create admin user directly (no approval needed)
+                            admin_data = {
+                                'username': admin_username,
+                                'email': admin_email,
+                                'full_name': admin_full_name,
+                                'password': admin_password,
+                                'role': 'admin',
+                                'status': 'approved',
+                                'tenant': user['tenant'],
+                                'created_at': firestore.SERVER_TIMESTAMP,
+                                'created_by': user['id']
+                            }
+                            
+                            _, admin_ref = db.collection('users').add(admin_data)
+                            record_changes([('create', admin_ref, admin_data, False)])
+                            users.append({
+                                'Username': admin_username,
+                                'Full Name': admin_full_name,
+                                'Email': admin_email,
+                                'Role': 'admin',
+                                'Status': 'approved',
+                                'Location': DEFAULT_LOCATION,
+                                'ID': admin_ref.id
+                            })
+                            _flash("Admin user created successfully!")
+                            
+                        except Exception as e:
+                            st.error(f"Error creating admin: {e}")
+                    else:
+                        st.error("Please fill all fields")
+        
+    except Exception as e:
+        st.error(f"Error loading users: {e}")
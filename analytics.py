@@ -0,0 +1,475 @@
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor, wait as wait_futures
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Report computations run here over numeric columns of the inventory held in
+# shared memory. Large catalogs are split into partitions and computed in a
+# process pool; small ones run inline where a pool would only add overhead.
+
+PARTITION_ROWS = 250_000
+BLOCK_ROWS = 65_536
+INLINE_ROWS = 200_000
+MAX_FRAMES = 2
+MAX_RESULTS = 64
+
+_engine = None
+_engine_lock = threading.Lock()
+
+# Worker-local attachments to shared memory blocks, by block name
+_attached = OrderedDict()
+MAX_ATTACHED = 16
+
+
+def inventory_columns(df):
+    """Get the numeric columns the analytics jobs work on from an inventory DataFrame"""
+    quantity = pd.to_numeric(df.get('quantity', pd.Series(0, index=df.index)), errors='coerce').fillna(0)
+    price = pd.to_numeric(df.get('price', pd.Series(0.0, index=df.index)), errors='coerce').fillna(0.0)
+    category_codes, categories = pd.factorize(df.get('category', pd.Series('Other', index=df.index)).fillna('Other'))
+    location_codes, locations = pd.factorize(df.get('location', pd.Series('', index=df.index)).fillna(''))
+
+    columns = {
+        'quantity': quantity.to_numpy(dtype=np.float64),
+        'price': price.to_numpy(dtype=np.float64),
+        'category': category_codes.astype(np.int32),
+        'location': location_codes.astype(np.int32),
+    }
+    labels = {'category': list(categories), 'location': list(locations)}
+    return columns, labels
+
+
+class SharedFrame:
+    """Numeric columns copied once into shared memory so workers read them without pickling"""
+
+    def __init__(self, columns, labels):
+        self.labels = labels
+        self.length = len(next(iter(columns.values()))) if columns else 0
+        self.spec = {}
+        self._blocks = []
+        self._local = {}
+
+        for name, values in columns.items():
+            values = np.ascontiguousarray(values)
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            array = np.ndarray(values.shape, values.dtype, buffer=block.buf)
+            array[:] = values
+            self._blocks.append(block)
+            self._local[name] = array
+            self.spec[name] = (block.name, values.shape, values.dtype.str)
+
+    def arrays(self):
+        return self._local
+
+    def close(self):
+        self._local = {}
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def _attach(spec):
+    """Map shared memory columns into this worker process"""
+    arrays = {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = _attached.get(block_name)
+        if block is None:
+            # Spawned workers share the parent's resource tracker, which
+            # unlinks the block when the parent closes the frame
+            block = shared_memory.SharedMemory(name=block_name)
+            _attached[block_name] = block
+        _attached.move_to_end(block_name)
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    return arrays
+
+
+def _cancelled(flag_name):
+    if flag_name is None:
+        return False
+    return _attach({'flag': (flag_name, (1,), '|u1')})['flag'][0] == 1
+
+
+# Jobs are (partition, reduce, prepare) triples. A partition function gets the column
+# arrays, a row range and the job parameters and returns a partial result,
+# or None when it notices cancellation between blocks.
+
+def _rollup_partition(arrays, start, stop, params, flag_name):
+    n_categories = params['n_categories']
+    n_locations = params['n_locations']
+    threshold = params['low_stock_threshold']
+    result = {
+        'item_count': 0,
+        'total_quantity': 0.0,
+        'total_value': 0.0,
+        'low_stock_count': 0,
+        'category_count': np.zeros(n_categories),
+        'category_quantity': np.zeros(n_categories),
+        'category_value': np.zeros(n_categories),
+        'location_value': np.zeros(n_locations),
+    }
+
+    for block_start in range(start, stop, BLOCK_ROWS):
+        if _cancelled(flag_name):
+            return None
+        block = slice(block_start, min(block_start + BLOCK_ROWS, stop))
+        quantity = arrays['quantity'][block]
+        value = quantity * arrays['price'][block]
+        category = arrays['category'][block]
+
+        result['item_count'] += len(quantity)
+        result['total_quantity'] += quantity.sum()
+        result['total_value'] += value.sum()
+        result['low_stock_count'] += int(np.count_nonzero(quantity < threshold))
+        result['category_count'] += np.bincount(category, minlength=n_categories)
+        result['category_quantity'] += np.bincount(category, weights=quantity, minlength=n_categories)
+        result['category_value'] += np.bincount(category, weights=value, minlength=n_categories)
+        result['location_value'] += np.bincount(arrays['location'][block], weights=value, minlength=n_locations)
+
+    return result
+
+
+def _sum_reduce(parts, labels):
+    total = parts[0]
+    for part in parts[1:]:
+        for key, value in part.items():
+            total[key] = total[key] + value
+
+    categories = labels['category']
+    total['by_category'] = pd.DataFrame({
+        'category': categories,
+        'count': total.pop('category_count').astype(int),
+        'quantity': total.pop('category_quantity'),
+        'total_value': total.pop('category_value'),
+    })
+    total['by_location'] = pd.DataFrame({
+        'location': labels['location'],
+        'total_value': total.pop('location_value'),
+    })
+    return total
+
+
+def _rollup_params(frame, params):
+    return dict(
+        params,
+        n_categories=max(len(frame.labels['category']), 1),
+        n_locations=max(len(frame.labels['location']), 1),
+    )
+
+
+JOBS = {
+    'inventory_rollup': (_rollup_partition, _sum_reduce, _rollup_params),
+}
+
+
+# ABC (Pareto) classification: A items make up the first 80% of value,
+# B the next 15% and C the remaining 5%
+ABC_CLASSES = np.array(['A', 'B', 'C'])
+ABC_THRESHOLDS = (0.80, 0.95)
+
+
+def abc_classify(values, groups=None, thresholds=ABC_THRESHOLDS):
+    """Classify every item A/B/C by cumulative share of value, overall or within each group.
+
+    values and groups are equal-length arrays; groups are integer codes
+    (e.g. from pd.factorize). An item's class is decided by the share of
+    value held by the items ranked above it, so the single most valuable
+    item is always A. Returns (classes, cumulative_share) in input order.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return np.array([], dtype='<U1'), np.array([])
+    if groups is None:
+        groups = np.zeros(n, dtype=np.int64)
+        order = np.argsort(-values)
+    else:
+        # Sort by group, then by value descending within the group
+        groups = np.asarray(groups)
+        order = np.lexsort((-values, groups))
+    sorted_values = values[order]
+    sorted_groups = groups[order]
+
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    lengths = np.diff(np.r_[starts, n])
+    totals = np.repeat(np.add.reduceat(sorted_values, starts), lengths)
+
+    # Cumulative value within each group, before and including each item
+    cumulative = np.cumsum(sorted_values)
+    cumulative -= np.repeat(cumulative[starts] - sorted_values[starts], lengths)
+    before = cumulative - sorted_values
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share_before = np.where(totals > 0, before / totals, 1.0)
+        share = np.where(totals > 0, cumulative / totals, 1.0)
+
+    class_index = np.searchsorted(np.asarray(thresholds), share_before, side='right')
+    classes = np.empty(n, dtype='<U1')
+    classes[order] = ABC_CLASSES[class_index]
+    cumulative_share = np.empty(n)
+    cumulative_share[order] = share
+    return classes, cumulative_share
+
+
+def scenario_prices(price, category_codes, supplier_codes, scenario, n_categories, n_suppliers):
+    """Get every item's price under a scenario of percentage changes.
+
+    A scenario maps 'all' to a percent and 'category' / 'supplier' to
+    {code: percent}. Changes compound, so an item whose category and
+    supplier both change gets both. Prices are rounded to cents and never
+    go below zero.
+    """
+    category_factor = np.ones(max(n_categories, 1))
+    for code, percent in scenario.get('category', {}).items():
+        category_factor[code] *= 1 + percent / 100
+    supplier_factor = np.ones(max(n_suppliers, 1))
+    for code, percent in scenario.get('supplier', {}).items():
+        supplier_factor[code] *= 1 + percent / 100
+
+    factor = category_factor[category_codes] * supplier_factor[supplier_codes] * (1 + scenario.get('all', 0.0) / 100)
+    return np.maximum(np.round(price * factor, 2), 0.0)
+
+
+def compare_price_scenarios(quantity, price, category_codes, supplier_codes, scenarios, n_categories, n_suppliers,
+                            top_n=10):
+    """Total value, value by category, items repriced and the top_n items by value, per scenario.
+
+    Works on whole columns at once; the current prices are the first result.
+    """
+    results = []
+    for scenario in [{}] + list(scenarios):
+        new_price = scenario_prices(price, category_codes, supplier_codes, scenario, n_categories, n_suppliers)
+        value = quantity * new_price
+        top = np.argpartition(value, -top_n)[-top_n:] if len(value) > top_n else np.arange(len(value))
+        results.append({
+            'total_value': float(value.sum()),
+            'category_value': np.bincount(category_codes, weights=value, minlength=n_categories),
+            'repriced': int(np.count_nonzero(new_price != price)),
+            'top': top[np.argsort(-value[top])],
+            'top_value': np.sort(value[top])[::-1]
+        })
+    return results
+
+
+def _run_partition(job_name, spec, start, stop, params, flag_name):
+    """Worker entry point: compute one partition of a job"""
+    # Drop attachments to blocks of old frames and finished jobs
+    current = {block_name for block_name, _, _ in spec.values()} | {flag_name}
+    while len(_attached) > MAX_ATTACHED:
+        stale = next((name for name in _attached if name not in current), None)
+        if stale is None:
+            break
+        _attached.pop(stale).close()
+
+    partition = JOBS[job_name][0]
+    return partition(_attach(spec), start, stop, params, flag_name)
+
+
+def job_key(job_name, version, params=None):
+    """Get the key identifying a job over the data at version"""
+    return (job_name, version, tuple(sorted((params or {}).items())))
+
+
+class AnalyticsJob:
+    """A running (or finished) report computation"""
+
+    def __init__(self, key, futures=None, reduce=None, flag=None, result=None, on_finish=None):
+        self.key = key
+        self._futures = futures or []
+        self._reduce = reduce
+        self._flag = flag
+        self._result = result
+        self._done = result is not None
+        self._cancelled = False
+        self._finished = result is not None
+        self._error = None
+        self._on_finish = on_finish
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done or self._cancelled or all(future.done() for future in self._futures)
+
+    def cancelled(self):
+        return self._cancelled
+
+    def progress(self):
+        if self._done or not self._futures:
+            return 1.0
+        return sum(future.done() for future in self._futures) / len(self._futures)
+
+    def cancel(self):
+        """Stop queued partitions and ask running ones to stop at their next block"""
+        self._cancelled = True
+        if self._flag is not None:
+            self._flag.buf[0] = 1
+        for future in self._futures:
+            future.cancel()
+
+    def result(self, timeout=None):
+        """Wait for every partition and combine them; returns None if cancelled.
+
+        Raises the error of a partition or of combining them, on every call.
+        """
+        if self._futures and not self._done:
+            # Cancelled partitions stop at their next block, so this is short
+            _, pending = wait_futures(self._futures, timeout)
+            if pending:
+                raise TimeoutError("Analytics job is still running")
+
+        with self._lock:
+            if not (self._done or self._finished):
+                try:
+                    try:
+                        parts = [future.result() for future in self._futures]
+                    except CancelledError:
+                        parts = [None]
+                    if self._cancelled or any(part is None for part in parts):
+                        self._cancelled = True
+                    else:
+                        self._result = self._reduce(parts)
+                        self._done = True
+                except Exception as e:
+                    self._error = e
+                finally:
+                    # Frees the flag and leaves the engine's running jobs, so the next request starts afresh
+                    self._finish()
+            if self._error is not None:
+                raise self._error
+            return self._result
+
+    def _finish(self):
+        self._finished = True
+        if self._flag is not None:
+            self._flag.close()
+            self._flag.unlink()
+            self._flag = None
+        if self._on_finish:
+            self._on_finish(self)
+            self._on_finish = None
+
+
+def _settle(job):
+    try:
+        job.result()
+    except Exception:
+        pass  # Raised again to the sessions that ask for the result
+
+
+class AnalyticsEngine:
+    """Runs report jobs over shared inventory columns in a process pool.
+
+    Frames and results are cached by data version, so rerunning a page
+    over unchanged data does not recompute anything, and identical
+    concurrent requests share one running job.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool = None
+        self._frames = OrderedDict()
+        self._results = OrderedDict()
+        self._running = {}
+        self._lock = threading.RLock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn keeps workers independent of the server's threads
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _get_frame(self, version, load_columns):
+        frame = self._frames.get(version)
+        if frame is None:
+            frame = SharedFrame(*load_columns())
+            self._frames[version] = frame
+            self._evict_frames()
+        self._frames.move_to_end(version)
+        return frame
+
+    def _evict_frames(self):
+        in_use = {key[1] for key in self._running}
+        for version in list(self._frames):
+            if len(self._frames) <= MAX_FRAMES:
+                break
+            if version not in in_use:
+                self._frames.pop(version).close()
+
+    def submit(self, job_name, version, load_columns, params=None):
+        """Start (or reuse) a job over the data at version.
+
+        load_columns is only called when the version's columns are not
+        loaded yet and returns (columns, labels) as from inventory_columns.
+        """
+        params = params or {}
+        key = job_key(job_name, version, params)
+
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return AnalyticsJob(key, result=self._results[key])
+            if key in self._running:
+                return self._running[key]
+
+            frame = self._get_frame(version, load_columns)
+            partition, reduce, prepare = JOBS[job_name]
+            job_params = prepare(frame, params)
+
+            def combine(parts):
+                return reduce(parts, frame.labels)
+
+            if frame.length <= INLINE_ROWS:
+                result = combine([partition(frame.arrays(), 0, frame.length, job_params, None)])
+                self._store(key, result)
+                return AnalyticsJob(key, result=result)
+
+            flag = shared_memory.SharedMemory(create=True, size=1)
+            flag.buf[0] = 0
+            pool = self._get_pool()
+            futures = [
+                pool.submit(_run_partition, job_name, frame.spec, start, min(start + PARTITION_ROWS, frame.length),
+                            job_params, flag.name)
+                for start in range(0, frame.length, PARTITION_ROWS)
+            ]
+            job = AnalyticsJob(key, futures, combine, flag, on_finish=self._job_finished)
+            self._running[key] = job
+
+            # Combine in the background so results are cached even if the
+            # session that asked has moved on
+            threading.Thread(target=_settle, args=(job,), daemon=True).start()
+            return job
+
+    def _job_finished(self, job):
+        with self._lock:
+            self._running.pop(job.key, None)
+            if not job.cancelled() and job._result is not None:
+                self._store(job.key, job._result)
+            self._evict_frames()
+
+    def _store(self, key, result):
+        self._results[key] = result
+        while len(self._results) > MAX_RESULTS:
+            self._results.popitem(last=False)
+
+    def shutdown(self):
+        with self._lock:
+            for job in list(self._running.values()):
+                job.cancel()
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+            for frame in self._frames.values():
+                frame.close()
+            self._frames.clear()
+
+
+def get_analytics_engine():
+    """Get the process-wide analytics engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AnalyticsEngine()
+        return _engine
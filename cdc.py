@@ -0,0 +1,193 @@
+import fcntl
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+# Local change-data-capture feed. Every change is one JSON record with a
+# feed-wide sequence number, appended to gzip-compressed JSONL segments:
+#   changes-000000000001.jsonl.gz, changes-000000052311.jsonl.gz, ...
+# Segments rotate by size and age; each is named after its first sequence
+# number, so a consumer resumes from its last seq by skipping whole files.
+# Several processes may append to the same directory; a lock file orders them.
+
+SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+SEGMENT_MAX_SECONDS = 3600
+# Never write secrets to the feed
+REDACTED_FIELDS = {'password', 'reset_code'}
+
+_SEGMENT_PATTERN = re.compile(r'^changes-(\d{12})\.jsonl\.gz$')
+
+
+def _jsonable(value, commit_time):
+    """Convert a written value, or its write-queue JSON form, to plain JSON"""
+    if value is firestore.SERVER_TIMESTAMP:
+        return commit_time
+    if value is firestore.DELETE_FIELD:
+        return {'$delete': True}
+    if isinstance(value, firestore.Increment):
+        return {'$increment': value.value}
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        if value.keys() == {'__sentinel__'}:
+            return commit_time if value['__sentinel__'] == 'server_timestamp' else {'$delete': True}
+        if value.keys() == {'__increment__'}:
+            return {'$increment': value['__increment__']}
+        if value.keys() == {'__datetime__'}:
+            return value['__datetime__']
+        return {
+            key: '***' if key in REDACTED_FIELDS else _jsonable(val, commit_time)
+            for key, val in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(val, commit_time) for val in value]
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def change_record(op, path, data=None, merge=False, commit_time=None, source='app', **extra):
+    """Build a feed record for one document write"""
+    commit_time = (commit_time or datetime.now(timezone.utc)).isoformat()
+    parts = path.split('/')
+    record = {
+        'ts': commit_time,
+        'op': op,
+        'path': path,
+        'collection': parts[-2],
+        'doc_id': parts[-1],
+        'source': source
+    }
+    if op != 'delete':
+        record['data'] = _jsonable(data or {}, commit_time)
+        record['merge'] = bool(merge)
+    record.update(extra)
+    return record
+
+
+class ChangeFeed:
+    """Append-only, rotating, gzip JSONL change log with sequence numbers"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self):
+        """List (first_seq, path) of every segment in sequence order"""
+        segments = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT_PATTERN.match(name)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def _read_state(self):
+        try:
+            with open(os.path.join(self.directory, 'sequence')) as state:
+                last_seq, segment_started = state.read().split()
+                return int(last_seq), float(segment_started)
+        except (FileNotFoundError, ValueError):
+            return 0, 0.0
+
+    def _write_state(self, last_seq, segment_started):
+        temp_path = os.path.join(self.directory, 'sequence.tmp')
+        with open(temp_path, 'w') as state:
+            state.write(f"{last_seq} {segment_started}")
+        os.replace(temp_path, os.path.join(self.directory, 'sequence'))
+
+    def append(self, records):
+        """Append records, assigning sequence numbers; returns the last one"""
+        if not records:
+            return None
+
+        with self._lock, open(os.path.join(self.directory, 'lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            last_seq, segment_started = self._read_state()
+            segments = self.segments()
+            now = time.time()
+
+            if (not segments or os.path.getsize(segments[-1][1]) >= SEGMENT_MAX_BYTES
+                    or now - segment_started >= SEGMENT_MAX_SECONDS):
+                path = os.path.join(self.directory, f"changes-{last_seq + 1:012d}.jsonl.gz")
+                segment_started = now
+            else:
+                path = segments[-1][1]
+
+            lines = []
+            for record in records:
+                last_seq += 1
+                lines.append(json.dumps(dict(record, seq=last_seq), default=str, separators=(',', ':')))
+
+            # Each append is one gzip member; concatenated members are a valid gzip file
+            with open(path, 'ab') as segment:
+                segment.write(gzip.compress(('\n'.join(lines) + '\n').encode('utf-8')))
+                segment.flush()
+                os.fsync(segment.fileno())
+            self._write_state(last_seq, segment_started)
+            return last_seq
+
+    def read(self, after_seq=0):
+        """Yield the records with a sequence number above after_seq, oldest first"""
+        segments = self.segments()
+        for index, (first_seq, path) in enumerate(segments):
+            # Skip segments that end before the cursor
+            if index + 1 < len(segments) and segments[index + 1][0] <= after_seq + 1:
+                continue
+            try:
+                with gzip.open(path, 'rt', encoding='utf-8') as segment:
+                    for line in segment:
+                        record = json.loads(line)
+                        if record['seq'] > after_seq:
+                            yield record
+            except (EOFError, gzip.BadGzipFile):
+                # The newest member of the active segment is still being written
+                return
+
+    def last_seq(self):
+        return self._read_state()[0]
+
+
+def watch_changes(db, feed, stop_event):
+    """Record changes made anywhere (console, other services) until stop_event is set.
+
+    Listens to every inventory collection and the users collection. Each
+    listener's first snapshot is the current state and is skipped. Changes
+    this app made itself are recorded again with source 'watch'; their ts
+    is the document update time, so (path, ts) matches the app's record.
+    """
+    def listener():
+        seen_initial = False
+
+        def on_snapshot(_, changes, read_time):
+            nonlocal seen_initial
+            # Each listener's first snapshot is the current state, not changes
+            if not seen_initial:
+                seen_initial = True
+                return
+            records = []
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    records.append(change_record('delete', doc.reference.path, commit_time=read_time, source='watch'))
+                else:
+                    records.append(change_record('set', doc.reference.path, doc.to_dict(), commit_time=doc.update_time, source='watch'))
+            feed.append(records)
+
+        return on_snapshot
+
+    watches = [
+        db.collection_group('inventory').on_snapshot(listener()),
+        db.collection('users').on_snapshot(listener())
+    ]
+    try:
+        stop_event.wait()
+    finally:
+        for watch in watches:
+            watch.unsubscribe()
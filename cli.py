@@ -0,0 +1,434 @@
+import argparse
+import hmac
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from firebase_config import (
+    ALL_LOCATIONS, DEFAULT_LOCATION, DEFAULT_TENANT, TENANT_ENV, STOCK_MOVEMENT_TYPES, LOCAL_DATA_DIR,
+    get_db, get_write_queue, get_change_feed, set_process_tenant, create_tenant, backfill_user_tenants,
+    get_read_metrics, get_shared_cache, drain_writes
+)
+from cdc import watch_changes
+from read_governor import read_exported_metrics
+import inventory_api
+from forecasting import FORECAST_WINDOW_DAYS, run_forecast
+from valuation import take_valuation_snapshot, roll_up_valuations
+
+# Headless entry point for integrations (POS sync, supplier feeds):
+#   python cli.py list --location main > items.ndjson
+#   python cli.py upsert --location main items.ndjson
+#   python cli.py serve --port 8600
+#   python cli.py --location __all__ forecast       (nightly cron)
+#   python cli.py valuation                         (daily cron)
+#   python cli.py --location dock scan --type receive < /dev/hidraw0
+#   python cli.py feed tail --after 1200 --follow  (incremental changes)
+#   python cli.py --tenant acme list                (another organization's data)
+# Records are newline-delimited JSON on stdin/stdout and over HTTP.
+
+API_TOKEN_ENV = 'INVENTORY_API_TOKEN'
+
+
+def _dumps(record):
+    # Firestore timestamps and other non-JSON values become strings
+    return json.dumps(record, default=str, separators=(',', ':'))
+
+
+def _parse_records(text):
+    """Parse NDJSON records, or a single JSON array"""
+    text = text.strip()
+    if not text:
+        return []
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _open_input(path):
+    return sys.stdin if path in (None, '-') else open(path, encoding='utf-8')
+
+
+def cmd_list(args):
+    fields = args.fields.split(',') if args.fields else None
+    for item in inventory_api.stream_items(args.location, fields):
+        sys.stdout.write(_dumps(item) + '\n')
+
+
+def cmd_get(args):
+    for item in inventory_api.get_items(args.location, args.ids):
+        sys.stdout.write(_dumps(item) + '\n')
+
+
+def cmd_upsert(args):
+    with _open_input(args.file) as stream:
+        items = _parse_records(stream.read())
+    ids, status = inventory_api.upsert_items(items, args.location, args.user, args.key)
+    print(_dumps({'upserted': len(ids), 'ids': ids, 'status': status}))
+
+
+def cmd_adjust(args):
+    with _open_input(args.file) as stream:
+        adjustments = _parse_records(stream.read())
+    applied, status = inventory_api.adjust_items(adjustments, args.location, args.user, args.key)
+    print(_dumps({'applied': applied, 'status': status}))
+
+
+def cmd_scan(args):
+    # Codes are resolved from an in-memory index built once; a miss (an item
+    # added since) falls back to the SKU index document
+    index = {
+        item['sku']: item['id']
+        for item in inventory_api.stream_items(args.location, ['sku']) if item.get('sku')
+    }
+    print(f"Ready: {len(index)} SKUs indexed", file=sys.stderr)
+
+    for line in sys.stdin:
+        sku = line.strip()
+        if not sku:
+            continue
+        item_id = index.get(sku)
+        if item_id is None:
+            item = inventory_api.get_item_by_sku(args.location, sku)
+            if item is None:
+                print(_dumps({'sku': sku, 'error': 'unknown SKU'}), flush=True)
+                continue
+            item_id = index[sku] = item['id']
+
+        adjustment = {'id': item_id, 'type': args.type, 'quantity': args.quantity, 'reason': 'scan'}
+        applied, status = inventory_api.adjust_items([adjustment], args.location, args.user)
+        print(_dumps({'sku': sku, 'id': item_id, 'applied': applied, 'status': status}), flush=True)
+
+
+def cmd_forecast(args):
+    alerts, status = run_forecast(args.location, args.window_days)
+    print(_dumps({'reorder_now': alerts, 'status': status}))
+
+
+def cmd_valuation(args):
+    result = {}
+    if not args.rollup_only:
+        valuation = take_valuation_snapshot()
+        result.update(date=valuation['date'], total_value=valuation['total_value'],
+                      total_quantity=valuation['total_quantity'])
+    result['rolled_up'], result['status'] = roll_up_valuations()
+    print(_dumps(result))
+
+
+def cmd_feed_tail(args):
+    feed = get_change_feed()
+    after = args.after
+    while True:
+        for record in feed.read(after):
+            sys.stdout.write(_dumps(record) + '\n')
+            after = record['seq']
+        sys.stdout.flush()
+        if not args.follow:
+            return
+        time.sleep(args.interval)
+
+
+def cmd_feed_watch(args):
+    stop = threading.Event()
+    print("Recording external changes; Ctrl+C to stop", file=sys.stderr)
+    try:
+        watch_changes(get_db(), get_change_feed(), stop)
+    except KeyboardInterrupt:
+        stop.set()
+
+
+def cmd_tenant_create(args):
+    created = create_tenant(args.id, args.name or args.id, args.daily_reads)
+    print(_dumps({'created': created, 'tenant': args.id}))
+
+
+def cmd_tenant_backfill(args):
+    print(_dumps({'users_assigned': backfill_user_tenants(), 'tenant': DEFAULT_TENANT}))
+
+
+def cmd_delete(args):
+    ids = args.ids
+    if not ids or ids == ['-']:
+        ids = [line.strip() for line in sys.stdin if line.strip()]
+    deleted, status = inventory_api.delete_items(ids, args.location, args.key)
+    print(_dumps({'deleted': deleted, 'status': status}))
+
+
+BREAKER_STATES = ('closed', 'open', 'half_open')
+
+
+def metrics_text():
+    """Render the read governor counters of every process on this host, and the shared cache's size, as Prometheus text"""
+    processes = {(metrics['host'], metrics['pid']): metrics
+                 for metrics in read_exported_metrics(os.path.join(LOCAL_DATA_DIR, 'metrics'))}
+    own = get_read_metrics()
+    processes[(own['host'], own['pid'])] = own
+
+    lines = [
+        "# HELP inventory_read_breaker_state 1 for the read circuit breaker's current state",
+        "# TYPE inventory_read_breaker_state gauge",
+        "# HELP inventory_read_breaker_opened_total Times the read circuit breaker opened",
+        "# TYPE inventory_read_breaker_opened_total counter",
+        "# HELP inventory_read_events_total Governed read outcomes (stale_<reason>, deadline_exceeded, read_errors, late_reads) and shared cache use (shared_<hits|refreshes|waits|...>)",
+        "# TYPE inventory_read_events_total counter",
+        "# HELP inventory_stale_served_total Results served from the last read instead of reading, per tenant",
+        "# TYPE inventory_stale_served_total counter",
+    ]
+    for (host, pid), metrics in sorted(processes.items()):
+        labels = f'host="{host}",pid="{pid}"'
+        for state in BREAKER_STATES:
+            lines.append(f'inventory_read_breaker_state{{{labels},state="{state}"}} {int(metrics["breaker_state"] == state)}')
+        lines.append(f'inventory_read_breaker_opened_total{{{labels}}} {metrics["breaker_opened_total"]}')
+        for event, count in sorted(metrics['events'].items()):
+            lines.append(f'inventory_read_events_total{{{labels},event="{event}"}} {count}')
+        for tenant, count in sorted(metrics['stale_served'].items()):
+            lines.append(f'inventory_stale_served_total{{{labels},tenant="{tenant}"}} {count}')
+
+    shared = get_shared_cache().stats()
+    lines += [
+        "# HELP inventory_shared_cache_entries Entries in the host's shared cache",
+        "# TYPE inventory_shared_cache_entries gauge",
+        f"inventory_shared_cache_entries {shared['entries']}",
+        "# HELP inventory_shared_cache_bytes Size of the shared cache's values",
+        "# TYPE inventory_shared_cache_bytes gauge",
+        f"inventory_shared_cache_bytes {shared['bytes']}",
+        "# HELP inventory_shared_cache_refreshing Shared cache refreshes in progress",
+        "# TYPE inventory_shared_cache_refreshing gauge",
+        f"inventory_shared_cache_refreshing {shared['refreshing']}",
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+class InventoryRequestHandler(BaseHTTPRequestHandler):
+    """JSON/NDJSON inventory service.
+
+    GET  /health
+    GET  /metrics                                      Prometheus text (read breaker, stale results)
+    GET  /items?location=main[&fields=name,quantity]   streamed NDJSON
+    GET  /items/<id>?location=main
+    GET  /skus/<sku>?location=main                     item by SKU / barcode
+    POST /items/upsert?location=main                   NDJSON or JSON array body
+    POST /items/adjust?location=main
+    POST /items/delete?location=main                   ids as NDJSON strings or a JSON array
+    """
+
+    protocol_version = 'HTTP/1.1'
+    username = 'api'
+
+    def _params(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        params.setdefault('location', DEFAULT_LOCATION)
+        return url.path.rstrip('/'), params
+
+    def _authorized(self):
+        token = os.environ.get(API_TOKEN_ENV)
+        if not token:
+            return True
+        return hmac.compare_digest(self.headers.get('Authorization', ''), f"Bearer {token}")
+
+    def _send_json(self, status, payload):
+        body = _dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text, content_type='text/plain; version=0.0.4'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_ndjson(self, records):
+        """Send records as a chunked NDJSON response while they are read"""
+        # Pull the first record before committing to a 200 so connection
+        # errors still surface as a 500
+        records = iter(records)
+        first = next(records, None)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        buffer = []
+        size = 0
+        for record in itertools.chain([first] if first is not None else [], records):
+            line = (_dumps(record) + '\n').encode('utf-8')
+            buffer.append(line)
+            size += len(line)
+            if size >= 64 * 1024:
+                self._write_chunk(b''.join(buffer))
+                buffer, size = [], 0
+        if buffer:
+            self._write_chunk(b''.join(buffer))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return _parse_records(self.rfile.read(length).decode('utf-8'))
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._send_json(401, {'error': 'unauthorized'})
+
+        path, params = self._params()
+        try:
+            if path == '/health':
+                return self._send_json(200, {'status': 'ok', 'writes': get_write_queue().counts()})
+            if path == '/metrics':
+                return self._send_text(200, metrics_text())
+            if path == '/items':
+                fields = params['fields'].split(',') if params.get('fields') else None
+                return self._stream_ndjson(inventory_api.stream_items(params['location'], fields))
+            if path.startswith('/items/'):
+                items = inventory_api.get_items(params['location'], [path[len('/items/'):]])
+                if not items:
+                    return self._send_json(404, {'error': 'not found'})
+                return self._send_json(200, items[0])
+            if path.startswith('/skus/'):
+                item = inventory_api.get_item_by_sku(params['location'], unquote(path[len('/skus/'):]))
+                if item is None:
+                    return self._send_json(404, {'error': 'not found'})
+                return self._send_json(200, item)
+            return self._send_json(404, {'error': 'not found'})
+        except Exception as e:
+            return self._send_json(500, {'error': str(e)})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._send_json(401, {'error': 'unauthorized'})
+
+        path, params = self._params()
+        if params['location'] == ALL_LOCATIONS:
+            return self._send_json(400, {'error': 'writes need a single location'})
+
+        key = self.headers.get('Idempotency-Key')
+        try:
+            records = self._read_body()
+            if path == '/items/upsert':
+                ids, status = inventory_api.upsert_items(records, params['location'], self.username, key)
+                return self._send_json(200, {'upserted': len(ids), 'ids': ids, 'status': status})
+            if path == '/items/adjust':
+                applied, status = inventory_api.adjust_items(records, params['location'], self.username, key)
+                return self._send_json(200, {'applied': applied, 'status': status})
+            if path == '/items/delete':
+                deleted, status = inventory_api.delete_items(records, params['location'], key)
+                return self._send_json(200, {'deleted': deleted, 'status': status})
+            return self._send_json(404, {'error': 'not found'})
+        except (ValueError, KeyError) as e:
+            return self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            return self._send_json(500, {'error': str(e)})
+
+
+def cmd_serve(args):
+    InventoryRequestHandler.username = args.user
+    server = ThreadingHTTPServer((args.host, args.port), InventoryRequestHandler)
+    print(f"Serving inventory API on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless inventory operations")
+    parser.add_argument('--tenant', default=os.environ.get(TENANT_ENV, DEFAULT_TENANT),
+                        help=f"organization whose data is used (default: ${TENANT_ENV} or {DEFAULT_TENANT})")
+    parser.add_argument('--location', default=DEFAULT_LOCATION,
+                        help=f"location id, or {ALL_LOCATIONS} for every location (reads only)")
+    parser.add_argument('--user', default='api', help="recorded as created_by/updated_by")
+    parser.add_argument('--key', help="idempotency key; resubmitting the same key is a no-op")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help="stream items as NDJSON")
+    list_parser.add_argument('--fields', help="comma-separated fields to fetch")
+    list_parser.set_defaults(func=cmd_list)
+
+    get_parser = commands.add_parser('get', help="get items by id")
+    get_parser.add_argument('ids', nargs='+')
+    get_parser.set_defaults(func=cmd_get)
+
+    upsert_parser = commands.add_parser('upsert', help="create or update items from NDJSON")
+    upsert_parser.add_argument('file', nargs='?', default='-')
+    upsert_parser.set_defaults(func=cmd_upsert)
+
+    adjust_parser = commands.add_parser('adjust', help="apply {id, type, quantity, reason} stock movements")
+    adjust_parser.add_argument('file', nargs='?', default='-')
+    adjust_parser.set_defaults(func=cmd_adjust)
+
+    delete_parser = commands.add_parser('delete', help="delete items by id (or ids on stdin)")
+    delete_parser.add_argument('ids', nargs='*')
+    delete_parser.set_defaults(func=cmd_delete)
+
+    scan_parser = commands.add_parser('scan', help="apply one stock movement per SKU read from stdin")
+    scan_parser.add_argument('--type', choices=STOCK_MOVEMENT_TYPES, default='receive')
+    scan_parser.add_argument('--quantity', type=int, default=1, help="units per scan")
+    scan_parser.set_defaults(func=cmd_scan)
+
+    forecast_parser = commands.add_parser('forecast', help="recompute demand forecasts and reorder points")
+    forecast_parser.add_argument('--window-days', type=int, default=FORECAST_WINDOW_DAYS)
+    forecast_parser.set_defaults(func=cmd_forecast)
+
+    valuation_parser = commands.add_parser('valuation', help="store today's valuation and roll up old ones")
+    valuation_parser.add_argument('--rollup-only', action='store_true')
+    valuation_parser.set_defaults(func=cmd_valuation)
+
+    feed_parser = commands.add_parser('feed', help="read or extend the local change feed")
+    feed_commands = feed_parser.add_subparsers(dest='feed_command', required=True)
+    tail_parser = feed_commands.add_parser('tail', help="print changes after a sequence number as NDJSON")
+    tail_parser.add_argument('--after', type=int, default=0)
+    tail_parser.add_argument('--follow', action='store_true', help="keep printing new changes")
+    tail_parser.add_argument('--interval', type=float, default=1.0)
+    tail_parser.set_defaults(func=cmd_feed_tail)
+    watch_parser = feed_commands.add_parser('watch', help="record changes made outside this app")
+    watch_parser.set_defaults(func=cmd_feed_watch)
+
+    tenant_parser = commands.add_parser('tenant', help="manage organizations")
+    tenant_commands = tenant_parser.add_subparsers(dest='tenant_command', required=True)
+    create_parser = tenant_commands.add_parser('create', help="create an organization")
+    create_parser.add_argument('id')
+    create_parser.add_argument('--name')
+    create_parser.add_argument('--daily-reads', type=int, help="daily read budget per server process")
+    create_parser.set_defaults(func=cmd_tenant_create)
+    backfill_parser = tenant_commands.add_parser('backfill-users', help=f"assign users without one to {DEFAULT_TENANT}")
+    backfill_parser.set_defaults(func=cmd_tenant_backfill)
+
+    serve_parser = commands.add_parser('serve', help="run the local HTTP/JSON service")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8600)
+    serve_parser.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    set_process_tenant(args.tenant)
+    if args.command in ('upsert', 'adjust', 'delete', 'scan') and args.location == ALL_LOCATIONS:
+        print("Writes need a single --location", file=sys.stderr)
+        return 2
+    args.func(args)
+    # The flusher is a daemon thread, so flush here rather than leave writes for the next run
+    pending = drain_writes()
+    if pending:
+        print(f"{pending} write groups are still queued; the next command or server start flushes them", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,403 @@
+import copy
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud.firestore_v1 import transforms
+
+# In-memory stand-in for the parts of the Firestore client this app uses,
+# for load tests. Every RPC sleeps for the configured latency and is
+# counted; reads are billed the way Firestore bills them (one per document
+# returned, at least one per query). Transactions are not supported.
+
+COUNT_ENTRIES_PER_READ = 1000
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _get_field(data, field_path):
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+
+def _apply_value(target, key, value, now):
+    """Write one field, resolving server-side transforms"""
+    if value is transforms.SERVER_TIMESTAMP:
+        target[key] = now
+    elif value is transforms.DELETE_FIELD:
+        target.pop(key, None)
+    elif isinstance(value, transforms.Increment):
+        current = target.get(key)
+        target[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+    else:
+        target[key] = copy.deepcopy(value)
+
+
+def _merge(target, data, now):
+    for key, value in data.items():
+        if isinstance(value, dict) and value:
+            child = target.get(key)
+            if not isinstance(child, dict):
+                child = target[key] = {}
+            _merge(child, value, now)
+        else:
+            _apply_value(target, key, value, now)
+
+
+def _set_path(target, field_path, value, now):
+    parts = field_path.split('.')
+    for part in parts[:-1]:
+        child = target.get(part)
+        if not isinstance(child, dict):
+            child = target[part] = {}
+        target = child
+    _apply_value(target, parts[-1], value, now)
+
+
+def _matches(value, op, expected):
+    if op == '==':
+        return value == expected
+    if op == '!=':
+        return value != expected
+    if op == 'in':
+        return value in expected
+    if op == 'not-in':
+        return value not in expected
+    if op == 'array_contains':
+        return isinstance(value, list) and expected in value
+    try:
+        if op == '<':
+            return value < expected
+        if op == '<=':
+            return value <= expected
+        if op == '>':
+            return value > expected
+        if op == '>=':
+            return value >= expected
+    except TypeError:
+        # Firestore only compares values of the same type
+        return False
+    raise ValueError(f"Unsupported operator {op}")
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return copy.deepcopy(_get_field(self._data or {}, field_path))
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeCollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def collection(self, collection_id):
+        return FakeCollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._get(self, field_paths)
+
+    def create(self, document_data):
+        batch = self._client.batch()
+        batch.create(self, document_data)
+        batch.commit()
+
+    def set(self, document_data, merge=False):
+        batch = self._client.batch()
+        batch.set(self, document_data, merge=merge)
+        batch.commit()
+
+    def update(self, field_updates):
+        batch = self._client.batch()
+        batch.update(self, field_updates)
+        batch.commit()
+
+    def delete(self):
+        batch = self._client.batch()
+        batch.delete(self)
+        batch.commit()
+
+
+class FakeAggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class FakeCountQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        count = len(self._query._run(bill=False))
+        self._query._client._rpc('aggregations', max(1, -(-count // COUNT_ENTRIES_PER_READ)))
+        return [[FakeAggregationResult(self._alias or 'field_1', count)]]
+
+
+class FakeQuery:
+    def __init__(self, client, parent_path=None, group_id=None, filters=(), orders=(), limit=None, projection=None):
+        self._client = client
+        self._parent_path = parent_path
+        self._group_id = group_id
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._projection = projection
+
+    def _copy(self, **changes):
+        fields = dict(
+            parent_path=self._parent_path, group_id=self._group_id, filters=self._filters,
+            orders=self._orders, limit=self._limit, projection=self._projection
+        )
+        fields.update(changes)
+        return FakeQuery(self._client, **fields)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction == 'DESCENDING'),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def count(self, alias=None):
+        return FakeCountQuery(self, alias)
+
+    def _in_scope(self, path):
+        parent, _ = path.rsplit('/', 1)
+        if self._group_id is not None:
+            return parent.rsplit('/', 1)[-1] == self._group_id
+        return parent == self._parent_path
+
+    def _run(self, bill=True):
+        with self._client._lock:
+            rows = [
+                (path, document) for path, document in self._client._documents.items()
+                if self._in_scope(path)
+            ]
+            results = []
+            for path, document in rows:
+                data = document['data']
+                try:
+                    if not all(_matches(_get_field(data, field), op, value) for field, op, value in self._filters):
+                        continue
+                    keys = [_get_field(data, field) for field, _ in self._orders]
+                except KeyError:
+                    # Documents missing a filtered or ordered field are not indexed
+                    continue
+                results.append((keys, path, document))
+
+        for index in reversed(range(len(self._orders))):
+            descending = self._orders[index][1]
+            results.sort(key=lambda row: row[0][index], reverse=descending)
+        if not self._orders:
+            results.sort(key=lambda row: row[1])
+        if self._limit is not None:
+            results = results[:self._limit]
+
+        snapshots = []
+        for _, path, document in results:
+            data = copy.deepcopy(document['data'])
+            if self._projection is not None:
+                data = {field: data[field] for field in self._projection if field in data}
+            snapshots.append(FakeDocumentSnapshot(
+                FakeDocumentReference(self._client, path), data, document['create_time'], document['update_time']
+            ))
+        if bill:
+            self._client._rpc('reads', max(1, len(snapshots)))
+        return snapshots
+
+    def stream(self, transaction=None):
+        return iter(self._run())
+
+    def get(self, transaction=None):
+        return self._run()
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, path):
+        super().__init__(client, parent_path=path)
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        if '/' not in self.path:
+            return None
+        return FakeDocumentReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._client, f"{self.path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        reference.create(document_data)
+        return self._client._documents[reference.path]['update_time'], reference
+
+    def list_documents(self, page_size=None):
+        # Like Firestore, includes "missing" documents that only have subcollections
+        prefix = f"{self.path}/"
+        with self._client._lock:
+            ids = {path[len(prefix):].split('/', 1)[0] for path in self._client._documents if path.startswith(prefix)}
+        self._client._rpc('list_calls', 1)
+        return [self.document(document_id) for document_id in sorted(ids)]
+
+
+class FakeWriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, False))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(('update', reference, field_updates, False))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self):
+        return self._client._commit(self._writes)
+
+
+class FakeFirestore:
+    """Thread-safe in-memory Firestore client with latency and operation counters"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.counts = Counter()
+        self._documents = {}
+        self._lock = threading.RLock()
+
+    def _rpc(self, kind, amount):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.counts['rpcs'] += 1
+            self.counts[kind] += amount
+
+    def collection(self, path):
+        return FakeCollectionReference(self, path)
+
+    def collection_group(self, collection_id):
+        return FakeQuery(self, group_id=collection_id)
+
+    def document(self, path):
+        return FakeDocumentReference(self, path)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        raise NotImplementedError("Transactions are not supported by the fake client")
+
+    def _get(self, reference, field_paths=None):
+        self._rpc('reads', 1)
+        return self._snapshot(reference, field_paths)
+
+    def _snapshot(self, reference, field_paths=None):
+        with self._lock:
+            document = self._documents.get(reference.path)
+            if document is None:
+                return FakeDocumentSnapshot(reference, None)
+            data = copy.deepcopy(document['data'])
+        if field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        return FakeDocumentSnapshot(reference, data, document['create_time'], document['update_time'])
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._rpc('reads', max(1, len(references)))
+        return [self._snapshot(reference, field_paths) for reference in references]
+
+    def _commit(self, writes):
+        self._rpc('commits', 1)
+        with self._lock:
+            now = _now()
+            # Validate first so a batch applies all or nothing
+            for op, reference, _, _ in writes:
+                exists = reference.path in self._documents
+                if op == 'create' and exists:
+                    raise api_exceptions.AlreadyExists(f"Document already exists: {reference.path}")
+                if op == 'update' and not exists:
+                    raise api_exceptions.NotFound(f"No document to update: {reference.path}")
+
+            for op, reference, data, merge in writes:
+                self.counts['deletes' if op == 'delete' else 'writes'] += 1
+                if op == 'delete':
+                    self._documents.pop(reference.path, None)
+                    continue
+
+                document = self._documents.get(reference.path)
+                if document is None or (op in ('create', 'set') and not merge):
+                    current = {}
+                    create_time = document['create_time'] if document else now
+                else:
+                    current = document['data']
+                    create_time = document['create_time']
+
+                if op == 'update':
+                    for field_path, value in data.items():
+                        _set_path(current, field_path, value, now)
+                else:
+                    _merge(current, data, now)
+                self._documents[reference.path] = {'data': current, 'create_time': create_time, 'update_time': now}
+        return [FakeWriteResult(now) for _ in writes]
@@ -5,16 +5,83 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import random
+import copy
 import string
 import hashlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from google.api_core import exceptions as api_exceptions
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from write_queue import WriteQueue
+from cdc import ChangeFeed, change_record
+from models import decode_item, decode_user
+from shared_cache import SharedCache
+from read_governor import (
+    ReadGovernor, ReadUnavailable, TokenBucket, PeerWait,
+    SESSION_READS_PER_MINUTE, SESSION_BURST_READS, READ_DEADLINE_SECONDS, FIRST_READ_DEADLINE_SECONDS
+)
+
+# Inventory is partitioned per location under locations/{location}/inventory
+DEFAULT_LOCATION = 'main'
+ALL_LOCATIONS = '__all__'
+LOW_STOCK_THRESHOLD = 10
+
+# Local state (write queue, caches) lives here; one directory per host
+LOCAL_DATA_DIR = os.environ.get('INVENTORY_DATA_DIR', '.inventory_data')
+# How long a write handler waits for the queue to reach Firestore before returning
+WRITE_WAIT_SECONDS = 1.0
+# How long bulk and headless operations wait for all of their groups
+BULK_WAIT_SECONDS = 30.0
+FIELD_UPDATE_CHUNK_SIZE = 450
+# Deleted item ids are kept this long so snapshots can sync deletes by delta
+TOMBSTONE_RETENTION_DAYS = 30
+# A governed read another server process made this recently is shared, not
+# repeated, unless a write to the tenant has landed since
+SHARED_READ_SECONDS = 5
+
+# Organizations: the default tenant keeps the original root layout, every
+# other tenant's locations live under tenants/{tenant}/locations. Users stay
+# in one collection (usernames are global for login) with a tenant field.
+DEFAULT_TENANT = 'default'
+TENANT_ENV = 'INVENTORY_TENANT'
+# Estimated document reads a tenant may spend per day, per server process,
+# unless its tenant document sets daily_read_budget
+DEFAULT_DAILY_READ_BUDGET = 2_000_000
+TENANT_CACHE_SECONDS = 300
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+_change_feed = None
+_shared_cache = None
+_process_tenant = os.environ.get(TENANT_ENV, DEFAULT_TENANT)
+_tenant_reads = {}
+_tenant_budgets = {}
+_tenant_lock = threading.Lock()
+_thread_tenant = threading.local()
+# The groups this thread submitted that it has not yet reflected locally
+_local_writes = threading.local()
+# The reads this thread is counting for a session or a governed read (see counting_reads)
+_read_counter = threading.local()
+_read_governor = ReadGovernor(os.path.join(LOCAL_DATA_DIR, 'metrics'))
+
+def _has_firebase_secrets():
+    """Check for Firebase credentials in Streamlit secrets without requiring a secrets file"""
+    try:
+        return hasattr(st, 'secrets') and 'firebase' in st.secrets
+    except FileNotFoundError:
+        return False
 
 def initialize_firebase():
     """Initialize Firebase connection"""
     if not firebase_admin._apps:
         try:
             # Try to get credentials from Streamlit secrets (for deployment)
-            if hasattr(st, 'secrets') and 'firebase' in st.secrets:
+            if _has_firebase_secrets():
                 # Convert secrets to dict for credentials
                 firebase_secrets = {
                     "type": st.secrets["firebase"]["type"],
@@ -30,8 +97,8 @@ def initialize_firebase():
                 }
                 cred = credentials.Certificate(firebase_secrets)
             else:
-                # Use local credentials file for development
-                cred = credentials.Certificate('firebase-credentials.json')
+                # Use local credentials file for development and headless tools
+                cred = credentials.Certificate(os.environ.get('FIREBASE_CREDENTIALS', 'firebase-credentials.json'))
             
             firebase_admin.initialize_app(cred)
             return True  # Return True on success
@@ -59,8 +126,8 @@ def authenticate_user(username, password):
         docs = query.stream()
         
         for doc in docs:
-            user_data = doc.to_dict()
-            user_data['id'] = doc.id
+            user_data = decode_user(doc.to_dict(), doc.id).to_dict()
+            user_data.setdefault('tenant', DEFAULT_TENANT)
             return user_data
         return None
     except Exception as e:
@@ -79,8 +146,7 @@ def find_user_by_email(email):
         docs = query.stream()
         
         for doc in docs:
-            user_data = doc.to_dict()
-            user_data['id'] = doc.id
+            user_data = decode_user(doc.to_dict(), doc.id).to_dict()
             return user_data
         return None
     except Exception as e:
@@ -163,6 +229,7 @@ def store_reset_code(user_id, reset_code):
             'used': False
         }
         
+        # Reset codes are deliberately kept out of the change feed
         db.collection('password_resets').add(reset_data)
         return True
     except Exception as e:
@@ -206,10 +273,13 @@ def update_user_password(user_id, new_password):
         return False
     
     try:
-        db.collection('users').document(user_id).update({
+        user_ref = db.collection('users').document(user_id)
+        data = {
             'password': new_password,
             'password_updated_at': firestore.SERVER_TIMESTAMP
-        })
+        }
+        user_ref.update(data)
+        record_changes([('update', user_ref, data, False)])
         return True
     except Exception as e:
         st.error(f"Error updating password: {e}")
@@ -234,11 +304,13 @@ def create_pending_user(user_data):
     
     try:
         # Add timestamp
+        user_data.setdefault('tenant', get_active_tenant())
         user_data['created_at'] = firestore.SERVER_TIMESTAMP
         user_data['last_updated'] = firestore.SERVER_TIMESTAMP
         
         # Add user to Firestore
-        db.collection('users').add(user_data)
+        _, user_ref = db.collection('users').add(user_data)
+        record_changes([('create', user_ref, user_data, False)])
         return True
     except Exception as e:
         st.error(f"Error creating user: {e}")
@@ -282,13 +354,12 @@ def get_pending_users():
     
     try:
         users_ref = db.collection('users')
-        query = users_ref.where('status', '==', 'pending')
+        query = users_ref.where('tenant', '==', get_active_tenant()).where('status', '==', 'pending')
         docs = query.stream()
         
         users = []
         for doc in docs:
-            user_data = doc.to_dict()
-            user_data['id'] = doc.id
+            user_data = decode_user(doc.to_dict(), doc.id).to_dict()
             users.append(user_data)
         
         return users
@@ -303,10 +374,13 @@ def approve_user(user_id):
         return False
     
     try:
-        db.collection('users').document(user_id).update({
+        user_ref = db.collection('users').document(user_id)
+        data = {
             'status': 'approved',
             'approved_at': firestore.SERVER_TIMESTAMP
-        })
+        }
+        user_ref.update(data)
+        record_changes([('update', user_ref, data, False)])
         return True
     except Exception as e:
         st.error(f"Error approving user: {e}")
@@ -319,10 +393,13 @@ def reject_user(user_id):
         return False
     
     try:
-        db.collection('users').document(user_id).update({
+        user_ref = db.collection('users').document(user_id)
+        data = {
             'status': 'rejected',
             'rejected_at': firestore.SERVER_TIMESTAMP
-        })
+        }
+        user_ref.update(data)
+        record_changes([('update', user_ref, data, False)])
         return True
     except Exception as e:
         st.error(f"Error rejecting user: {e}")
@@ -346,3 +423,1403 @@ def cleanup_expired_reset_codes():
     except Exception as e:
         st.error(f"Error cleaning up expired codes: {e}")
         return False
+
+def _read_recent_users(limit):
+    query = tenant_users(get_db()).order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
+    
+    users = []
+    for doc in query.stream():
+        user_data = decode_user(doc.to_dict(), doc.id).to_dict()
+        users.append(user_data)
+    charge_reads(len(users))
+    
+    return users
+
+def get_recent_users(limit=10):
+    """Get the most recently registered users"""
+    db = get_db()
+    if not db:
+        return []
+    
+    try:
+        return governed_read('recent_users', _read_recent_users, limit)
+    except Exception as e:
+        st.error(f"Error getting recent users: {e}")
+        return []
+
+# Durable write path
+
+def get_change_feed():
+    """Get the local change feed that every write is appended to"""
+    global _change_feed
+    with _write_queue_lock:
+        if _change_feed is None:
+            _change_feed = ChangeFeed(os.path.join(LOCAL_DATA_DIR, 'changes'))
+        return _change_feed
+
+def record_changes(writes, source='app', **extra):
+    """Append (op, document reference, data, merge) writes made directly, not through the queue, to the change feed"""
+    try:
+        get_change_feed().append([
+            change_record(op, ref.path, data, merge, source=source, **extra)
+            for op, ref, data, merge in writes
+        ])
+    except OSError as e:
+        st.warning(f"Change feed unavailable: {e}")
+
+def _write_version_key(tenant):
+    return f"write-version/{tenant}"
+
+def get_write_version(tenant=None):
+    """Get a token that changes when a queued write to a tenant commits on this host"""
+    entry = get_shared_cache().get(_write_version_key(tenant or get_active_tenant()))
+    return entry.value if entry else ''
+
+def _record_queue_commit(flush_id, commit_time, writes):
+    get_change_feed().append([
+        change_record(op, path, data, merge, commit_time, source='queue', flush_id=flush_id)
+        for op, path, data, merge in writes
+    ])
+    # Reads shared before this batch no longer match the tenants it wrote
+    tenants = {path.split('/')[1] if path.startswith('tenants/') else DEFAULT_TENANT for _, path, _, _ in writes}
+    for tenant in tenants:
+        get_shared_cache().put(_write_version_key(tenant), flush_id)
+
+def get_write_queue():
+    """Get the process-wide durable write queue"""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue(os.path.join(LOCAL_DATA_DIR, 'write_queue.db'), get_db, _record_queue_commit)
+            # Writes left pending by a crashed server or an exited CLI command
+            if _write_queue.counts()['pending']:
+                _write_queue.start()
+        return _write_queue
+
+def get_shared_cache():
+    """Get the cache shared by the server processes on this host"""
+    global _shared_cache
+    with _write_queue_lock:
+        if _shared_cache is None:
+            _shared_cache = SharedCache(os.path.join(LOCAL_DATA_DIR, 'shared_cache.db'), _read_governor.count)
+        return _shared_cache
+
+def write_key(name):
+    """Get the idempotency key of the current submission of a form"""
+    nonce_key = f"{name}_write_nonce"
+    if nonce_key not in st.session_state:
+        st.session_state[nonce_key] = uuid.uuid4().hex
+    return f"{name}-{st.session_state[nonce_key]}"
+
+def rotate_write_key(name):
+    """Start a new submission of a form after the previous one was accepted"""
+    st.session_state[f"{name}_write_nonce"] = uuid.uuid4().hex
+
+def commit_writes(writes, key=None, wait=WRITE_WAIT_SECONDS):
+    """Queue a group of writes to be committed atomically.
+    
+    Writes are (op, document reference, data, merge) tuples. The group is
+    durable once this returns; it waits up to wait seconds for the flush and
+    returns the group's status (done or pending), or 'duplicate' when the
+    idempotency key was already submitted and not rejected. Raises when
+    Firestore rejects the group; submitting the same key again retries it.
+    """
+    if getattr(_local_writes, 'claimed', True):
+        # Chunks of one operation are reflected together
+        _local_writes.keys = []
+        _local_writes.claimed = False
+    queue = get_write_queue()
+    submitted = queue.submit([(op, ref.path, data, merge) for op, ref, data, merge in writes], key)
+    _local_writes.keys.append(submitted or key)
+    if submitted is None:
+        return 'duplicate'
+    key = submitted
+    
+    status = queue.wait(key, wait)
+    if status == 'failed':
+        raise RuntimeError("The database rejected the change")
+    return status
+
+def wait_for_writes(keys, timeout=BULK_WAIT_SECONDS):
+    """Wait for every submitted group; returns 'done' or the first other status"""
+    queue = get_write_queue()
+    for key in keys:
+        status = queue.wait(key, timeout)
+        if status != 'done':
+            return status
+    return 'done'
+
+def drain_writes(timeout=BULK_WAIT_SECONDS):
+    """Wait for the queue to flush before the process exits; returns the groups still pending"""
+    if _write_queue is None:
+        # This process never queued a write
+        return 0
+    return _write_queue.drain(timeout)
+
+def local_write_keys():
+    """Get the keys of the groups this thread is now reflecting locally.
+    
+    Consecutive commit_writes calls count as one operation until this is
+    called after them.
+    """
+    _local_writes.claimed = True
+    return tuple(getattr(_local_writes, 'keys', ()))
+
+def write_commit_time(keys):
+    """Get when the last of some groups was committed, or None while any is not done"""
+    queue = get_write_queue()
+    times = [queue.commit_time(key) for key in keys]
+    return max(times) if times and None not in times else None
+
+# Tenants
+
+def set_process_tenant(tenant):
+    """Set the tenant of callers without a session (CLI, HTTP service)"""
+    global _process_tenant
+    _process_tenant = tenant or DEFAULT_TENANT
+
+@contextmanager
+def tenant_scope(tenant):
+    """Make tenant the active one for this thread (background workers have no session)"""
+    previous = getattr(_thread_tenant, 'tenant', None)
+    _thread_tenant.tenant = tenant
+    try:
+        yield
+    finally:
+        _thread_tenant.tenant = previous
+
+def get_active_tenant():
+    """Get the tenant of the signed-in user, or of the process outside a session"""
+    scoped = getattr(_thread_tenant, 'tenant', None)
+    if scoped:
+        return scoped
+    
+    user = st.session_state.get('user') or {}
+    return user.get('tenant') or _process_tenant
+
+def tenant_root(db, tenant=None):
+    """Get what a tenant's collections hang off: the database itself for the default tenant"""
+    tenant = tenant or get_active_tenant()
+    if tenant == DEFAULT_TENANT:
+        return db
+    return db.collection('tenants').document(tenant)
+
+def locations_collection(db, tenant=None):
+    """Get the locations collection of a tenant (the active one by default)"""
+    return tenant_root(db, tenant).collection('locations')
+
+def tenant_users(db, tenant=None):
+    """Get a query over the users of a tenant"""
+    return db.collection('users').where('tenant', '==', tenant or get_active_tenant())
+
+def _read_user_count():
+    count = tenant_users(get_db()).count().get()[0][0].value
+    charge_reads(count // 1000 + 1)
+    return count
+
+def count_tenant_users():
+    """Count the users of the active tenant"""
+    db = get_db()
+    if not db:
+        return 0
+    
+    try:
+        return governed_read('user_count', _read_user_count)
+    except Exception as e:
+        st.error(f"Error counting users: {e}")
+        return 0
+
+def tenant_exists(tenant):
+    """Check that a tenant id names the default tenant or a created tenant"""
+    if tenant == DEFAULT_TENANT:
+        return True
+    db = get_db()
+    if not db or not tenant or '/' in tenant:
+        return False
+    return db.collection('tenants').document(tenant).get().exists
+
+def create_tenant(tenant, name, daily_read_budget=None):
+    """Create a tenant document; its data is created as it is used"""
+    db = get_db()
+    if not db:
+        return False
+    
+    try:
+        if not tenant or '/' in tenant or tenant == DEFAULT_TENANT:
+            raise ValueError(f"Invalid tenant id '{tenant}'")
+        tenant_ref = db.collection('tenants').document(tenant)
+        data = {'name': name, 'created_at': firestore.SERVER_TIMESTAMP}
+        if daily_read_budget:
+            data['daily_read_budget'] = daily_read_budget
+        tenant_ref.create(data)
+        record_changes([('create', tenant_ref, data, False)])
+        return True
+    except Exception as e:
+        st.error(f"Error creating tenant: {e}")
+        return False
+
+def backfill_user_tenants():
+    """Assign users created before tenants existed to the default tenant"""
+    db = get_db()
+    if not db:
+        return 0
+    
+    try:
+        writes = [
+            ('update', doc.reference, {'tenant': DEFAULT_TENANT}, False)
+            for doc in db.collection('users').stream()
+            if not (doc.to_dict() or {}).get('tenant')
+        ]
+        for start in range(0, len(writes), FIELD_UPDATE_CHUNK_SIZE):
+            commit_writes(writes[start:start + FIELD_UPDATE_CHUNK_SIZE], wait=0)
+        return len(writes)
+    except Exception as e:
+        st.error(f"Error assigning users to the default tenant: {e}")
+        return 0
+
+# Per-tenant read budgets. Reads are estimated the way Firestore bills them
+# (one per document returned, at least one per query) and counted per day
+# in this process.
+
+def _daily_read_budget(tenant):
+    cached = _tenant_budgets.get(tenant)
+    if cached and time.monotonic() - cached[1] < TENANT_CACHE_SECONDS:
+        return cached[0]
+    
+    budget = DEFAULT_DAILY_READ_BUDGET
+    db = get_db()
+    if db and tenant != DEFAULT_TENANT:
+        try:
+            snapshot = db.collection('tenants').document(tenant).get()
+            budget = (snapshot.to_dict() or {}).get('daily_read_budget', budget)
+        except Exception:
+            pass  # Keep the default until the tenant document can be read
+    _tenant_budgets[tenant] = (budget, time.monotonic())
+    return budget
+
+def charge_reads(count, tenant=None):
+    """Count reads against a tenant's daily budget and read bucket"""
+    tenant = tenant or get_active_tenant()
+    key = (tenant, datetime.utcnow().date())
+    with _tenant_lock:
+        _tenant_reads[key] = _tenant_reads.get(key, 0) + max(1, count)
+    _read_governor.tenant_bucket(tenant).consume(max(1, count))
+    note_reads(max(1, count))
+
+class ReadCount:
+    def __init__(self):
+        self.reads = 0
+
+@contextmanager
+def counting_reads():
+    """Count the reads this thread charges while active, and add them to any enclosing count.
+    
+    Reads made concurrently by other sessions or threads are not counted;
+    a thread that reads on this one's behalf reports them with note_reads.
+    """
+    outer = getattr(_read_counter, 'current', None)
+    counter = _read_counter.current = ReadCount()
+    try:
+        yield counter
+    finally:
+        _read_counter.current = outer
+        if outer is not None:
+            outer.reads += counter.reads
+
+def note_reads(count):
+    """Add reads already charged to the tenant (e.g. by a read-pool thread) to this thread's count"""
+    counter = getattr(_read_counter, 'current', None)
+    if counter is not None:
+        counter.reads += count
+
+def get_read_usage(tenant=None):
+    """Get (reads today, daily budget) of a tenant"""
+    tenant = tenant or get_active_tenant()
+    with _tenant_lock:
+        used = _tenant_reads.get((tenant, datetime.utcnow().date()), 0)
+    return used, _daily_read_budget(tenant)
+
+def read_budget_exhausted(tenant=None):
+    """Check whether a tenant has spent today's read budget"""
+    used, budget = get_read_usage(tenant)
+    return used >= budget
+
+# Read admission control (see read_governor.py): besides the daily budget,
+# reads are rate limited per session and per tenant. Reads that don't fit
+# serve their last result, and the page shows how old it is.
+
+def _session_read_bucket():
+    """Get this session's read bucket, or None outside a session (workers, CLI)"""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    if 'read_bucket' not in st.session_state:
+        st.session_state.read_bucket = TokenBucket(SESSION_READS_PER_MINUTE, SESSION_BURST_READS)
+    return st.session_state.read_bucket
+
+def charge_session_reads(count):
+    """Count reads against this session's read bucket"""
+    session_bucket = _session_read_bucket()
+    if session_bucket is not None:
+        session_bucket.consume(max(1, count))
+
+def note_stale_data(as_of):
+    """Record that this run shows data read at as_of rather than reading it again"""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return
+    shown = st.session_state.get('data_as_of')
+    if shown is None or as_of < shown:
+        st.session_state.data_as_of = as_of
+
+def reads_admitted(cost=1, tenant=None):
+    """Check whether a read of about cost documents fits the daily budget and the read buckets"""
+    tenant = tenant or get_active_tenant()
+    if read_budget_exhausted(tenant):
+        return False
+    return _read_governor.admits(tenant, _session_read_bucket(), cost)
+
+def _serve_stale(tenant, reason, cached):
+    result, _, as_of = cached
+    _read_governor.served_stale(tenant, reason)
+    note_stale_data(as_of)
+    return result
+
+def governed_read(name, fetch, *args, deadline=READ_DEADLINE_SECONDS):
+    """Get fetch(*args), or its last result for this tenant when it can't or shouldn't be read.
+    
+    The last result is served when the read is not admitted (see
+    reads_admitted), the circuit breaker is open, or the read fails or
+    misses its deadline; a late read still refreshes the last result. A
+    read's cost is estimated from the reads it charged when it last ran.
+    A result another server process read within SHARED_READ_SECONDS, with
+    no write to the tenant committed since, is used instead of reading.
+    Raises ReadUnavailable when there is nothing to serve.
+    """
+    tenant = get_active_tenant()
+    key = (tenant, name, args)
+    cached = _read_governor.cached(key)
+    if cached is not None and not reads_admitted(cached[1], tenant):
+        return _serve_stale(tenant, 'budget', cached)
+    if not _read_governor.breaker.allow():
+        if cached is not None:
+            return _serve_stale(tenant, 'breaker', cached)
+        raise ReadUnavailable("The database is not responding; try again shortly")
+    
+    timeout = deadline if cached is not None else FIRST_READ_DEADLINE_SECONDS
+    peer_wait = PeerWait()
+    
+    def read():
+        # Runs in the read pool, which has no session; the cost is this read's own.
+        # Waiting for another process's read never outlasts the caller's deadline
+        with tenant_scope(tenant), counting_reads() as counter:
+            result = get_shared_cache().get_or_refresh(f"read/{tenant}/{name}/{args!r}", lambda: fetch(*args),
+                                                       version=get_write_version(tenant), max_age=SHARED_READ_SECONDS,
+                                                       wait=timeout, on_wait=peer_wait.set)
+        return result, max(1, counter.reads)
+    
+    future = _read_governor.submit(key, read, peer_wait)
+    if cached is not None and getattr(future, 'timed_out', False):
+        # Already late for another caller; don't wait for it again. A probe
+        # that joined it didn't start a read, so the next caller may probe
+        _read_governor.breaker.release_probe()
+        return _serve_stale(tenant, 'deadline', cached)
+    try:
+        result, cost = future.result(timeout)
+    except FuturesTimeoutError:
+        _read_governor.missed_deadline(future)
+        if cached is not None:
+            return _serve_stale(tenant, 'deadline', cached)
+        raise ReadUnavailable("The database is too slow to answer; try again shortly")
+    except Exception:
+        if cached is not None:
+            return _serve_stale(tenant, 'error', cached)
+        raise
+    finally:
+        _read_governor.export_metrics()
+    
+    charge_session_reads(cost)
+    # Sessions that joined the same read each get their own copy
+    return copy.deepcopy(result)
+
+def read_breaker_allows():
+    """Check whether the read circuit breaker lets a read through"""
+    return _read_governor.breaker.allow()
+
+def submit_read(read, peer_wait=None):
+    """Run an ungoverned read in the read pool; returns its future.
+    
+    A read that may wait for another process's refresh reports it to
+    peer_wait (a PeerWait), so that wait doesn't count as a breaker failure.
+    """
+    return _read_governor.run(read, peer_wait)
+
+def new_peer_wait():
+    """Get a PeerWait to pass to submit_read and the shared cache"""
+    return PeerWait()
+
+def missed_read_deadline(future):
+    """Count a read from submit_read that missed its deadline as a breaker failure"""
+    _read_governor.missed_deadline(future)
+
+def record_read_outcome(succeeded, late=False):
+    """Report an ungoverned read's success or failure to the circuit breaker.
+    
+    A late read (one that missed its deadline) only decides a probe in progress.
+    """
+    if not succeeded:
+        _read_governor.count('read_errors')
+    if late:
+        _read_governor.breaker.record_late(succeeded)
+    elif succeeded:
+        _read_governor.breaker.record_success()
+    else:
+        _read_governor.breaker.record_failure()
+
+def release_read_probe():
+    """Let another caller probe the circuit breaker when the one allowed didn't read"""
+    _read_governor.breaker.release_probe()
+
+def record_stale_served(reason, tenant=None):
+    """Count data served from a local copy instead of being read"""
+    _read_governor.served_stale(tenant or get_active_tenant(), reason)
+
+def get_read_metrics():
+    """Get this process's read governor counters (breaker state, stale results served, ...)"""
+    return _read_governor.metrics()
+
+def get_read_allowance(tenant=None):
+    """Get what the tenant and this session may still read, and how often stale data was served"""
+    tenant = tenant or get_active_tenant()
+    used, budget = get_read_usage(tenant)
+    tenant_bucket = _read_governor.tenant_bucket(tenant)
+    session_bucket = _session_read_bucket()
+    return {
+        'daily_used': used,
+        'daily_budget': budget,
+        'tenant_available': max(0, int(tenant_bucket.available())),
+        'tenant_capacity': tenant_bucket.capacity,
+        'session_available': max(0, int(session_bucket.available())) if session_bucket else None,
+        'session_capacity': session_bucket.capacity if session_bucket else None,
+        'stale_served': _read_governor.stale_served[tenant],
+        'breaker_state': _read_governor.breaker.state()
+    }
+
+# Location-scoped inventory access
+
+def get_active_location():
+    """Get the location the current session is scoped to"""
+    if 'active_location' in st.session_state:
+        return st.session_state.active_location
+    
+    user = st.session_state.get('user') or {}
+    return user.get('location', DEFAULT_LOCATION)
+
+def location_label(location):
+    """Get a display label for a location id"""
+    if location == ALL_LOCATIONS:
+        return "🌐 All Locations"
+    return f"📍 {location}"
+
+def inventory_collection(db, location, tenant=None):
+    """Get the inventory collection of a single location"""
+    return locations_collection(db, tenant).document(location).collection('inventory')
+
+def inventory_queries(db, location, tenant=None):
+    """Get the inventory collections of one location, or of every location of the tenant.
+    
+    A collection group query would also span other tenants, so ALL_LOCATIONS
+    fans out over the tenant's locations instead.
+    """
+    tenant = tenant or get_active_tenant()
+    if location != ALL_LOCATIONS:
+        return [inventory_collection(db, location, tenant)]
+    
+    collections = [ref.collection('inventory') for ref in locations_collection(db, tenant).list_documents()]
+    if tenant == DEFAULT_TENANT:
+        # The pre-location root collection, until it is migrated
+        collections.append(db.collection('inventory'))
+    return collections
+
+def _stream_items(queries, order_by=None, limit=None):
+    """Read item dicts from several queries, merging results ordered descending by order_by"""
+    items = []
+    reads = 0
+    for query in queries:
+        docs = list(query.stream())
+        reads += max(1, len(docs))
+        items.extend(item_from_doc(doc) for doc in docs)
+    charge_reads(reads)
+    
+    if order_by:
+        items.sort(key=lambda item: item.get(order_by) or 0, reverse=True)
+    return items[:limit] if limit else items
+
+def record_from_doc(doc):
+    """Decode an inventory document snapshot into an InventoryItem record"""
+    parent = doc.reference.parent.parent
+    return decode_item(doc.to_dict(), doc.id, parent.id if parent else None)
+
+def item_from_doc(doc):
+    """Convert an inventory document snapshot to an item dict"""
+    return record_from_doc(doc).to_dict()
+
+def _item_ref(db, item):
+    """Get the document reference of an item dict"""
+    if item.get('location'):
+        return inventory_collection(db, item['location']).document(item['id'])
+    return db.collection('inventory').document(item['id'])
+
+def summary_change(old=None, new=None):
+    """Build the location summary update for an item going from old to new"""
+    count = 0
+    quantity = 0
+    value = 0.0
+    categories = {}
+    
+    for item, sign in ((old, -1), (new, 1)):
+        if not item:
+            continue
+        item_quantity = item.get('quantity', 0)
+        count += sign
+        quantity += sign * item_quantity
+        value += sign * item_quantity * item.get('price', 0.0)
+        category = item.get('category', 'Other')
+        categories[category] = categories.get(category, 0) + sign
+    
+    change = {
+        'item_count': firestore.Increment(count),
+        'total_quantity': firestore.Increment(quantity),
+        'total_value': firestore.Increment(value),
+        'last_updated': firestore.SERVER_TIMESTAMP
+    }
+    category_counts = {
+        category: firestore.Increment(delta)
+        for category, delta in categories.items() if delta
+    }
+    # An empty map in a merge would replace the stored counts
+    if category_counts:
+        change['category_counts'] = category_counts
+    return change
+
+def tombstone_write(db, item):
+    """Build the write recording an item's deletion for delta syncs"""
+    # expire_at drives a Firestore TTL policy on the tombstones collection group
+    return ('set', locations_collection(db).document(item['location']).collection('tombstones').document(item['id']), {
+        'deleted_at': firestore.SERVER_TIMESTAMP,
+        'expire_at': datetime.utcnow() + timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    }, False)
+
+# SKU / barcode index: locations/{location}/skus/{sku} holds the item id, so a
+# scanned code resolves with a direct document read instead of a query
+
+def normalize_sku(sku):
+    """Clean a typed or scanned SKU; returns None for a blank one"""
+    sku = str(sku or '').strip()
+    if not sku:
+        return None
+    if '/' in sku or sku in ('.', '..') or sku.startswith('__'):
+        raise ValueError(f"Invalid SKU '{sku}'")
+    return sku
+
+def sku_ref(db, location, sku):
+    """Get the index document of a SKU in a location"""
+    return locations_collection(db).document(location).collection('skus').document(sku)
+
+def claim_sku(db, location, sku, item_id):
+    """Reserve a SKU for an item, failing if another item of the location has it"""
+    ref = sku_ref(db, location, sku)
+    data = {'item_id': item_id, 'created_at': firestore.SERVER_TIMESTAMP}
+    try:
+        # create() is committed directly: the queue cannot fail a write for an existing document
+        ref.create(data)
+    except api_exceptions.AlreadyExists:
+        if (ref.get().to_dict() or {}).get('item_id') != item_id:
+            raise ValueError(f"SKU '{sku}' is already used by another item")
+        return
+    record_changes([('create', ref, data, False)])
+
+def release_sku_claims(db, claims):
+    """Free (location, sku, item_id) claims whose item write failed, if the item still holds them"""
+    for location, sku, item_id in claims:
+        ref = sku_ref(db, location, sku)
+        try:
+            if (ref.get().to_dict() or {}).get('item_id') == item_id:
+                ref.delete()
+                record_changes([('delete', ref, None, False)])
+        except Exception as e:
+            st.warning(f"Could not release SKU '{sku}': {e}")
+
+def release_sku_write(db, location, sku):
+    """Build the write freeing a SKU when its item is deleted or recoded"""
+    return ('delete', sku_ref(db, location, sku), None, False)
+
+def find_item_by_sku(location, sku):
+    """Get an item by SKU with two direct reads; returns None if unknown"""
+    db = get_db()
+    if not db:
+        return None
+    
+    try:
+        index = sku_ref(db, location, sku).get()
+        if not index.exists:
+            return None
+        doc = inventory_collection(db, location).document(index.get('item_id')).get()
+        return resolve_sharded_quantities([item_from_doc(doc)])[0] if doc.exists else None
+    except Exception as e:
+        st.error(f"Error looking up SKU: {e}")
+        return None
+
+def list_locations():
+    """Get the ids of all locations"""
+    db = get_db()
+    if not db:
+        return []
+    
+    try:
+        return sorted(ref.id for ref in locations_collection(db).list_documents())
+    except Exception as e:
+        st.error(f"Error listing locations: {e}")
+        return []
+
+def add_inventory_item(item_data, location, key=None):
+    """Add an item to a location and update the location summary; returns the new id"""
+    db = get_db()
+    if not db:
+        return None
+    
+    try:
+        item_ref = inventory_collection(db, location).document()
+        item_data = dict(
+            item_data,
+            location=location,
+            total_value=item_data.get('quantity', 0) * item_data.get('price', 0.0),
+            created_at=firestore.SERVER_TIMESTAMP,
+            last_updated=firestore.SERVER_TIMESTAMP
+        )
+        sku = normalize_sku(item_data.pop('sku', None))
+        claims = []
+        if sku:
+            claim_sku(db, location, sku, item_ref.id)
+            item_data['sku'] = sku
+            claims.append((location, sku, item_ref.id))
+        
+        try:
+            commit_writes([
+                ('set', item_ref, item_data, False),
+                ('set', locations_collection(db).document(location), summary_change(new=item_data), True)
+            ], key)
+        except Exception:
+            release_sku_claims(db, claims)
+            raise
+        return item_ref.id
+    except Exception as e:
+        st.error(f"Error adding item: {e}")
+        return None
+
+def update_inventory_item(item, updated_data, key=None):
+    """Update an item and adjust its location summary by the difference"""
+    db = get_db()
+    if not db:
+        return False
+    
+    try:
+        # Only write the fields that changed so concurrent edits of other fields survive
+        if 'sku' in updated_data:
+            updated_data = dict(updated_data, sku=normalize_sku(updated_data['sku']))
+        updated_data = {
+            key: value for key, value in updated_data.items()
+            if key == 'updated_by' or item.get(key) != value
+        }
+        new_item = dict(item, **updated_data)
+        if 'quantity' in updated_data or 'price' in updated_data:
+            updated_data['total_value'] = new_item.get('quantity', 0) * new_item.get('price', 0.0)
+        updated_data['last_updated'] = firestore.SERVER_TIMESTAMP
+        
+        writes = [('update', _item_ref(db, item), updated_data, False)]
+        claims = []
+        if 'sku' in updated_data and item.get('location'):
+            if updated_data['sku']:
+                claim_sku(db, item['location'], updated_data['sku'], item['id'])
+                claims.append((item['location'], updated_data['sku'], item['id']))
+            if item.get('sku'):
+                writes.append(release_sku_write(db, item['location'], item['sku']))
+        if item.get('location'):
+            writes.append(('set', locations_collection(db).document(item['location']), summary_change(old=item, new=new_item), True))
+        try:
+            commit_writes(writes, key)
+        except Exception:
+            release_sku_claims(db, claims)
+            raise
+        return True
+    except Exception as e:
+        st.error(f"Error updating item: {e}")
+        return False
+
+def delete_inventory_item(item, key=None):
+    """Delete an item and remove it from its location summary"""
+    db = get_db()
+    if not db:
+        return False
+    
+    try:
+        writes = [('delete', _item_ref(db, item), None, False)]
+        if item.get('location'):
+            writes.append(('set', locations_collection(db).document(item['location']), summary_change(old=item), True))
+            writes.append(tombstone_write(db, item))
+            if item.get('sku'):
+                writes.append(release_sku_write(db, item['location'], item['sku']))
+        commit_writes(writes, key)
+        return True
+    except Exception as e:
+        st.error(f"Error deleting item: {e}")
+        return False
+
+def update_item_fields(updates, key=None):
+    """Write derived fields that do not affect the location summary to many items.
+    
+    updates is a list of (item, fields) pairs; they are committed in
+    batched groups without waiting. Returns (items written, group keys) so
+    callers can wait for the groups with wait_for_writes.
+    """
+    db = get_db()
+    if not db:
+        return 0, []
+    
+    written = 0
+    keys = []
+    try:
+        key = key or uuid.uuid4().hex
+        for start in range(0, len(updates), FIELD_UPDATE_CHUNK_SIZE):
+            writes = [
+                ('update', _item_ref(db, item), dict(fields, last_updated=firestore.SERVER_TIMESTAMP), False)
+                for item, fields in updates[start:start + FIELD_UPDATE_CHUNK_SIZE]
+            ]
+            if commit_writes(writes, f"{key}-{start}", wait=0) != 'duplicate':
+                keys.append(f"{key}-{start}")
+            written += len(writes)
+        return written, keys
+    except Exception as e:
+        st.error(f"Error updating items: {e}")
+        return written, keys
+
+# Bulk edits and deletes
+
+BULK_ACTIONS = ['delete', 'category', 'price_percent', 'supplier']
+# Each item is one write (three for a delete: item, tombstone, SKU) plus
+# one coalesced summary write per location, within the 500 write limit
+BULK_EDIT_CHUNK_SIZE = 400
+BULK_DELETE_CHUNK_SIZE = 160
+
+def plan_bulk_edit(items, action, value=None):
+    """Compute a bulk edit locally as (item, changed fields) pairs, without writing.
+    
+    action is 'category', 'supplier' or 'price_percent' (value is the percent
+    change); items the edit would not change are left out.
+    """
+    changes = []
+    for item in items:
+        if action == 'price_percent':
+            fields = {'price': max(0.0, round(item.get('price', 0.0) * (1 + value / 100), 2))}
+        else:
+            fields = {action: value}
+        fields = {field: new for field, new in fields.items() if item.get(field) != new}
+        if fields:
+            changes.append((item, fields))
+    return changes
+
+def bulk_update_items(changes, username, key=None):
+    """Apply (item, fields) changes in chunked batches, keeping location summaries in step"""
+    db = get_db()
+    if not db:
+        return 0
+    
+    written = 0
+    try:
+        key = key or uuid.uuid4().hex
+        for start in range(0, len(changes), BULK_EDIT_CHUNK_SIZE):
+            chunk = changes[start:start + BULK_EDIT_CHUNK_SIZE]
+            writes = []
+            for item, fields in chunk:
+                new_item = dict(item, **fields)
+                data = dict(fields, last_updated=firestore.SERVER_TIMESTAMP, updated_by=username)
+                if 'quantity' in fields or 'price' in fields:
+                    data['total_value'] = new_item.get('quantity', 0) * new_item.get('price', 0.0)
+                writes.append(('update', _item_ref(db, item), data, False))
+                if item.get('location'):
+                    writes.append(('set', locations_collection(db).document(item['location']), summary_change(old=item, new=new_item), True))
+            # Only the last chunk waits; earlier ones flush while the rest are queued
+            last = start + BULK_EDIT_CHUNK_SIZE >= len(changes)
+            commit_writes(writes, f"{key}-{start}", wait=WRITE_WAIT_SECONDS if last else 0)
+            written += len(chunk)
+        return written
+    except Exception as e:
+        st.error(f"Error updating items: {e}")
+        return written
+
+def bulk_delete_items(items, key=None):
+    """Delete many items in chunked batches; returns the number deleted"""
+    db = get_db()
+    if not db:
+        return 0
+    
+    deleted = 0
+    try:
+        key = key or uuid.uuid4().hex
+        for start in range(0, len(items), BULK_DELETE_CHUNK_SIZE):
+            chunk = items[start:start + BULK_DELETE_CHUNK_SIZE]
+            writes = []
+            for item in chunk:
+                writes.append(('delete', _item_ref(db, item), None, False))
+                if item.get('location'):
+                    writes.append(('set', locations_collection(db).document(item['location']), summary_change(old=item), True))
+                    writes.append(tombstone_write(db, item))
+                    if item.get('sku'):
+                        writes.append(release_sku_write(db, item['location'], item['sku']))
+            last = start + BULK_DELETE_CHUNK_SIZE >= len(items)
+            commit_writes(writes, f"{key}-{start}", wait=WRITE_WAIT_SECONDS if last else 0)
+            deleted += len(chunk)
+        return deleted
+    except Exception as e:
+        st.error(f"Error deleting items: {e}")
+        return deleted
+
+# Stock adjustments
+
+STOCK_MOVEMENT_TYPES = ['receive', 'issue', 'adjust']
+ADJUSTMENT_CHUNK_SIZE = 200
+
+def movement_delta(movement_type, quantity):
+    """Get the signed quantity change of a stock movement"""
+    if movement_type == 'receive':
+        return abs(quantity)
+    if movement_type == 'issue':
+        return -abs(quantity)
+    return quantity
+
+def stock_adjustment_writes(db, adjustments, username):
+    """Build the writes for a chunk of stock movements; returns (writes, number applied)"""
+    writes = []
+    summaries = {}
+    applied = 0
+    
+    for adjustment in adjustments:
+        item = adjustment['item']
+        delta = movement_delta(adjustment['type'], adjustment['quantity'])
+        if delta == 0:
+            continue
+        
+        item_ref = _item_ref(db, item)
+        value_delta = delta * item.get('price', 0.0)
+        
+        if item.get('num_shards'):
+            # Hot SKUs spread increments over shards; fold_sharded_counter
+            # moves them into the item and its location summary
+            shard_ref = item_ref.collection('shards').document(str(random.randrange(item['num_shards'])))
+            writes.append(('set', shard_ref, {'quantity': firestore.Increment(delta)}, True))
+        else:
+            writes.append(('update', item_ref, {
+                'quantity': firestore.Increment(delta),
+                'total_value': firestore.Increment(value_delta),
+                'last_updated': firestore.SERVER_TIMESTAMP,
+                'updated_by': username
+            }, False))
+            if item.get('location'):
+                quantity_total, value_total = summaries.get(item['location'], (0, 0.0))
+                summaries[item['location']] = (quantity_total + delta, value_total + value_delta)
+        
+        movements = item_ref.parent.parent.collection('stock_movements') if item.get('location') else db.collection('stock_movements')
+        writes.append(('set', movements.document(), {
+            'item_id': item['id'],
+            'item_name': item.get('name'),
+            'type': adjustment['type'],
+            'delta': delta,
+            'reason': adjustment.get('reason', ''),
+            'created_by': username,
+            'created_at': firestore.SERVER_TIMESTAMP
+        }, False))
+        applied += 1
+    
+    for location, (quantity_total, value_total) in summaries.items():
+        writes.append(('set', locations_collection(db).document(location), {
+            'total_quantity': firestore.Increment(quantity_total),
+            'total_value': firestore.Increment(value_total),
+            'last_updated': firestore.SERVER_TIMESTAMP
+        }, True))
+    
+    return writes, applied
+
+def adjust_stock_batch(adjustments, username, key=None):
+    """Apply stock movements by delta with Increment, committing many items per batch.
+    
+    Each adjustment is a dict with 'item', 'type' (receive/issue/adjust),
+    'quantity' and an optional 'reason'. Returns the number applied.
+    """
+    db = get_db()
+    if not db:
+        return 0
+    
+    applied = 0
+    try:
+        # Each adjustment writes the item (or a shard) and a movement record,
+        # plus one summary write per location, within the 500 write limit
+        key = key or uuid.uuid4().hex
+        for start in range(0, len(adjustments), ADJUSTMENT_CHUNK_SIZE):
+            writes, chunk_applied = stock_adjustment_writes(db, adjustments[start:start + ADJUSTMENT_CHUNK_SIZE], username)
+            if writes:
+                commit_writes(writes, f"{key}-{start}")
+            applied += chunk_applied
+        
+        return applied
+    except Exception as e:
+        st.error(f"Error adjusting stock: {e}")
+        return applied
+
+def adjust_stock(item, movement_type, quantity, username, reason='', key=None):
+    """Apply a single stock movement by delta"""
+    adjustment = {'item': item, 'type': movement_type, 'quantity': quantity, 'reason': reason}
+    return adjust_stock_batch([adjustment], username, key) == 1
+
+# Cycle counts: counted quantities are compared with the quantities on hand
+# when the count started, and each difference is applied as an 'adjust'
+# movement with a variance record under
+# locations/{location}/cycle_counts/{count_id}/variances/{item_id}
+
+# Each variance writes the item (or a shard), a movement and a variance
+# record, plus one summary write per location per chunk
+CYCLE_COUNT_CHUNK_SIZE = 150
+
+def _cycle_count_ref(db, item, count_id):
+    parent = locations_collection(db).document(item['location']) if item.get('location') else db
+    return parent.collection('cycle_counts').document(count_id)
+
+def commit_cycle_count(count_id, counts, username, scope='', started_at=None, key=None):
+    """Apply a cycle count's variances as stock adjustments in batched groups.
+    
+    counts is a list of dicts with 'item', 'expected' and 'counted'; items
+    counted at their expected quantity are only included in the count's
+    summary. Returns the number of adjustments Firestore has committed;
+    committing the same key again retries the rest.
+    """
+    db = get_db()
+    if not db:
+        return 0
+    
+    variances = [dict(count, variance=count['counted'] - count['expected'])
+                 for count in counts if count['counted'] != count['expected']]
+    applied = 0
+    try:
+        key = key or uuid.uuid4().hex
+        groups = []
+        for start in range(0, len(variances), CYCLE_COUNT_CHUNK_SIZE):
+            chunk = variances[start:start + CYCLE_COUNT_CHUNK_SIZE]
+            writes, chunk_applied = stock_adjustment_writes(db, [
+                {'item': count['item'], 'type': 'adjust', 'quantity': count['variance'], 'reason': f"cycle count {count_id}"}
+                for count in chunk
+            ], username)
+            
+            totals = {}
+            for count in chunk:
+                item = count['item']
+                count_ref = _cycle_count_ref(db, item, count_id)
+                value_variance = count['variance'] * item.get('price', 0.0)
+                writes.append(('set', count_ref.collection('variances').document(item['id']), {
+                    'item_id': item['id'],
+                    'item_name': item.get('name'),
+                    'sku': item.get('sku'),
+                    'expected': count['expected'],
+                    'counted': count['counted'],
+                    'variance': count['variance'],
+                    'value_variance': value_variance,
+                    'counted_by': username,
+                    'created_at': firestore.SERVER_TIMESTAMP
+                }, False))
+                _, adjusted, quantity_total, value_total = totals.get(count_ref.path, (count_ref, 0, 0, 0.0))
+                totals[count_ref.path] = (count_ref, adjusted + 1, quantity_total + count['variance'], value_total + value_variance)
+            
+            for count_ref, adjusted, quantity_total, value_total in totals.values():
+                writes.append(('set', count_ref, {
+                    'items_adjusted': firestore.Increment(adjusted),
+                    'quantity_variance': firestore.Increment(quantity_total),
+                    'value_variance': firestore.Increment(value_total)
+                }, True))
+            commit_writes(writes, f"{key}-{start}", wait=0)
+            groups.append((f"{key}-{start}", chunk_applied))
+        
+        # The summary also records a count that found no differences
+        summaries = {}
+        for count in counts:
+            count_ref = _cycle_count_ref(db, count['item'], count_id)
+            summaries[count_ref.path] = (count_ref, summaries.get(count_ref.path, (None, 0))[1] + 1)
+        commit_writes([
+            ('set', count_ref, {
+                'scope': scope,
+                'items_counted': counted,
+                'counted_by': username,
+                'started_at': started_at,
+                'committed_at': firestore.SERVER_TIMESTAMP
+            }, True)
+            for count_ref, counted in summaries.values()
+        ], f"{key}-summary", wait=0)
+        
+        # Only chunks Firestore has committed count as applied
+        queue = get_write_queue()
+        statuses = []
+        for group_key, chunk_applied in groups:
+            status = queue.wait(group_key, WRITE_WAIT_SECONDS)
+            statuses.append(status)
+            if status == 'done':
+                applied += chunk_applied
+        if 'failed' in statuses:
+            raise RuntimeError("The database rejected some of the adjustments; commit again to retry them")
+        if 'pending' in statuses:
+            st.warning("Some adjustments are still being written; commit again to confirm them.")
+        return applied
+    except Exception as e:
+        st.error(f"Error committing cycle count: {e}")
+        return applied
+
+def enable_sharded_counter(item, num_shards=10):
+    """Spread an item's stock increments over shards to sustain concurrent writes"""
+    db = get_db()
+    if not db:
+        return False
+    
+    try:
+        commit_writes([('update', _item_ref(db, item), {'num_shards': num_shards}, False)])
+        return True
+    except Exception as e:
+        st.error(f"Error enabling sharded counter: {e}")
+        return False
+
+def _sharded_delta(item_ref):
+    """Sum the pending increments in an item's shards"""
+    return sum((doc.to_dict() or {}).get('quantity', 0) for doc in item_ref.collection('shards').stream())
+
+def resolve_sharded_quantities(items):
+    """Add pending shard increments to the quantity of sharded items"""
+    db = get_db()
+    if not db:
+        return items
+    
+    for item in items:
+        if item.get('num_shards'):
+            item['quantity'] = item.get('quantity', 0) + _sharded_delta(_item_ref(db, item))
+            item['total_value'] = item['quantity'] * item.get('price', 0.0)
+    return items
+
+def resolve_sharded_records(items):
+    """Add pending shard increments to the quantity of sharded InventoryItem records"""
+    sharded = [item.to_dict() for item in items if item.num_shards]
+    if not sharded:
+        return items
+    resolved = {item['id']: decode_item(item) for item in resolve_sharded_quantities(sharded)}
+    return [resolved.get(item.id, item) for item in items]
+
+def fold_sharded_counter(item):
+    """Move an item's shard increments into its quantity and location summary"""
+    db = get_db()
+    if not db:
+        return False
+    
+    try:
+        item_ref = _item_ref(db, item)
+        transaction = db.transaction()
+        
+        @firestore.transactional
+        def fold(transaction):
+            snapshot = item_ref.get(transaction=transaction)
+            shards = list(item_ref.collection('shards').stream(transaction=transaction))
+            delta = sum((doc.to_dict() or {}).get('quantity', 0) for doc in shards)
+            price = (snapshot.to_dict() or {}).get('price', 0.0)
+            
+            writes = [('update', item_ref, {
+                'quantity': firestore.Increment(delta),
+                'total_value': firestore.Increment(delta * price),
+                'last_updated': firestore.SERVER_TIMESTAMP
+            }, False)]
+            writes.extend(('delete', doc.reference, None, False) for doc in shards)
+            if item.get('location'):
+                writes.append(('set', locations_collection(db).document(item['location']), {
+                    'total_quantity': firestore.Increment(delta),
+                    'total_value': firestore.Increment(delta * price),
+                    'last_updated': firestore.SERVER_TIMESTAMP
+                }, True))
+            
+            for op, ref, data, merge in writes:
+                if op == 'delete':
+                    transaction.delete(ref)
+                elif op == 'update':
+                    transaction.update(ref, data)
+                else:
+                    transaction.set(ref, data, merge=merge)
+            return writes
+        
+        record_changes(fold(transaction))
+        return True
+    except Exception as e:
+        st.error(f"Error folding sharded counter: {e}")
+        return False
+
+def get_inventory_items(location, abc_classes=None):
+    """Get every item of a location, or of all locations, optionally only some ABC classes"""
+    db = get_db()
+    if not db:
+        return []
+    
+    try:
+        queries = inventory_queries(db, location)
+        if abc_classes:
+            queries = [query.where('abc_class', 'in', list(abc_classes)) for query in queries]
+        return resolve_sharded_quantities(_stream_items(queries))
+    except Exception as e:
+        st.error(f"Error loading inventory: {e}")
+        return []
+
+def _read_legacy_records():
+    docs = list(get_db().collection('inventory').stream())
+    charge_reads(len(docs))
+    return [record_from_doc(doc) for doc in docs]
+
+def get_legacy_inventory_records():
+    """Get the default tenant's items still in the pre-location root collection, as records.
+    
+    That collection has no tombstones to sync deletes from, so it is read
+    whole, through the read governor. Raises ReadUnavailable like
+    governed_read.
+    """
+    return governed_read('legacy_inventory', _read_legacy_records)
+
+def _read_recent_items(location, limit):
+    queries = [
+        query.order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
+        for query in inventory_queries(get_db(), location)
+    ]
+    return _stream_items(queries, 'created_at', limit)
+
+def get_recent_items(location, limit=5):
+    """Get the most recently added inventory items"""
+    db = get_db()
+    if not db:
+        return []
+    
+    try:
+        return governed_read('recent_items', _read_recent_items, location, limit)
+    except Exception as e:
+        st.error(f"Error getting recent items: {e}")
+        return []
+
+def _read_top_valuable_items(location, limit):
+    queries = [
+        query.order_by('total_value', direction=firestore.Query.DESCENDING).limit(limit)
+        for query in inventory_queries(get_db(), location)
+    ]
+    return _stream_items(queries, 'total_value', limit)
+
+def get_top_valuable_items(location, limit=5):
+    """Get the inventory items with the highest total value (quantity * price)"""
+    db = get_db()
+    if not db:
+        return []
+    
+    try:
+        return governed_read('top_valuable_items', _read_top_valuable_items, location, limit)
+    except Exception as e:
+        st.error(f"Error getting top valuable items: {e}")
+        return []
+
+def _read_low_stock_items(location, threshold):
+    return _stream_items([query.where('quantity', '<', threshold) for query in inventory_queries(get_db(), location)])
+
+def get_low_stock_items(location, threshold=LOW_STOCK_THRESHOLD):
+    """Get the items below the low stock threshold"""
+    db = get_db()
+    if not db:
+        return []
+    
+    try:
+        return governed_read('low_stock_items', _read_low_stock_items, location, threshold)
+    except Exception as e:
+        st.error(f"Error getting low stock items: {e}")
+        return []
+
+def _load_location_summary(db, location, tenant):
+    """Read one location's summary document and count its low stock items"""
+    snapshot = locations_collection(db, tenant).document(location).get()
+    summary = snapshot.to_dict() or {}
+    low_stock = inventory_collection(db, location, tenant).where('quantity', '<', LOW_STOCK_THRESHOLD).count().get()
+    charge_reads(2, tenant)
+    
+    return {
+        'item_count': summary.get('item_count', 0),
+        'total_quantity': summary.get('total_quantity', 0),
+        'total_value': summary.get('total_value', 0.0),
+        'category_counts': summary.get('category_counts', {}),
+        'low_stock_count': low_stock[0][0].value
+    }
+
+def _read_inventory_summary(location):
+    db = get_db()
+    # Worker threads have no session, so the tenant is resolved here
+    tenant = get_active_tenant()
+    if location != ALL_LOCATIONS:
+        return _load_location_summary(db, location, tenant)
+    
+    # Global totals are the sum of the per-location summaries, fetched in parallel
+    locations = [ref.id for ref in locations_collection(db, tenant).list_documents()]
+    with ThreadPoolExecutor(max_workers=min(16, max(1, len(locations)))) as pool:
+        summaries = list(pool.map(lambda loc: _load_location_summary(db, loc, tenant), locations))
+    
+    total = {'item_count': 0, 'total_quantity': 0, 'total_value': 0.0, 'category_counts': {}, 'low_stock_count': 0}
+    for summary in summaries:
+        for key in ('item_count', 'total_quantity', 'total_value', 'low_stock_count'):
+            total[key] += summary[key]
+        for category, count in summary['category_counts'].items():
+            total['category_counts'][category] = total['category_counts'].get(category, 0) + count
+    
+    return total
+
+def get_inventory_summary(location):
+    """Get item count, quantity, value, category and low stock totals for a location or all locations"""
+    db = get_db()
+    if not db:
+        return None
+    
+    try:
+        return governed_read('inventory_summary', _read_inventory_summary, location)
+    except Exception as e:
+        st.error(f"Error loading inventory summary: {e}")
+        return None
+
+def _read_data_version(location):
+    db = get_db()
+    # Every item write also updates its location summary document
+    if location == ALL_LOCATIONS:
+        refs = list(locations_collection(db).list_documents())
+    else:
+        refs = [locations_collection(db).document(location)]
+    
+    versions = sorted(
+        f"{snapshot.id}@{snapshot.update_time.timestamp() if snapshot.update_time else 0}"
+        for snapshot in db.get_all(refs, field_paths=['item_count'])
+    )
+    charge_reads(len(refs))
+    return hashlib.sha256('|'.join(versions).encode()).hexdigest()[:16]
+
+def get_data_version(location):
+    """Get a token that changes whenever a location's (or any location's) inventory changes"""
+    db = get_db()
+    if not db:
+        return None
+    
+    try:
+        return governed_read('data_version', _read_data_version, location)
+    except Exception as e:
+        st.error(f"Error reading data version: {e}")
+        return None
+
+def rebuild_location_summary(location, tenant=None):
+    """Recompute a location's summary document from its items"""
+    db = get_db()
+    if not db:
+        return False
+    
+    try:
+        summary = {'item_count': 0, 'total_quantity': 0, 'total_value': 0.0, 'category_counts': {}}
+        for doc in inventory_collection(db, location, tenant).stream():
+            item = record_from_doc(doc)
+            summary['item_count'] += 1
+            summary['total_quantity'] += item.quantity
+            summary['total_value'] += item.quantity * item.price
+            summary['category_counts'][item.category] = summary['category_counts'].get(item.category, 0) + 1
+        
+        summary['last_updated'] = firestore.SERVER_TIMESTAMP
+        location_ref = locations_collection(db, tenant).document(location)
+        location_ref.set(summary)
+        record_changes([('set', location_ref, summary, False)])
+        return True
+    except Exception as e:
+        st.error(f"Error rebuilding location summary: {e}")
+        return False
+
+def migrate_legacy_inventory(location=DEFAULT_LOCATION):
+    """Move items from the pre-location root inventory collection into a location.
+    
+    The root collection predates tenants and belongs to the default tenant,
+    so other tenants have nothing to move.
+    """
+    db = get_db()
+    if not db or get_active_tenant() != DEFAULT_TENANT:
+        return 0
+    
+    try:
+        moved = 0
+        batch = db.batch()
+        pending = 0
+        writes = []
+        
+        for doc in db.collection('inventory').stream():
+            item = doc.to_dict()
+            item['location'] = location
+            item['total_value'] = item.get('quantity', 0) * item.get('price', 0.0)
+            item['last_updated'] = firestore.SERVER_TIMESTAMP
+            item_ref = inventory_collection(db, location, DEFAULT_TENANT).document(doc.id)
+            batch.set(item_ref, item)
+            batch.delete(doc.reference)
+            writes.append(('set', item_ref, item, False))
+            writes.append(('delete', doc.reference, None, False))
+            pending += 2
+            moved += 1
+            
+            # Firestore batches are limited to 500 writes
+            if pending >= 498:
+                batch.commit()
+                record_changes(writes)
+                batch = db.batch()
+                pending = 0
+                writes = []
+        
+        if pending:
+            batch.commit()
+            record_changes(writes)
+        
+        rebuild_location_summary(location, DEFAULT_TENANT)
+        return moved
+    except Exception as e:
+        st.error(f"Error migrating inventory: {e}")
+        return 0
+
+def backfill_total_value():
+    """Add the total_value field to the active tenant's items written before it was maintained"""
+    db = get_db()
+    if not db:
+        return 0
+    
+    try:
+        key = uuid.uuid4().hex
+        keys = []
+        writes = []
+        updated = 0
+        
+        for query in inventory_queries(db, ALL_LOCATIONS):
+            for doc in query.stream():
+                item = doc.to_dict()
+                total_value = item.get('quantity', 0) * item.get('price', 0.0)
+                if item.get('total_value') != total_value:
+                    writes.append(('update', doc.reference, {'total_value': total_value, 'last_updated': firestore.SERVER_TIMESTAMP}, False))
+                    updated += 1
+                
+                if len(writes) == FIELD_UPDATE_CHUNK_SIZE:
+                    keys.append(f"{key}-{len(keys)}")
+                    commit_writes(writes, keys[-1], wait=0)
+                    writes = []
+        
+        if writes:
+            keys.append(f"{key}-{len(keys)}")
+            commit_writes(writes, keys[-1], wait=0)
+        
+        status = wait_for_writes(keys)
+        if status != 'done':
+            st.warning(f"Some item values are not written yet ({status})")
+        return updated
+    except Exception as e:
+        st.error(f"Error backfilling item values: {e}")
+        return 0
@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from firebase_admin import firestore
+
+from firebase_config import (
+    get_db,
+    ALL_LOCATIONS,
+    locations_collection,
+    inventory_collection,
+    item_from_doc,
+    update_item_fields,
+    wait_for_writes,
+    resolve_sharded_quantities,
+    record_changes,
+    charge_reads,
+    governed_read
+)
+
+# Demand is estimated from the 'issue' movements in each location's
+# stock_movements over a trailing window; reorder points cover lead time
+# demand plus safety stock at the chosen service level.
+
+FORECAST_WINDOW_DAYS = 90
+DEFAULT_LEAD_TIME_DAYS = 7
+REVIEW_PERIOD_DAYS = 14
+SERVICE_LEVEL_Z = 1.65  # ~95% cycle service level
+MAX_ALERTS = 200
+
+
+def compute_reorder_points(quantities, lead_times, movement_items, movement_days, movement_demand, n_days,
+                           service_z=SERVICE_LEVEL_Z, review_days=REVIEW_PERIOD_DAYS):
+    """Compute demand, safety stock and reorder points for every SKU at once.
+
+    quantities and lead_times are per-item arrays. Movements are given as
+    parallel arrays of item index, day index (0..n_days-1) and units
+    demanded. Daily demand is aggregated sparsely, so memory scales with
+    the number of movements rather than items times days.
+    """
+    n_items = len(quantities)
+    quantities = np.asarray(quantities, dtype=np.float64)
+    lead_times = np.asarray(lead_times, dtype=np.float64)
+
+    # Total demand per (item, day), then per-item sum and sum of squares
+    keys = np.asarray(movement_items, dtype=np.int64) * n_days + np.asarray(movement_days, dtype=np.int64)
+    day_keys, inverse = np.unique(keys, return_inverse=True)
+    daily = np.bincount(inverse, weights=np.asarray(movement_demand, dtype=np.float64), minlength=len(day_keys))
+    day_items = day_keys // n_days
+    demand_sum = np.bincount(day_items, weights=daily, minlength=n_items)
+    demand_sumsq = np.bincount(day_items, weights=daily ** 2, minlength=n_items)
+
+    daily_demand = demand_sum / n_days
+    variance = (demand_sumsq - n_days * daily_demand ** 2) / max(n_days - 1, 1)
+    demand_std = np.sqrt(np.clip(variance, 0, None))
+
+    safety_stock = service_z * demand_std * np.sqrt(lead_times)
+    reorder_point = daily_demand * lead_times + safety_stock
+    order_up_to = reorder_point + daily_demand * review_days
+    reorder_now = (reorder_point > 0) & (quantities <= reorder_point)
+    suggested = np.where(reorder_now, np.ceil(order_up_to - quantities), 0)
+
+    return {
+        'daily_demand': daily_demand,
+        'demand_std': demand_std,
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'suggested_order_qty': np.clip(suggested, 0, None),
+        'reorder_now': reorder_now,
+    }
+
+
+def _location_ids(db, location):
+    if location == ALL_LOCATIONS:
+        return [ref.id for ref in locations_collection(db).list_documents()]
+    return [location]
+
+
+def run_forecast(location, window_days=FORECAST_WINDOW_DAYS):
+    """Recompute and store reorder points for a location (or every location).
+
+    Returns (alert count, status): status is 'done' once every reorder
+    point is written, else the first other write status.
+    """
+    db = get_db()
+    if not db:
+        raise ConnectionError("Database connection failed")
+
+    alerts = 0
+    status = 'done'
+    for location_id in _location_ids(db, location):
+        location_alerts, location_status = _forecast_location(db, location_id, window_days)
+        alerts += location_alerts
+        if status == 'done':
+            status = location_status
+    return alerts, status
+
+
+def _forecast_location(db, location, window_days):
+    items = resolve_sharded_quantities([item_from_doc(doc) for doc in inventory_collection(db, location).stream()])
+    if not items:
+        return 0, 'done'
+
+    items_df = pd.DataFrame(items)
+    item_index = pd.Index(items_df['id'])
+    since = datetime.now(timezone.utc) - timedelta(days=window_days)
+
+    movements = locations_collection(db).document(location).collection('stock_movements') \
+        .where('created_at', '>=', since) \
+        .select(['item_id', 'type', 'delta', 'created_at']) \
+        .stream()
+    movements_df = pd.DataFrame([doc.to_dict() for doc in movements], columns=['item_id', 'type', 'delta', 'created_at'])
+    movements_df = movements_df[(movements_df['type'] == 'issue') & movements_df['item_id'].isin(item_index)]
+
+    created_at = pd.to_datetime(movements_df['created_at'], utc=True)
+    days = ((created_at - pd.Timestamp(since)) // pd.Timedelta(days=1)).clip(0, window_days - 1)
+
+    lead_times = pd.to_numeric(items_df.get('lead_time_days', pd.Series(index=items_df.index, dtype=float)),
+                               errors='coerce').fillna(DEFAULT_LEAD_TIME_DAYS)
+    result = compute_reorder_points(
+        pd.to_numeric(items_df['quantity'], errors='coerce').fillna(0).to_numpy(),
+        lead_times.to_numpy(),
+        item_index.get_indexer(movements_df['item_id']),
+        days.to_numpy(dtype=np.int64),
+        -movements_df['delta'].to_numpy(dtype=np.float64),
+        window_days
+    )
+
+    # Store the per-item results, writing only items whose plan changed
+    fields = {
+        'daily_demand': np.round(result['daily_demand'], 3),
+        'safety_stock': np.round(result['safety_stock'], 1),
+        'reorder_point': np.round(result['reorder_point'], 1),
+        'suggested_order_qty': result['suggested_order_qty'].astype(int),
+    }
+    updates = []
+    for i, item in enumerate(items):
+        item_fields = {name: values[i].item() for name, values in fields.items()}
+        if any(item.get(name) != value for name, value in item_fields.items()):
+            updates.append((item, item_fields))
+    _, keys = update_item_fields(updates)
+    status = wait_for_writes(keys)
+
+    # A small alerts document lets pages show "reorder now" with one read
+    flagged = np.flatnonzero(result['reorder_now'])
+    if status != 'done':
+        # Keep the last alerts until the reorder points they describe are written
+        return len(flagged), status
+    flagged = flagged[np.argsort(-result['suggested_order_qty'][flagged])]
+    forecast_ref = locations_collection(db).document(location).collection('forecasts').document('latest')
+    forecast = {
+        'generated_at': firestore.SERVER_TIMESTAMP,
+        'window_days': window_days,
+        'reorder_count': len(flagged),
+        'alerts': [
+            {
+                'id': items[i]['id'],
+                'name': items[i].get('name'),
+                'location': location,
+                'quantity': items[i].get('quantity', 0),
+                'reorder_point': fields['reorder_point'][i].item(),
+                'suggested_order_qty': fields['suggested_order_qty'][i].item()
+            }
+            for i in flagged[:MAX_ALERTS]
+        ]
+    }
+    forecast_ref.set(forecast)
+    record_changes([('set', forecast_ref, forecast, False)])
+    return len(flagged), status
+
+
+def _read_reorder_alerts(location):
+    db = get_db()
+    refs = [
+        locations_collection(db).document(location_id).collection('forecasts').document('latest')
+        for location_id in _location_ids(db, location)
+    ]
+    alerts = []
+    count = 0
+    for snapshot in db.get_all(refs):
+        if snapshot.exists:
+            forecast = snapshot.to_dict()
+            alerts.extend(forecast.get('alerts', []))
+            count += forecast.get('reorder_count', len(forecast.get('alerts', [])))
+    charge_reads(len(refs))
+    return sorted(alerts, key=lambda alert: -alert['suggested_order_qty']), count
+
+
+def get_reorder_alerts(location):
+    """Get the stored reorder-now alerts of a location (or every location) without recomputing.
+
+    Returns (alerts, count): alerts holds each forecast's top MAX_ALERTS
+    items, count is how many items should be reordered in total.
+    """
+    if not get_db():
+        return [], 0
+    return governed_read('reorder_forecast', _read_reorder_alerts, location)
@@ -1,5 +1,15 @@
 import streamlit as st
-from firebase_config import get_db
+from firebase_config import (
+    get_db,
+    get_active_location,
+    location_label,
+    get_inventory_summary,
+    get_low_stock_items,
+    get_recent_items,
+    get_top_valuable_items,
+    count_tenant_users
+)
+from forecasting import get_reorder_alerts
 import pandas as pd
 import plotly.express as px
 from datetime import datetime
@@ -18,26 +28,22 @@ def app():
         st.error("Database connection failed")
         return
     
+    location = get_active_location()
+    st.caption(location_label(location))
+    
     try:
-        # Get inventory data
-        inventory_docs = list(db.collection('inventory').stream())
-        items = []
-        
-        for doc in inventory_docs:
-            item = doc.to_dict()
-            item['id'] = doc.id
-            items.append(item)
+        # Totals come from the maintained per-location summaries, not a scan
+        summary = get_inventory_summary(location)
+        has_items = bool(summary and summary['item_count'])
         
         # Display metrics
         col1, col2, col3, col4 = st.columns(4)
         
-        if items:
-            df = pd.DataFrame(items)
-            
-            total_items = len(items)
-            total_quantity = df['quantity'].sum()
-            total_value = (df['quantity'] * df['price']).sum()
-            low_stock_items = len(df[df['quantity'] < 10])  # Items with less than 10 units
+        if has_items:
+            total_items = summary['item_count']
+            total_quantity = summary['total_quantity']
+            total_value = summary['total_value']
+            low_stock_items = summary['low_stock_count']
             
             with col1:
                 st.metric("📦 Total Items", total_items)
@@ -92,12 +98,13 @@ def app():
         st.markdown("---")
         
         # Recent activity and charts
-        if items:
+        if has_items:
             col1, col2 = st.columns(2)
             
             with col1:
                 st.subheader("📈 Category Distribution")
-                category_counts = df['category'].value_counts()
+                category_counts = pd.Series(summary['category_counts'])
+                category_counts = category_counts[category_counts > 0]
                 fig_pie = px.pie(
                     values=category_counts.values, 
                     names=category_counts.index,
@@ -108,8 +115,7 @@ def app():
             
             with col2:
                 st.subheader("💰 Top 5 Valuable Items")
-                df['total_value'] = df['quantity'] * df['price']
-                top_items = df.nlargest(5, 'total_value')
+                top_items = pd.DataFrame(get_top_valuable_items(location, 5))
                 
                 if not top_items.empty:
                     fig_bar = px.bar(
@@ -120,7 +126,7 @@ def app():
                         color='category'
                     )
                     fig_bar.update_layout(height=400)
-                    fig_bar.update_xaxis(tickangle=45)
+                    fig_bar.update_xaxes(tickangle=45)
                     st.plotly_chart(fig_bar, use_container_width=True)
                 else:
                     st.info("No items to display")
@@ -132,7 +138,7 @@ def app():
             if low_stock_items > 0:
                 st.warning(f"⚠️ {low_stock_items} items are running low on stock!")
                 
-                low_stock_df = df[df['quantity'] < 10]
+                low_stock_df = pd.DataFrame(get_low_stock_items(location))
                 with st.expander("View Low Stock Items"):
                     st.dataframe(
                         low_stock_df[['name', 'category', 'quantity', 'price']].sort_values('quantity'),
@@ -141,15 +147,30 @@ def app():
             else:
                 st.success("✅ All items are well stocked!")
             
+            # Reorder points come from the last forecast run, not recomputed here
+            try:
+                reorder_alerts, reorder_count = get_reorder_alerts(location)
+            except Exception as e:
+                st.error(f"Error loading reorder alerts: {e}")
+                reorder_alerts, reorder_count = [], 0
+            
+            if reorder_alerts:
+                st.warning(f"🛒 {reorder_count} items should be reordered now!")
+                with st.expander("View Reorder Suggestions"):
+                    st.dataframe(
+                        pd.DataFrame(reorder_alerts)[['name', 'quantity', 'reorder_point', 'suggested_order_qty']],
+                        use_container_width=True,
+                        hide_index=True
+                    )
+            
             # Recent items (last 5 added)
             st.markdown("---")
             st.subheader("🕒 Recently Added Items")
             
-            # Sort by creation time if available, otherwise show last 5
-            recent_items = df.tail(5) if len(df) > 5 else df
+            recent_items = get_recent_items(location, 5)
             
-            if not recent_items.empty:
-                for _, item in recent_items.iterrows():
+            if recent_items:
+                for item in recent_items:
                     with st.container():
                         col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
                         
@@ -164,8 +185,7 @@ def app():
                             st.write(f"${item['price']:.2f}")
                         
                         with col4:
-                            total_val = item['quantity'] * item['price']
-                            st.write(f"${total_val:.2f}")
+                            st.write(f"${item.get('total_value', item['quantity'] * item['price']):.2f}")
                         
                         st.divider()
             else:
@@ -191,7 +211,7 @@ def app():
             st.success("🟢 Database: Connected")
         
         with col2:
-            user_count = len(list(db.collection('users').stream()))
+            user_count = count_tenant_users()
             st.info(f"👥 Active Users: {user_count}")
         
         with col3:
@@ -1,8 +1,57 @@
 import streamlit as st
-from firebase_config import get_db
-from firebase_admin import firestore  # Add this import
+from streamlit.errors import StreamlitAPIException
+from firebase_config import (
+    get_db,
+    ALL_LOCATIONS,
+    DEFAULT_LOCATION,
+    get_active_location,
+    get_active_tenant,
+    location_label,
+    list_locations,
+    add_inventory_item,
+    update_inventory_item,
+    delete_inventory_item,
+    STOCK_MOVEMENT_TYPES,
+    movement_delta,
+    adjust_stock_batch,
+    adjust_stock,
+    commit_cycle_count,
+    enable_sharded_counter,
+    fold_sharded_counter,
+    write_key,
+    rotate_write_key,
+    plan_bulk_edit,
+    bulk_update_items,
+    bulk_delete_items
+)
+from snapshot import get_inventory_items, get_item_by_sku, patch_local_item
+from photos import store_photo, get_thumbnail
+from datetime import datetime, timezone
+import uuid
 import pandas as pd
 
+CATEGORIES = ["Electronics", "Clothing", "Food", "Books", "Other"]
+GALLERY_PAGE_SIZE = 24
+GALLERY_COLUMNS = 6
+
+# Each section is a fragment: a write reruns only its own section, and the
+# changed item is patched into the local snapshot instead of re-reading the
+# location. Other sections show the patch the next time they rerun.
+
+def _flash(message):
+    """Show a success message after the fragment rerun that follows a write"""
+    st.session_state.inventory_flash = message
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        # The fragment is running as part of a full-app run
+        st.rerun()
+
+def _show_flash():
+    message = st.session_state.pop('inventory_flash', None)
+    if message:
+        st.success(message)
+
 def app():
     st.title("📦 Inventory Management")
     
@@ -11,135 +60,548 @@ def app():
         st.error("Database connection failed")
         return
     
+    location = get_active_location()
+    st.caption(location_label(location))
+    
     # Tabs for different inventory operations
-    tab1, tab2, tab3 = st.tabs(["View Inventory", "Add Item", "Update Item"])
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["View Inventory", "Add Item", "Update Item", "Adjust Stock", "Scan",
+                                                  "Cycle Count"])
     
     with tab1:
-        st.subheader("Current Inventory")
+        view_inventory(location)
+    
+    with tab2:
+        add_item(location)
+    
+    with tab3:
+        update_item(location)
+    
+    with tab4:
+        adjust_stock_tab(location)
+    
+    with tab5:
+        scan_items(location)
+    
+    with tab6:
+        cycle_count(location)
+
+@st.fragment
+def view_inventory(location):
+    st.subheader("Current Inventory")
+    _show_flash()
+    
+    try:
+        # ABC classes are stored on the items; the snapshot filters on them in memory
+        abc_classes = st.multiselect("ABC Class", ['A', 'B', 'C'], placeholder="All classes")
         
-        try:
-            # Get all inventory items
-            items = []
-            docs = db.collection('inventory').stream()
+        # Get all inventory items of the active location
+        items = get_inventory_items(location, abc_classes)
+        
+        if items:
+            df = pd.DataFrame(items)
+            table_key = f"inventory_table_{st.session_state.get('inventory_table_version', 0)}"
+            event = st.dataframe(df, use_container_width=True, on_select="rerun",
+                                 selection_mode="multi-row", key=table_key)
             
-            for doc in docs:
-                item = doc.to_dict()
-                item['id'] = doc.id
-                items.append(item)
+            bulk_actions(items, [items[row] for row in event.selection.rows])
             
-            if items:
-                df = pd.DataFrame(items)
-                st.dataframe(df, use_container_width=True)
-                
-                # Add delete functionality
-                st.subheader("Delete Item")
-                if items:
-                    item_names = [f"{item['name']} (ID: {item['id']})" for item in items]
-                    selected_item = st.selectbox("Select item to delete:", [""] + item_names)
-                    
-                    if selected_item and st.button("🗑️ Delete Item", type="secondary"):
-                        item_id = selected_item.split("ID: ")[1].rstrip(")")
-                        try:
-                            db.collection('inventory').document(item_id).delete()
-                            st.success("Item deleted successfully!")
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Error deleting item: {e}")
+            if st.toggle("🖼️ Show photos", key="show_gallery"):
+                photo_gallery(items)
+            
+            # Add delete functionality
+            st.subheader("Delete Item")
+            item_names = {f"{item['name']} (ID: {item['id']})": item for item in items}
+            selected_item = st.selectbox("Select item to delete:", [""] + list(item_names.keys()))
+            
+            if selected_item and st.button("🗑️ Delete Item", type="secondary"):
+                item = item_names[selected_item]
+                if delete_inventory_item(item, key=write_key('delete_item')):
+                    rotate_write_key('delete_item')
+                    patch_local_item(item, removed=True)
+                    _flash("Item deleted successfully!")
+        else:
+            st.info("No items in inventory yet.")
+    
+    except Exception as e:
+        st.error(f"Error loading inventory: {e}")
+
+def photo_gallery(items):
+    """Show one page of item thumbnails; only that page's thumbnails are loaded"""
+    pages = max(1, -(-len(items) // GALLERY_PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1, key="gallery_page") if pages > 1 else 1
+    start = (page - 1) * GALLERY_PAGE_SIZE
+    
+    columns = st.columns(GALLERY_COLUMNS)
+    for index, item in enumerate(items[start:start + GALLERY_PAGE_SIZE]):
+        with columns[index % GALLERY_COLUMNS]:
+            thumbnail = get_thumbnail(item['photo']) if item.get('photo') else None
+            if thumbnail:
+                st.image(thumbnail)
             else:
-                st.info("No items in inventory yet.")
+                st.markdown("📷 *No photo*")
+            st.caption(f"{item['name']} · Qty {item.get('quantity', 0)}")
+
+BULK_ACTION_LABELS = {
+    'delete': "🗑️ Delete",
+    'category': "🏷️ Re-categorize",
+    'price_percent': "💲 Change price by %",
+    'supplier': "🚚 Reassign supplier"
+}
+
+def bulk_actions(items, selected):
+    """Bulk delete or edit the selected rows, with a local dry-run preview"""
+    with st.expander(f"✏️ Bulk Actions ({len(selected)} selected)"):
+        version = st.session_state.get('inventory_table_version', 0)
+        if st.checkbox(f"Apply to all {len(items)} items shown", key=f"bulk_all_{version}"):
+            selected = items
+        if not selected:
+            st.info("Select rows in the table, or apply to all items shown.")
+            return
+        
+        action = st.radio("Action", list(BULK_ACTION_LABELS), format_func=BULK_ACTION_LABELS.get,
+                          horizontal=True, key="bulk_action")
+        
+        if action == 'delete':
+            preview = pd.DataFrame([
+                {'Item': item['name'], 'Location': item.get('location'), 'Quantity': item.get('quantity', 0),
+                 'Value': item.get('quantity', 0) * item.get('price', 0.0)}
+                for item in selected
+            ])
+            st.warning(f"{len(selected)} items worth ${preview['Value'].sum():,.2f} will be deleted.")
+            st.dataframe(preview, hide_index=True, use_container_width=True)
+            confirmed = st.checkbox("I understand this cannot be undone", key=f"bulk_delete_confirm_{version}")
+            
+            if st.button(f"Delete {len(selected)} Items", type="primary", disabled=not confirmed):
+                deleted = bulk_delete_items(selected, key=write_key('bulk_action'))
+                if deleted:
+                    rotate_write_key('bulk_action')
+                    for item in selected[:deleted]:
+                        patch_local_item(item, removed=True)
+                    _finish_bulk(f"Deleted {deleted} items")
+            return
+        
+        if action == 'category':
+            value = st.selectbox("New category", CATEGORIES, key="bulk_category")
+        elif action == 'price_percent':
+            value = st.number_input("Price change (%)", min_value=-100.0, value=0.0, step=1.0, key="bulk_percent")
+        else:
+            value = st.text_input("New supplier", key="bulk_supplier")
+        
+        changes = plan_bulk_edit(selected, action, value)
+        value_change = sum(
+            item.get('quantity', 0) * (fields['price'] - item.get('price', 0.0))
+            for item, fields in changes if 'price' in fields
+        )
+        st.caption(f"Preview: {len(changes)} of {len(selected)} items change"
+                   + (f", inventory value {value_change:+,.2f}" if action == 'price_percent' else ""))
+        if changes:
+            st.dataframe(pd.DataFrame([
+                {'Item': item['name'], 'Before': item.get(field), 'After': new}
+                for item, fields in changes[:1000] for field, new in fields.items()
+            ]), hide_index=True, use_container_width=True)
+        
+        if st.button(f"Apply to {len(changes)} Items", type="primary", disabled=not changes):
+            written = bulk_update_items(changes, st.session_state.user['username'], key=write_key('bulk_action'))
+            if written:
+                rotate_write_key('bulk_action')
+                for item, fields in changes[:written]:
+                    new_item = dict(item, **fields)
+                    patch_local_item(dict(new_item, total_value=new_item.get('quantity', 0) * new_item.get('price', 0.0)))
+                _finish_bulk(f"Updated {written} items")
+
+def _finish_bulk(message):
+    # New widget keys clear the row selection and the bulk checkboxes
+    st.session_state.inventory_table_version = st.session_state.get('inventory_table_version', 0) + 1
+    _flash(message)
+
+@st.fragment
+def add_item(location):
+    st.subheader("Add New Item")
+    _show_flash()
+    
+    with st.form("add_item_form"):
+        name = st.text_input("Item Name")
+        sku = st.text_input("SKU / Barcode (Optional)")
+        category = st.selectbox("Category", CATEGORIES)
+        quantity = st.number_input("Quantity", min_value=0, value=0)
+        price = st.number_input("Price per Unit", min_value=0.0, value=0.0, format="%.2f")
+        description = st.text_area("Description")
+        supplier = st.text_input("Supplier (Optional)")
+        
+        # Admins may add to any location, everyone else to their own
+        if st.session_state.user.get('role') == 'admin':
+            locations = list_locations() or [DEFAULT_LOCATION]
+            default_location = location if location in locations else locations[0]
+            item_location = st.selectbox("Location", locations, index=locations.index(default_location))
+        else:
+            item_location = location if location != ALL_LOCATIONS else DEFAULT_LOCATION
+        
+        if st.form_submit_button("Add Item"):
+            if name and quantity >= 0 and price >= 0:
+                item_data = {
+                    'name': name,
+                    'sku': sku,
+                    'category': category,
+                    'quantity': quantity,
+                    'price': price,
+                    'description': description,
+                    'supplier': supplier,
+                    'created_by': st.session_state.user['username']
+                }
                 
-        except Exception as e:
-            st.error(f"Error loading inventory: {e}")
+                item_id = add_inventory_item(item_data, item_location, key=write_key('add_item'))
+                if item_id:
+                    rotate_write_key('add_item')
+                    patch_local_item(dict(
+                        item_data,
+                        sku=sku.strip() or None,
+                        id=item_id,
+                        location=item_location,
+                        total_value=quantity * price,
+                        created_at=datetime.now(timezone.utc)
+                    ))
+                    _flash(f"Item '{name}' added successfully!")
+            else:
+                st.error("Please fill in all required fields")
+
+@st.fragment
+def update_item(location):
+    st.subheader("Update Item")
+    _show_flash()
     
-    with tab2:
-        st.subheader("Add New Item")
-        
-        with st.form("add_item_form"):
-            name = st.text_input("Item Name")
-            category = st.selectbox("Category", ["Electronics", "Clothing", "Food", "Books", "Other"])
-            quantity = st.number_input("Quantity", min_value=0, value=0)
-            price = st.number_input("Price per Unit", min_value=0.0, value=0.0, format="%.2f")
-            description = st.text_area("Description")
-            supplier = st.text_input("Supplier (Optional)")
+    try:
+        # Get all items for selection
+        items = get_inventory_items(location)
+        
+        if items:
+            # Select item to update
+            item_options = {f"{item['name']} (Qty: {item['quantity']})": item for item in items}
+            selected_item_name = st.selectbox("Select item to update:", [""] + list(item_options.keys()))
             
-            if st.form_submit_button("Add Item"):
-                if name and quantity >= 0 and price >= 0:
-                    try:
-                        item_data = {
-                            'name': name,
-                            'category': category,
-                            'quantity': quantity,
-                            'price': price,
-                            'description': description,
-                            'supplier': supplier,
-                            'created_by': st.session_state.user['username'],
-                            'created_at': firestore.SERVER_TIMESTAMP,
-                            'last_updated': firestore.SERVER_TIMESTAMP
+            if selected_item_name:
+                selected_item = item_options[selected_item_name]
+                
+                with st.form("update_item_form"):
+                    st.write(f"Updating: **{selected_item['name']}**")
+                    
+                    new_name = st.text_input("Item Name", value=selected_item['name'])
+                    new_sku = st.text_input("SKU / Barcode", value=selected_item.get('sku') or '')
+                    new_category = st.selectbox("Category",
+                                              CATEGORIES,
+                                              index=CATEGORIES.index(selected_item.get('category', 'Other')))
+                    new_quantity = st.number_input("Quantity", min_value=0, value=selected_item['quantity'])
+                    new_price = st.number_input("Price per Unit", min_value=0.0, value=selected_item['price'], format="%.2f")
+                    new_description = st.text_area("Description", value=selected_item.get('description', ''))
+                    new_supplier = st.text_input("Supplier", value=selected_item.get('supplier', ''))
+                    
+                    if st.form_submit_button("Update Item"):
+                        updated_data = {
+                            'name': new_name,
+                            'sku': new_sku,
+                            'category': new_category,
+                            'quantity': new_quantity,
+                            'price': new_price,
+                            'description': new_description,
+                            'supplier': new_supplier,
+                            'updated_by': st.session_state.user['username']
                         }
                         
-                        db.collection('inventory').add(item_data)
-                        st.success(f"Item '{name}' added successfully!")
-                        st.rerun()
-                        
-                    except Exception as e:
-                        st.error(f"Error adding item: {e}")
-                else:
-                    st.error("Please fill in all required fields")
+                        if update_inventory_item(selected_item, updated_data, key=write_key('update_item')):
+                            rotate_write_key('update_item')
+                            updated_data['sku'] = new_sku.strip() or None
+                            patch_local_item(dict(selected_item, **updated_data, total_value=new_quantity * new_price))
+                            _flash(f"Item '{new_name}' updated successfully!")
+                
+                item_photo(selected_item)
+        else:
+            st.info("No items available to update.")
     
-    with tab3:
-        st.subheader("Update Item")
+    except Exception as e:
+        st.error(f"Error loading items for update: {e}")
+
+def item_photo(item):
+    """Show an item's photo and replace it with an upload"""
+    st.write("**Photo**")
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        thumbnail = get_thumbnail(item['photo'], 256) if item.get('photo') else None
+        if thumbnail:
+            st.image(thumbnail)
+        else:
+            st.caption("📷 No photo yet")
+    
+    with col2:
+        upload = st.file_uploader("Upload photo", type=['jpg', 'jpeg', 'png', 'webp', 'gif', 'bmp'],
+                                  key=f"photo_upload_{item['id']}")
+        if upload and st.button("📷 Save Photo"):
+            try:
+                # Thumbnails are made in worker processes; identical photos are stored once
+                photo_id = store_photo(upload.getvalue())
+                if update_inventory_item(item, {'photo': photo_id, 'updated_by': st.session_state.user['username']},
+                                         key=write_key('item_photo')):
+                    rotate_write_key('item_photo')
+                    patch_local_item(dict(item, photo=photo_id))
+                    _flash("Photo saved!")
+            except ValueError as e:
+                st.error(f"Error saving photo: {e}")
+
+@st.fragment
+def adjust_stock_tab(location):
+    st.subheader("Adjust Stock")
+    st.caption("Receive, issue or adjust quantities by a delta. Changes from other clerks are kept.")
+    _show_flash()
+    
+    try:
+        items = get_inventory_items(location)
         
-        try:
-            # Get all items for selection
-            items = []
-            docs = db.collection('inventory').stream()
+        if items:
+            movement_type = st.radio("Movement", STOCK_MOVEMENT_TYPES, horizontal=True,
+                                     format_func=str.title)
             
-            for doc in docs:
-                item = doc.to_dict()
-                item['id'] = doc.id
-                items.append(item)
+            adjust_df = pd.DataFrame([
+                {
+                    'id': item['id'],
+                    'Item': item['name'],
+                    'Location': item.get('location'),
+                    'On Hand': item.get('quantity', 0),
+                    'Change': 0,
+                    'Reason': ''
+                }
+                for item in items
+            ])
+            edited_df = st.data_editor(
+                adjust_df,
+                column_config={'id': None},
+                disabled=['Item', 'Location', 'On Hand'],
+                hide_index=True,
+                use_container_width=True,
+                key=f"adjust_editor_{movement_type}_{st.session_state.get('adjust_editor_version', 0)}"
+            )
             
-            if items:
-                # Select item to update
-                item_options = {f"{item['name']} (Qty: {item['quantity']})": item for item in items}
-                selected_item_name = st.selectbox("Select item to update:", [""] + list(item_options.keys()))
+            changes = edited_df[edited_df['Change'] != 0]
+            if st.button(f"✅ Apply {len(changes)} {movement_type.title()} Movement(s)", type="primary",
+                         disabled=changes.empty):
+                items_by_id = {item['id']: item for item in items}
+                adjustments = [
+                    {
+                        'item': items_by_id[row['id']],
+                        'type': movement_type,
+                        'quantity': int(row['Change']),
+                        'reason': row['Reason']
+                    }
+                    for _, row in changes.iterrows()
+                ]
                 
-                if selected_item_name:
-                    selected_item = item_options[selected_item_name]
+                applied = adjust_stock_batch(adjustments, st.session_state.user['username'],
+                                             key=write_key('adjust_stock'))
+                if applied:
+                    rotate_write_key('adjust_stock')
+                    # A new editor key gives a fresh, empty Change column
+                    st.session_state.adjust_editor_version = st.session_state.get('adjust_editor_version', 0) + 1
+                    for adjustment in adjustments:
+                        item = adjustment['item']
+                        # Sharded items already add their shards to the quantity on every read
+                        if item.get('num_shards'):
+                            continue
+                        quantity = item.get('quantity', 0) + movement_delta(adjustment['type'], adjustment['quantity'])
+                        patch_local_item(dict(item, quantity=quantity, total_value=quantity * item.get('price', 0.0)))
+                    _flash(f"Applied {applied} stock movement(s)")
+            
+            # Sharded counters for SKUs with heavy concurrent movement
+            if st.session_state.user.get('role') == 'admin':
+                with st.expander("🔥 High-Traffic Items"):
+                    hot_options = {f"{item['name']} (ID: {item['id']})": item for item in items}
+                    hot_item_name = st.selectbox("Item", [""] + list(hot_options.keys()), key="hot_item")
                     
-                    with st.form("update_item_form"):
-                        st.write(f"Updating: **{selected_item['name']}**")
+                    if hot_item_name:
+                        hot_item = hot_options[hot_item_name]
+                        num_shards = st.number_input("Counter shards", min_value=1, max_value=100,
+                                                     value=hot_item.get('num_shards') or 10)
                         
-                        new_name = st.text_input("Item Name", value=selected_item['name'])
-                        new_category = st.selectbox("Category", 
-                                                  ["Electronics", "Clothing", "Food", "Books", "Other"],
-                                                  index=["Electronics", "Clothing", "Food", "Books", "Other"].index(selected_item.get('category', 'Other')))
-                        new_quantity = st.number_input("Quantity", min_value=0, value=selected_item['quantity'])
-                        new_price = st.number_input("Price per Unit", min_value=0.0, value=selected_item['price'], format="%.2f")
-                        new_description = st.text_area("Description", value=selected_item.get('description', ''))
-                        new_supplier = st.text_input("Supplier", value=selected_item.get('supplier', ''))
-                        
-                        if st.form_submit_button("Update Item"):
-                            try:
-                                updated_data = {
-                                    'name': new_name,
-                                    'category': new_category,
-                                    'quantity': new_quantity,
-                                    'price': new_price,
-                                    'description': new_description,
-                                    'supplier': new_supplier,
-                                    'last_updated': firestore.SERVER_TIMESTAMP,
-                                    'updated_by': st.session_state.user['username']
-                                }
-                                
-                                db.collection('inventory').document(selected_item['id']).update(updated_data)
-                                st.success(f"Item '{new_name}' updated successfully!")
-                                st.rerun()
-                                
-                            except Exception as e:
-                                st.error(f"Error updating item: {e}")
-            else:
-                st.info("No items available to update.")
-                
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if st.button("Enable Sharded Counter"):
+                                if enable_sharded_counter(hot_item, num_shards):
+                                    patch_local_item(dict(hot_item, num_shards=num_shards))
+                                    st.success("Sharded counter enabled")
+                        with col2:
+                            if hot_item.get('num_shards') and st.button("Fold Shards"):
+                                if fold_sharded_counter(hot_item):
+                                    # The read quantity already included the shards that were folded
+                                    patch_local_item(hot_item)
+                                    _flash("Shards folded into item quantity")
+        else:
+            st.info("No items available to adjust.")
+    
+    except Exception as e:
+        st.error(f"Error loading items for adjustment: {e}")
+
+@st.fragment
+def scan_items(location):
+    st.subheader("Scan")
+    st.caption("Scan or type a SKU and press Enter; each scan applies one stock movement.")
+    
+    if location == ALL_LOCATIONS:
+        st.info("Select a single location to scan items.")
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        movement_type = st.radio("Movement", STOCK_MOVEMENT_TYPES, horizontal=True,
+                                 format_func=str.title, key="scan_movement")
+    with col2:
+        quantity = st.number_input("Units per scan", min_value=1, value=1, key="scan_quantity")
+    
+    # Submitting clears the field, so the scanner's Enter readies the next scan
+    with st.form("scan_form", clear_on_submit=True):
+        sku = st.text_input("SKU / Barcode")
+        submitted = st.form_submit_button("Apply")
+    
+    scan_log = st.session_state.setdefault('scan_log', [])
+    if submitted and sku.strip():
+        try:
+            item = get_item_by_sku(location, sku.strip())
+            if item is None:
+                st.error(f"Unknown SKU: {sku.strip()}")
+            elif adjust_stock(item, movement_type, quantity, st.session_state.user['username'],
+                              reason='scan', key=write_key('scan')):
+                rotate_write_key('scan')
+                delta = movement_delta(movement_type, quantity)
+                new_quantity = item.get('quantity', 0) + delta
+                if not item.get('num_shards'):
+                    patch_local_item(dict(item, quantity=new_quantity, total_value=new_quantity * item.get('price', 0.0)))
+                st.success(f"{item['name']}: {delta:+d} → {new_quantity}")
+                scan_log.insert(0, {'SKU': item['sku'], 'Item': item['name'], 'Change': delta, 'On Hand': new_quantity})
+                del scan_log[20:]
         except Exception as e:
-            st.error(f"Error loading items for update: {e}")
+            st.error(f"Error applying scan: {e}")
+    
+    if scan_log:
+        st.dataframe(pd.DataFrame(scan_log), hide_index=True, use_container_width=True)
+
+@st.fragment
+def cycle_count(location):
+    st.subheader("Cycle Count")
+    st.caption("Count one category and enter what is on the shelf. Variances are against the quantity when the "
+               "count started; movements made since then are kept.")
+    _show_flash()
+    
+    try:
+        items = get_inventory_items(location)
+        count = st.session_state.get('cycle_count')
+        if count and (count['location'] != location or count['tenant'] != get_active_tenant()):
+            count = st.session_state.cycle_count = None
+        
+        if not count:
+            categories = sorted({item.get('category', 'Other') for item in items})
+            if not categories:
+                st.info("No items available to count.")
+                return
+            
+            category = st.selectbox("Category", categories, key="count_category")
+            if st.button("📋 Start Count"):
+                # The rows and their expected quantities are fixed when the count starts
+                counted_items = sorted((item for item in items if item.get('category', 'Other') == category),
+                                       key=lambda item: (item.get('location') or '', item['name'], item['id']))
+                st.session_state.cycle_count = {
+                    'id': f"{datetime.now(timezone.utc):%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}",
+                    'location': location,
+                    'tenant': get_active_tenant(),
+                    'category': category,
+                    'started_at': datetime.now(timezone.utc),
+                    'rows': [
+                        {
+                            'id': item['id'],
+                            'SKU': item.get('sku', ''),
+                            'Item': item['name'],
+                            'Location': item.get('location'),
+                            'Expected': item.get('quantity', 0)
+                        }
+                        for item in counted_items
+                    ]
+                }
+                _flash(f"Count started: {len(counted_items)} {category} item(s)")
+            return
+        
+        rows = count['rows']
+        row_ids = {row['id'] for row in rows}
+        items_by_id = {item['id']: item for item in items if item['id'] in row_ids}
+        st.markdown(f"**{count['category']}** · {len(rows)} item(s) · started "
+                    f"{count['started_at']:%Y-%m-%d %H:%M} UTC")
+        
+        # The editor keeps edits by row position, so the rows never change
+        # during a count; an item deleted since it started shows as removed
+        count_df = pd.DataFrame(rows, columns=['id', 'SKU', 'Item', 'Location', 'Expected'])
+        count_df['Removed'] = ~count_df['id'].isin(items_by_id.keys())
+        if count_df['Removed'].any():
+            st.warning(f"{int(count_df['Removed'].sum())} item(s) were deleted since the count started; "
+                       "their counts are not committed.")
+        count_df['Counted'] = pd.Series([None] * len(count_df), dtype='Int64')
+        edited_df = st.data_editor(
+            count_df,
+            column_config={
+                'id': None,
+                'Counted': st.column_config.NumberColumn("Counted", min_value=0, step=1,
+                                                         help="Leave empty for items not counted")
+            },
+            disabled=['SKU', 'Item', 'Location', 'Expected', 'Removed'],
+            hide_index=True,
+            use_container_width=True,
+            key=f"count_editor_{count['id']}"
+        )
+        
+        # Variances are worked out here; nothing is read or written until the count is committed
+        counted = edited_df.dropna(subset=['Counted'])
+        counted = counted[~counted['Removed']]
+        variance = counted['Counted'].astype(int) - counted['Expected']
+        prices = counted['id'].map(lambda item_id: items_by_id[item_id].get('price', 0.0))
+        variances = pd.DataFrame({
+            'Item': counted['Item'],
+            'Expected': counted['Expected'],
+            'Counted': counted['Counted'].astype(int),
+            'Variance': variance,
+            'Value Variance': variance * prices
+        })[variance != 0]
+        
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Counted", f"{len(counted)} / {len(rows)}")
+        col2.metric("Variances", len(variances), f"{int(variances['Variance'].sum()):+d} units", delta_color="off")
+        col3.metric("Value Variance", f"${variances['Value Variance'].sum():+,.2f}")
+        if not variances.empty:
+            st.dataframe(variances, hide_index=True, use_container_width=True, column_config={
+                'Value Variance': st.column_config.NumberColumn(format="$%.2f")
+            })
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            commit = st.button(f"✅ Commit Count ({len(variances)} adjustment(s))", type="primary",
+                               disabled=counted.empty)
+        with col2:
+            if st.button("Discard Count"):
+                st.session_state.cycle_count = None
+                _flash("Count discarded")
+        
+        if commit:
+            counts = [
+                {'item': items_by_id[row['id']], 'expected': int(row['Expected']), 'counted': int(row['Counted'])}
+                for row in counted.to_dict('records')
+            ]
+            applied = commit_cycle_count(count['id'], counts, st.session_state.user['username'],
+                                         scope=f"category:{count['category']}", started_at=count['started_at'],
+                                         key=write_key('cycle_count'))
+            variance_count = sum(1 for row in counts if row['counted'] != row['expected'])
+            if applied == variance_count:
+                rotate_write_key('cycle_count')
+                st.session_state.cycle_count = None
+                for row in counts:
+                    item = row['item']
+                    # Sharded items already add their shards to the quantity on every read
+                    if row['counted'] == row['expected'] or item.get('num_shards'):
+                        continue
+                    quantity = item.get('quantity', 0) + row['counted'] - row['expected']
+                    patch_local_item(dict(item, quantity=quantity, total_value=quantity * item.get('price', 0.0)))
+                _flash(f"Count committed: {len(counts)} item(s) counted, {applied} adjusted")
+    
+    except Exception as e:
+        st.error(f"Error running cycle count: {e}")
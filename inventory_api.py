@@ -0,0 +1,232 @@
+import math
+import uuid
+
+from firebase_admin import firestore
+
+from firebase_config import (
+    get_db,
+    get_write_queue,
+    commit_writes,
+    wait_for_writes,
+    normalize_sku,
+    sku_ref,
+    claim_sku,
+    release_sku_claims,
+    release_sku_write,
+    locations_collection,
+    inventory_collection,
+    inventory_queries,
+    item_from_doc,
+    resolve_sharded_quantities,
+    stock_adjustment_writes,
+    STOCK_MOVEMENT_TYPES,
+    summary_change,
+    tombstone_write,
+    ADJUSTMENT_CHUNK_SIZE
+)
+
+# Headless inventory operations for the CLI and HTTP service. Unlike the
+# page helpers in firebase_config these raise instead of calling st.error.
+
+# Item writes (plus a released SKU when one is recoded) and one summary
+# write per location stay under 500 per batch
+UPSERT_CHUNK_SIZE = 240
+# Deletes also write a tombstone and release the SKU of each item
+DELETE_CHUNK_SIZE = 160
+
+ITEM_FIELDS = ['name', 'sku', 'category', 'quantity', 'price', 'description', 'supplier']
+
+
+def _require_db():
+    db = get_db()
+    if not db:
+        raise ConnectionError("Database connection failed")
+    return db
+
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield start, values[start:start + size]
+
+
+def _number(record, field, integer=False, minimum=None):
+    """Coerce a numeric field of an input record; raises ValueError for anything else"""
+    value = record[field]
+    try:
+        if isinstance(value, bool):
+            raise TypeError(field)
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{field}' must be a number, not {value!r}")
+    if not math.isfinite(number) or (integer and not number.is_integer()):
+        raise ValueError(f"'{field}' must be a {'whole' if integer else 'finite'} number, not {value!r}")
+    if minimum is not None and number < minimum:
+        raise ValueError(f"'{field}' must be at least {minimum}, not {value!r}")
+    return int(number) if integer else number
+
+
+def _checked_item(item):
+    item = dict(item)
+    if 'quantity' in item:
+        item['quantity'] = _number(item, 'quantity', integer=True, minimum=0)
+    if 'price' in item:
+        item['price'] = _number(item, 'price', minimum=0)
+    return item
+
+
+def _checked_adjustment(adjustment):
+    if adjustment['type'] not in STOCK_MOVEMENT_TYPES:
+        raise ValueError(f"'type' must be one of {', '.join(STOCK_MOVEMENT_TYPES)}, not {adjustment['type']!r}")
+    return dict(adjustment, quantity=_number(adjustment, 'quantity', integer=True))
+
+
+def _get_existing(db, location, ids):
+    """Read a chunk of items by id in one round trip"""
+    refs = [inventory_collection(db, location).document(item_id) for item_id in ids]
+    return {doc.id: item_from_doc(doc) for doc in db.get_all(refs) if doc.exists}
+
+
+def stream_items(location, fields=None):
+    """Yield the items of a location (or all locations) as they arrive"""
+    db = _require_db()
+    for query in inventory_queries(db, location):
+        if fields:
+            query = query.select(list(fields))
+
+        for doc in query.stream():
+            item = item_from_doc(doc)
+            if item.get('num_shards'):
+                resolve_sharded_quantities([item])
+            yield item
+
+
+def get_items(location, ids):
+    """Get items by id; missing ids are skipped"""
+    db = _require_db()
+    items = []
+    for _, chunk in _chunks(list(ids), UPSERT_CHUNK_SIZE):
+        found = _get_existing(db, location, chunk)
+        items.extend(found[item_id] for item_id in chunk if item_id in found)
+    return resolve_sharded_quantities(items)
+
+
+def get_item_by_sku(location, sku):
+    """Get an item through its SKU index document; None if the SKU is unknown"""
+    db = _require_db()
+    index = sku_ref(db, location, normalize_sku(sku)).get()
+    if not index.exists:
+        return None
+    items = get_items(location, [index.get('item_id')])
+    return items[0] if items else None
+
+
+def upsert_items(items, location, username, key=None):
+    """Create or update items in batched commits.
+
+    Items with an 'id' that exists are updated with the given fields;
+    everything else is created. Returns (ids, status). Raises ValueError
+    for invalid fields before anything is written.
+    """
+    items = [_checked_item(item) for item in items]
+    db = _require_db()
+    key = key or uuid.uuid4().hex
+    ids = []
+    keys = []
+    claims = {}
+
+    for start, chunk in _chunks(list(items), UPSERT_CHUNK_SIZE):
+        existing = _get_existing(db, location, [item['id'] for item in chunk if item.get('id')])
+        writes = []
+        group_key = f"{key}-{start}"
+        claims[group_key] = []
+
+        try:
+            for item in chunk:
+                data = {field: item[field] for field in ITEM_FIELDS if field in item}
+                old = existing.get(item.get('id'))
+                item_ref = inventory_collection(db, location).document(item['id']) if item.get('id') else inventory_collection(db, location).document()
+                if 'sku' in data:
+                    data['sku'] = normalize_sku(data['sku'])
+                    old_sku = (old or {}).get('sku')
+                    if data['sku'] != old_sku:
+                        if data['sku']:
+                            claim_sku(db, location, data['sku'], item_ref.id)
+                            claims[group_key].append((location, data['sku'], item_ref.id))
+                        if old_sku:
+                            writes.append(release_sku_write(db, location, old_sku))
+                new = dict(old or {}, **data)
+                data.update({
+                    'location': location,
+                    'total_value': new.get('quantity', 0) * new.get('price', 0.0),
+                    'last_updated': firestore.SERVER_TIMESTAMP,
+                    'updated_by' if old else 'created_by': username
+                })
+                if not old:
+                    data['created_at'] = firestore.SERVER_TIMESTAMP
+
+                writes.append(('set', item_ref, data, bool(old)))
+                writes.append(('set', locations_collection(db).document(location), summary_change(old=old, new=new), True))
+                ids.append(item_ref.id)
+
+            if commit_writes(writes, group_key, wait=0) != 'duplicate':
+                keys.append(group_key)
+        except Exception:
+            # Nothing of this chunk was queued, so its claims have no item to back them
+            release_sku_claims(db, claims[group_key])
+            raise
+
+    status = wait_for_writes(keys)
+    # SKUs claimed for chunks the database rejected would otherwise stay taken
+    queue = get_write_queue()
+    for group_key in keys:
+        if queue.status(group_key) == 'failed':
+            release_sku_claims(db, claims[group_key])
+    return ids, status
+
+
+def adjust_items(adjustments, location, username, key=None):
+    """Apply stock movements given as {'id', 'type', 'quantity', 'reason'}; returns (applied, status)"""
+    adjustments = [_checked_adjustment(adjustment) for adjustment in adjustments]
+    db = _require_db()
+    key = key or uuid.uuid4().hex
+    applied = 0
+    keys = []
+
+    for start, chunk in _chunks(list(adjustments), ADJUSTMENT_CHUNK_SIZE):
+        existing = _get_existing(db, location, [adjustment['id'] for adjustment in chunk])
+        resolved = [
+            dict(adjustment, item=existing[adjustment['id']])
+            for adjustment in chunk if adjustment['id'] in existing
+        ]
+        writes, chunk_applied = stock_adjustment_writes(db, resolved, username)
+        group_key = f"{key}-{start}"
+        if writes and commit_writes(writes, group_key, wait=0) != 'duplicate':
+            keys.append(group_key)
+        applied += chunk_applied
+
+    return applied, wait_for_writes(keys)
+
+
+def delete_items(ids, location, key=None):
+    """Delete items by id in batched commits; returns (deleted, status)"""
+    db = _require_db()
+    key = key or uuid.uuid4().hex
+    deleted = 0
+    keys = []
+
+    for start, chunk in _chunks(list(ids), DELETE_CHUNK_SIZE):
+        existing = _get_existing(db, location, chunk)
+        writes = []
+        for item in existing.values():
+            writes.append(('delete', inventory_collection(db, location).document(item['id']), None, False))
+            writes.append(('set', locations_collection(db).document(location), summary_change(old=item), True))
+            writes.append(tombstone_write(db, dict(item, location=location)))
+            if item.get('sku'):
+                writes.append(release_sku_write(db, location, item['sku']))
+
+        group_key = f"{key}-{start}"
+        if writes and commit_writes(writes, group_key, wait=0) != 'duplicate':
+            keys.append(group_key)
+        deleted += len(existing)
+
+    return deleted, wait_for_writes(keys)
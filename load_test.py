@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pandas as pd
+
+# Local state (write queue, snapshots) must not touch the real data dir
+os.environ.setdefault('INVENTORY_DATA_DIR', tempfile.mkdtemp(prefix='inventory-load-'))
+
+import firebase_admin
+from firebase_admin import firestore
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.testing.v1 import AppTest
+
+from analytics import get_analytics_engine
+from fake_firestore import FakeFirestore
+from models import decode_item, items_frame
+
+# Drives main.py (MultiApp) through Streamlit's AppTest with many simulated
+# sessions against an in-memory Firestore that counts and delays operations:
+#   python load_test.py --sessions 1,4,16 --iterations 3 --latency 0.02
+# Every session logs in and repeats the scenarios; each AppTest run is one
+# rerun of the whole script.
+#   python load_test.py --decode-benchmark 100000
+# instead compares decoding documents into dicts and into InventoryItem records.
+
+SCENARIOS = ['browse', 'search', 'add', 'update', 'report']
+CATEGORIES = ["Electronics", "Clothing", "Food", "Books", "Other"]
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def seed(db, users, items, location='main'):
+    """Create approved users and a location with items and a matching summary"""
+    now = datetime.now(timezone.utc)
+    batch = db.batch()
+    batch.set(db.collection('users').document('admin'), {
+        'username': 'admin', 'password': 'admin', 'email': 'admin@example.com',
+        'role': 'admin', 'status': 'approved', 'location': location, 'created_at': now
+    })
+    for index in range(users):
+        batch.set(db.collection('users').document(f"user{index}"), {
+            'username': f"user{index}", 'password': 'secret', 'email': f"user{index}@example.com",
+            'role': 'user', 'status': 'approved', 'location': location, 'created_at': now
+        })
+
+    summary = {'item_count': 0, 'total_quantity': 0, 'total_value': 0.0, 'category_counts': {}}
+    rng = random.Random(0)
+    for index in range(items):
+        quantity = rng.randint(0, 200)
+        price = round(rng.uniform(1, 500), 2)
+        category = rng.choice(CATEGORIES)
+        batch.set(db.collection('locations').document(location).collection('inventory').document(f"item{index:06d}"), {
+            'name': f"Item {index}", 'category': category, 'quantity': quantity, 'price': price,
+            'total_value': quantity * price, 'description': '', 'supplier': '', 'location': location,
+            'created_by': 'admin', 'created_at': now, 'last_updated': now
+        })
+        summary['item_count'] += 1
+        summary['total_quantity'] += quantity
+        summary['total_value'] += quantity * price
+        summary['category_counts'][category] = summary['category_counts'].get(category, 0) + 1
+    batch.set(db.collection('locations').document(location), dict(summary, last_updated=now))
+    batch.commit()
+
+
+def install(db):
+    """Point firebase_config.get_db at the fake client"""
+    firebase_admin._apps.setdefault('[DEFAULT]', None)
+    firestore.client = lambda app=None: db
+
+
+def share_test_runtime():
+    """Let AppTest runs overlap across threads.
+
+    AppTest installs a mock Runtime singleton for each run and clears it
+    afterwards, which breaks any other run still in progress. Fall back to
+    one shared mock whenever none is installed.
+    """
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak rather than current outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _widget(widgets, label):
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"no widget labelled {label!r}")
+
+
+class SimulatedSession:
+    """One browser session scripted through AppTest"""
+
+    def __init__(self, username, password, timeout):
+        self.username = username
+        self.password = password
+        self.app = AppTest.from_file(APP_FILE, default_timeout=timeout)
+        self.latencies = []
+        self.errors = []
+        self.scenario = 'login'
+        self.empty_runs = 0
+        self.lost_selections = 0
+
+    def _run(self, page=None, widget=None):
+        if page:
+            self.app.session_state['page_redirect'] = page
+        started = time.perf_counter()
+        (widget or self.app).run()
+        if not list(self.app.main) and not list(self.app.sidebar):
+            # Overlapping AppTest runs occasionally return an empty tree;
+            # count it and run again rather than fail the session
+            self.empty_runs += 1
+            if page:
+                self.app.session_state['page_redirect'] = page
+            (widget or self.app).run()
+        self.latencies.append((self.scenario, time.perf_counter() - started))
+        self.errors.extend(element.value for element in self.app.error)
+        self.errors.extend(str(element.value) for element in self.app.exception)
+
+    def login(self):
+        self._run()
+        _widget(self.app.text_input, "Username").input(self.username)
+        _widget(self.app.text_input, "Password").input(self.password)
+        self._run(widget=_widget(self.app.button, "🔑 Login").click())
+
+    def browse(self):
+        self._run()
+
+    def search(self):
+        self._run('inventory')
+        select = _widget(self.app.selectbox, "Select item to update:")
+        if len(select.options) > 1:
+            select.select_index(random.randrange(1, len(select.options)))
+            self._run('inventory')
+
+    def add(self):
+        self._run('inventory')
+        _widget(self.app.text_input, "Item Name").input(f"Load {self.username} {random.randrange(10 ** 6)}")
+        _widget(self.app.number_input, "Quantity").set_value(random.randint(1, 50))
+        _widget(self.app.number_input, "Price per Unit").set_value(round(random.uniform(1, 100), 2))
+        self.app.session_state['page_redirect'] = 'inventory'
+        self._run(widget=_widget(self.app.button, "Add Item").click())
+
+    def update(self):
+        self._run('inventory')
+        select = _widget(self.app.selectbox, "Select item to update:")
+        if len(select.options) < 2:
+            return
+        select.select_index(random.randrange(1, len(select.options)))
+        self._run('inventory')
+        if not any(button.label == "Update Item" for button in self.app.button):
+            # The option labels include the quantity, so another session's
+            # write between the two runs can clear the selection
+            self.lost_selections += 1
+            return
+        quantity = [widget for widget in self.app.number_input if widget.label == "Quantity"][-1]
+        quantity.set_value(random.randint(0, 200))
+        self.app.session_state['page_redirect'] = 'inventory'
+        self._run(widget=_widget(self.app.button, "Update Item").click())
+
+    def report(self):
+        self._run('reports')
+
+    def play(self, iterations, scenarios):
+        self.login()
+        for _ in range(iterations):
+            for scenario in scenarios:
+                self.scenario = scenario
+                getattr(self, scenario)()
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def run_level(db, concurrency, iterations, scenarios, timeout):
+    """Run concurrency sessions at once; returns the measurements of the level"""
+    reads_before = db.counts['reads']
+    rpcs_before = db.counts['rpcs']
+    rss_before = _rss_bytes()
+
+    sessions = [SimulatedSession(f"user{index}", 'secret', timeout) for index in range(concurrency)]
+    failures = []
+
+    def play(session):
+        try:
+            session.play(iterations, scenarios)
+        except Exception as e:
+            failures.append(f"{session.username} ({session.scenario}): {type(e).__name__}: {e}")
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=play, args=(session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    # Sessions are still referenced here, so their memory is still counted
+    rss_after = _rss_bytes()
+    latencies = [latency for session in sessions for _, latency in session.latencies]
+    by_scenario = {}
+    for session in sessions:
+        for scenario, latency in session.latencies:
+            by_scenario.setdefault(scenario, []).append(latency)
+    errors = [error for session in sessions for error in session.errors]
+
+    return {
+        'sessions': concurrency,
+        'reruns': len(latencies),
+        'seconds': round(elapsed, 2),
+        'reruns_per_second': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 1),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        'memory_per_session_kb': round(max(0, rss_after - rss_before) / concurrency / 1024),
+        'reads_per_session': round((db.counts['reads'] - reads_before) / concurrency, 1),
+        'rpcs_per_session': round((db.counts['rpcs'] - rpcs_before) / concurrency, 1),
+        'scenario_p50_ms': {
+            scenario: round(_percentile(values, 50) * 1000, 1) for scenario, values in by_scenario.items()
+        },
+        'empty_runs': sum(session.empty_runs for session in sessions),
+        'lost_selections': sum(session.lost_selections for session in sessions),
+        'app_errors': len(errors),
+        'error_samples': sorted(set(errors))[:5],
+        'failed_sessions': failures
+    }
+
+
+def _measure(build):
+    """Run build() twice, timed and then traced; returns (result, seconds, bytes it holds)"""
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    # Tracing slows allocation down too much to time the same run
+    tracemalloc.start()
+    traced = build()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del traced
+    return result, elapsed, held
+
+
+def decode_benchmark(count):
+    """Time and size decoding count item documents as dicts and as records, and framing them"""
+    now = datetime.now(timezone.utc)
+    rng = random.Random(0)
+    documents = [(f"item{index:06d}", {
+        'name': f"Item {index}", 'category': rng.choice(CATEGORIES), 'quantity': rng.randint(0, 200),
+        'price': round(rng.uniform(1, 500), 2), 'total_value': 0.0, 'description': '', 'supplier': '',
+        'location': 'main', 'created_by': 'admin', 'created_at': now, 'last_updated': now
+    }) for index in range(count)]
+
+    def as_dicts():
+        items = []
+        for doc_id, data in documents:
+            item = dict(data)
+            item['id'] = doc_id
+            items.append(item)
+        return items
+
+    dicts, dict_seconds, dict_bytes = _measure(as_dicts)
+    records, record_seconds, record_bytes = _measure(lambda: [decode_item(data, doc_id) for doc_id, data in documents])
+    columns = ['id', 'name', 'category', 'quantity', 'price', 'location']
+
+    def dict_frame():
+        # Dicts carry whatever the document held, so the frame has to be coerced
+        df = pd.DataFrame(dicts, columns=columns)
+        df['quantity'] = pd.to_numeric(df['quantity'], errors='coerce').fillna(0)
+        df['price'] = pd.to_numeric(df['price'], errors='coerce').fillna(0.0)
+        df['category'] = df['category'].fillna('Other')
+        return df
+
+    _, dict_frame_seconds, _ = _measure(dict_frame)
+    _, record_frame_seconds, _ = _measure(lambda: items_frame(records, columns))
+
+    per = 100_000 / count
+    return {
+        'documents': count,
+        'dict_decode_ms_per_100k': round(dict_seconds * per * 1000, 1),
+        'record_decode_ms_per_100k': round(record_seconds * per * 1000, 1),
+        'dict_mb_per_100k': round(dict_bytes * per / 1024 / 1024, 1),
+        'record_mb_per_100k': round(record_bytes * per / 1024 / 1024, 1),
+        'dict_frame_ms_per_100k': round(dict_frame_seconds * per * 1000, 1),
+        'record_frame_ms_per_100k': round(record_frame_seconds * per * 1000, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test against an in-memory Firestore")
+    parser.add_argument('--sessions', default='1,2,4,8', help="comma-separated concurrency levels")
+    parser.add_argument('--iterations', type=int, default=2, help="scenario rounds per session")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--items', type=int, default=500, help="seeded inventory items")
+    parser.add_argument('--latency', type=float, default=0.01, help="seconds added to every Firestore RPC")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds allowed per rerun")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per level")
+    parser.add_argument('--decode-benchmark', type=int, metavar='DOCUMENTS',
+                        help="only compare decoding this many documents into dicts and into records")
+    args = parser.parse_args(argv)
+
+    if args.decode_benchmark:
+        result = decode_benchmark(args.decode_benchmark)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            for name, value in result.items():
+                print(f"{name:>26} {value}")
+        return 0
+
+    levels = [int(level) for level in args.sessions.split(',')]
+    scenarios = [scenario for scenario in args.scenarios.split(',') if scenario]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    db = FakeFirestore(latency=args.latency)
+    seed(db, max(levels), args.items)
+    install(db)
+    share_test_runtime()
+
+    header = f"{'sessions':>8} {'reruns':>7} {'rerun/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'KB/sess':>8} {'reads/sess':>10} {'errors':>6}"
+    try:
+        # One untimed session first, so imports and the analytics pool are not billed to level 1
+        run_level(db, 1, 1, scenarios, args.timeout)
+
+        if not args.json:
+            print(header)
+        for level in levels:
+            result = run_level(db, level, args.iterations, scenarios, args.timeout)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{result['sessions']:>8} {result['reruns']:>7} {result['reruns_per_second']:>8} "
+                      f"{result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+                      f"{result['memory_per_session_kb']:>8} {result['reads_per_session']:>10} {result['app_errors']:>6}")
+                for failure in result['failed_sessions'] + result['error_samples']:
+                    print(f"  {failure}", file=sys.stderr)
+    finally:
+        get_analytics_engine().shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
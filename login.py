@@ -3,7 +3,9 @@ from firebase_config import (
     authenticate_user,
     create_pending_user,
     check_username_exists,
-    check_email_exists
+    check_email_exists,
+    tenant_exists,
+    DEFAULT_TENANT
 )
 
 def login_page():
@@ -87,6 +89,8 @@ def show_register_form():
             full_name = st.text_input("Full Name*", placeholder="Enter your full name")
             department = st.text_input("Department", placeholder="Your department (optional)")
         
+        organization = st.text_input("Organization Code", placeholder="Leave blank unless your administrator gave you one")
+        
         password = st.text_input("Password*", type="password", placeholder="Enter password (min 6 characters)")
         confirm_password = st.text_input("Confirm Password*", type="password", placeholder="Confirm your password")
         
@@ -113,6 +117,11 @@ def show_register_form():
                 st.error("❌ Passwords do not match")
                 return
             
+            tenant = organization.strip() or DEFAULT_TENANT
+            if not tenant_exists(tenant):
+                st.error("❌ Unknown organization code. Please check it with your administrator.")
+                return
+            
             # Check if username or email already exists
             if check_username_exists(username):
                 st.error("❌ Username already exists. Please choose a different one.")
@@ -131,7 +140,8 @@ def show_register_form():
                 'password': password,
                 'reason': reason,
                 'role': 'user',
-                'status': 'pending'
+                'status': 'pending',
+                'tenant': tenant
             }
             
             if create_pending_user(user_data):
@@ -1,9 +1,18 @@
 import streamlit as st
 from streamlit_option_menu import option_menu
-import os
-import home, inventory, reports, account, about, login
-from PIL import Image
-from firebase_config import initialize_firebase
+from datetime import datetime
+import home, inventory, reports, pricing, account, about, login
+from profiling import profile_run, list_profiles
+from firebase_config import (
+    initialize_firebase,
+    ALL_LOCATIONS,
+    DEFAULT_LOCATION,
+    DEFAULT_TENANT,
+    location_label,
+    list_locations,
+    get_write_queue,
+    get_read_allowance
+)
 
 # Set page configuration as the first command
 st.set_page_config(
@@ -58,6 +67,7 @@ class MultiApp:
             redirect_map = {
                 "inventory": "Inventory",
                 "reports": "Reports", 
+                "pricing": "Pricing",
                 "account": "Account"
             }
             
@@ -72,8 +82,8 @@ class MultiApp:
             if user.get('role') == 'admin':
                 app = option_menu(
                     menu_title='Admin Panel',
-                    options=['Home', 'Inventory', 'Reports', 'Account', 'About'],
-                    icons=['house-fill', 'box-seam', 'graph-up', 'person-circle', 'info-circle-fill'],
+                    options=['Home', 'Inventory', 'Reports', 'Pricing', 'Account', 'About'],
+                    icons=['house-fill', 'box-seam', 'graph-up', 'currency-dollar', 'person-circle', 'info-circle-fill'],
                     menu_icon='gear-fill',
                     default_index=0,
                     key='admin_menu',
@@ -87,6 +97,17 @@ class MultiApp:
                 
                 st.markdown("---")
                 st.success("🛡️ Welcome Admin!")
+                
+                # Admins can scope the pages to any location or all of them
+                location_options = [ALL_LOCATIONS] + (list_locations() or [DEFAULT_LOCATION])
+                own_location = user.get('location', DEFAULT_LOCATION)
+                st.selectbox(
+                    "Location",
+                    location_options,
+                    index=location_options.index(own_location) if own_location in location_options else 0,
+                    format_func=location_label,
+                    key='active_location'
+                )
             else:
                 app = option_menu(
                     menu_title='Inventory System',
@@ -103,6 +124,44 @@ class MultiApp:
                     }
                 )
                 st.success(f"👤 Welcome, {user.get('username', 'User')}!")
+                st.caption(location_label(user.get('location', DEFAULT_LOCATION)))
+            if user.get('tenant', DEFAULT_TENANT) != DEFAULT_TENANT:
+                st.caption(f"🏢 {user['tenant']}")
+
+            # Writes accepted locally but not yet in Firestore
+            write_counts = get_write_queue().counts()
+            if write_counts['pending']:
+                st.info(f"⏳ {write_counts['pending']} change(s) waiting to sync")
+            if write_counts['failed']:
+                st.warning(f"⚠️ {write_counts['failed']} change(s) were rejected by the database")
+                if user.get('role') == 'admin':
+                    with st.expander("Rejected Changes"):
+                        for key, error, created_at in get_write_queue().failed_groups():
+                            st.caption(f"{datetime.fromtimestamp(created_at):%Y-%m-%d %H:%M} · {key}: {error}")
+                        if st.button("Discard Rejected Changes"):
+                            get_write_queue().discard_failed()
+                            st.rerun()
+
+            # Reads left before pages fall back to the last data read
+            if user.get('role') == 'admin':
+                allowance = get_read_allowance()
+                st.caption(f"📖 Reads left: {allowance['daily_budget'] - allowance['daily_used']:,} today · "
+                           f"{allowance['tenant_available']:,} burst · {allowance['session_available']:,} this session")
+                if allowance['breaker_state'] != 'closed':
+                    st.warning(f"🔌 Database reads paused ({allowance['breaker_state'].replace('_', '-')} circuit)")
+
+            # Capture where a slow page spends its time
+            if user.get('role') == 'admin':
+                with st.expander("🔬 Profiling"):
+                    st.toggle("Profile this session", key='profiling',
+                              help="Opening the app with ?profile=1 also profiles your session")
+                    for name, summary_path, folded_path in list_profiles(5):
+                        st.caption(name)
+                        col1, col2 = st.columns(2)
+                        with col1, open(summary_path) as summary:
+                            st.download_button("📄 Summary", summary.read(), file_name=f"{name}.txt", key=f"profile_txt_{name}")
+                        with col2, open(folded_path) as folded:
+                            st.download_button("🔥 Flame graph", folded.read(), file_name=f"{name}.folded", key=f"profile_folded_{name}")
 
             # Add some spacing
             st.markdown("<br>" * 2, unsafe_allow_html=True)
@@ -131,6 +190,10 @@ class MultiApp:
             app = st.session_state.selected_page
             del st.session_state.selected_page
 
+        # Filled in after the page if it showed data older than this run
+        st.session_state.pop('data_as_of', None)
+        stale_banner = st.empty()
+
         # Page navigation based on selected option
         if app == "Home":
             home.app()
@@ -138,11 +201,19 @@ class MultiApp:
             inventory.app()
         elif app == "Reports":
             reports.app()
+        elif app == "Pricing":
+            pricing.app()
         elif app == "Account":
             account.app()
         elif app == "About":
             about.app()
 
+        if st.session_state.get('data_as_of'):
+            as_of = st.session_state.data_as_of.astimezone()
+            stale_banner.warning(f"📉 Showing data as of {as_of:%Y-%m-%d %H:%M:%S}: the database is slow or the "
+                                 "read limit was reached. It refreshes automatically.")
+
 # Run the application
 if __name__ == "__main__":
-    MultiApp().run()
+    with profile_run():
+        MultiApp().run()
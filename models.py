@@ -0,0 +1,253 @@
+import math
+from dataclasses import dataclass
+from datetime import datetime
+from operator import attrgetter
+
+import numpy as np
+import pandas as pd
+
+# Typed records for Firestore documents. decode_item / decode_user take a
+# document's data as stored, coerce the known fields to their types and
+# fill defaults, so a missing or mistyped field can't crash a page; fields
+# the record doesn't know are kept in `extra`. Records use __slots__, so an
+# item takes about half the memory of the equivalent dict, and frames are
+# built from their typed fields without coercing columns again (see
+# `python load_test.py --decode-benchmark 100000`). Building a record costs
+# more than copying a dict, so documents are decoded once per version and
+# pages that still work on dicts get them from the snapshot's cached
+# to_dict() views (see LocationSnapshot.view), which leave out None fields.
+
+ITEM_NUMBER_COLUMNS = {'quantity': np.int64, 'price': np.float64, 'total_value': np.float64, 'num_shards': np.int64}
+# Numeric fields an item may not have; NaN in a frame
+ITEM_OPTIONAL_NUMBER_COLUMNS = ('lead_time_days', 'daily_demand', 'safety_stock', 'reorder_point', 'suggested_order_qty')
+
+
+@dataclass(slots=True)
+class InventoryItem:
+    id: str
+    name: str = ''
+    category: str = 'Other'
+    quantity: int = 0
+    price: float = 0.0
+    total_value: float = 0.0
+    location: str | None = None
+    sku: str | None = None
+    supplier: str = ''
+    description: str = ''
+    photo: str | None = None
+    num_shards: int = 0
+    abc_class: str | None = None
+    lead_time_days: float | None = None
+    daily_demand: float | None = None
+    safety_stock: float | None = None
+    reorder_point: float | None = None
+    suggested_order_qty: int | None = None
+    created_by: str | None = None
+    updated_by: str | None = None
+    created_at: datetime | None = None
+    last_updated: datetime | None = None
+    # Fields the record doesn't know; None rather than an empty dict per item
+    extra: dict | None = None
+
+    def get(self, name, default=None):
+        """Get a field, known or extra, like dict.get"""
+        if name in _DECODED_ITEM_FIELDS:
+            value = getattr(self, name)
+        else:
+            value = self.extra.get(name) if self.extra else None
+        return default if value is None else value
+
+    def to_dict(self):
+        item = {name: value for name, value in zip(ITEM_FIELDS, _item_values(self)) if value is not None}
+        if self.extra:
+            item.update(self.extra)
+        return item
+
+
+@dataclass(slots=True)
+class User:
+    id: str
+    username: str = ''
+    email: str = ''
+    role: str = 'user'
+    # No default: a user without a known status must not be taken as approved
+    status: str | None = None
+    tenant: str | None = None
+    location: str | None = None
+    password: str | None = None
+    created_at: datetime | None = None
+    extra: dict | None = None
+
+    def to_dict(self):
+        user = {name: value for name, value in zip(_USER_FIELDS, _user_values(self)) if value is not None}
+        if self.extra:
+            user.update(self.extra)
+        return user
+
+
+ITEM_FIELDS = tuple(name for name in InventoryItem.__dataclass_fields__ if name != 'extra')
+_USER_FIELDS = tuple(name for name in User.__dataclass_fields__ if name != 'extra')
+_item_values = attrgetter(*ITEM_FIELDS)
+_DECODED_ITEM_FIELDS = frozenset(ITEM_FIELDS)
+# The fields of a typical item; documents with only these skip the optional ones
+_COMMON_ITEM_FIELDS = frozenset(('id', 'name', 'category', 'quantity', 'price', 'total_value', 'location', 'supplier',
+                                 'description', 'num_shards', 'created_by', 'created_at', 'last_updated'))
+_DECODED_USER_FIELDS = frozenset(_USER_FIELDS)
+_user_values = attrgetter(*_USER_FIELDS)
+
+
+def _int(value, default=0):
+    if type(value) is int:
+        return value
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return int(value) if math.isfinite(value) else default
+
+
+def _float(value, default=0.0):
+    if type(value) is float:
+        return value if math.isfinite(value) else default
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if math.isfinite(value) else default
+
+
+def _optional_float(value):
+    return None if value is None else _float(value, None)
+
+
+def _optional_int(value):
+    return None if value is None else _int(value, None)
+
+
+def _text(value, default=''):
+    if type(value) is str:
+        return value
+    return default if value is None else str(value)
+
+
+def _optional_text(value):
+    if value is None or value == '':
+        return None
+    return value if type(value) is str else str(value)
+
+
+def _time(value):
+    return value if isinstance(value, datetime) else None
+
+
+def decode_item(data, item_id=None, location=None):
+    """Build an InventoryItem from a document's data (or an item dict carrying its id)"""
+    data = data or {}
+    get = data.get
+    name = get('name', '')
+    category = get('category')
+    quantity = get('quantity', 0)
+    price = get('price', 0.0)
+    total_value = get('total_value')
+    item_location = get('location')
+    supplier = get('supplier', '')
+    description = get('description', '')
+    num_shards = get('num_shards', 0)
+    created_by = get('created_by')
+    created_at = get('created_at')
+    last_updated = get('last_updated')
+    # Well-formed documents skip the coercion, and the optional fields most items lack
+    if not (type(name) is str and type(category) is str and category and type(quantity) is int
+            and type(price) is float and math.isfinite(price) and type(total_value) is float
+            and type(item_location) is str and item_location and type(supplier) is str
+            and type(description) is str and type(num_shards) is int
+            and (created_by is None or type(created_by) is str)):
+        name = _text(name)
+        category = _text(category) or 'Other'
+        quantity = _int(quantity)
+        price = _float(price)
+        total_value = quantity * price if total_value is None else _float(total_value)
+        item_location = _optional_text(item_location) or location
+        supplier = _text(supplier)
+        description = _text(description)
+        num_shards = _int(num_shards)
+        created_by = _optional_text(created_by)
+
+    keys = data.keys()
+    if keys <= _COMMON_ITEM_FIELDS:
+        item = InventoryItem(
+            get('id') or item_id, name, category, quantity, price, total_value, item_location,
+            None, supplier, description, None, num_shards, None, None, None, None, None, None,
+            created_by, None,
+            created_at if isinstance(created_at, datetime) else None,
+            last_updated if isinstance(last_updated, datetime) else None
+        )
+    else:
+        item = InventoryItem(
+            get('id') or item_id, name, category, quantity, price, total_value, item_location,
+            _optional_text(get('sku')),
+            supplier,
+            description,
+            _optional_text(get('photo')),
+            num_shards,
+            _optional_text(get('abc_class')),
+            _optional_float(get('lead_time_days')),
+            _optional_float(get('daily_demand')),
+            _optional_float(get('safety_stock')),
+            _optional_float(get('reorder_point')),
+            _optional_int(get('suggested_order_qty')),
+            created_by,
+            _optional_text(get('updated_by')),
+            created_at if isinstance(created_at, datetime) else None,
+            last_updated if isinstance(last_updated, datetime) else None
+        )
+        if not keys <= _DECODED_ITEM_FIELDS:
+            item.extra = {name: value for name, value in data.items()
+                          if name not in _DECODED_ITEM_FIELDS and value is not None} or None
+    return item
+
+
+def decode_user(data, user_id=None):
+    """Build a User from a document's data"""
+    data = data or {}
+    get = data.get
+    user = User(
+        get('id') or user_id,
+        _text(get('username')),
+        _text(get('email')),
+        _text(get('role')) or 'user',
+        _optional_text(get('status')),
+        _optional_text(get('tenant')),
+        _optional_text(get('location')),
+        _optional_text(get('password')),
+        _time(get('created_at'))
+    )
+    if not data.keys() <= _DECODED_USER_FIELDS:
+        user.extra = {name: value for name, value in data.items()
+                      if name not in _DECODED_USER_FIELDS and value is not None} or None
+    return user
+
+
+def item_columns(items):
+    """Get the fields set on any of the items, known fields first"""
+    columns = [name for name in ITEM_FIELDS if any(getattr(item, name) is not None for item in items)]
+    for item in items:
+        for name in item.extra or ():
+            if name not in columns:
+                columns.append(name)
+    return columns
+
+
+def items_frame(items, columns=('id', 'name', 'category', 'quantity', 'price', 'total_value', 'location')):
+    """Build a DataFrame of item records' fields, one column at a time"""
+    frame = {}
+    for name in columns:
+        getter = attrgetter(name) if name in ITEM_FIELDS else (lambda item, name=name: item.extra.get(name) if item.extra else None)
+        if name in ITEM_NUMBER_COLUMNS:
+            frame[name] = np.fromiter(map(getter, items), dtype=ITEM_NUMBER_COLUMNS[name], count=len(items))
+        elif name in ITEM_OPTIONAL_NUMBER_COLUMNS:
+            frame[name] = np.array(list(map(getter, items)), dtype=np.float64)
+        else:
+            # An object array is taken as is, where a list would be scanned for its type
+            frame[name] = np.fromiter(map(getter, items), dtype=object, count=len(items))
+    return pd.DataFrame(frame, columns=list(columns))
@@ -0,0 +1,176 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+
+from firebase_config import LOCAL_DATA_DIR
+
+# Item photos are stored by the SHA-256 of their bytes, so the same picture
+# uploaded for many items (or twice) is kept once. WebP thumbnails in every
+# THUMBNAIL_SIZES are made in a process pool when a photo is uploaded; pages
+# only ever load thumbnails. Storage goes through a small object-store
+# interface with a local directory stand-in:
+#   originals/ab/ab12...        as uploaded
+#   thumbs/256/ab/ab12....webp
+
+PHOTO_DIR = os.path.join(LOCAL_DATA_DIR, 'photos')
+THUMBNAIL_SIZES = (64, 256, 1024)
+THUMBNAIL_QUALITY = 80
+MAX_UPLOAD_BYTES = 15 * 1024 * 1024
+MAX_PIXELS = 50_000_000
+# Thumbnails kept in memory, mostly the small list-view size
+THUMBNAIL_CACHE_BYTES = 32 * 1024 * 1024
+
+_store = None
+_pool = None
+_lock = threading.Lock()
+_cache = OrderedDict()
+_cache_bytes = 0
+
+
+class LocalObjectStore:
+    """Object store interface (put/get/exists by key) backed by a directory"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as source:
+                return source.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial object
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as target:
+            target.write(data)
+        os.replace(temp_path, path)
+
+
+def original_key(photo_id):
+    return f"originals/{photo_id[:2]}/{photo_id}"
+
+
+def thumbnail_key(photo_id, size):
+    return f"thumbs/{size}/{photo_id[:2]}/{photo_id}.webp"
+
+
+def make_thumbnails(data, sizes=THUMBNAIL_SIZES):
+    """Decode an image and encode a WebP thumbnail per size (runs in a worker process)"""
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+        thumbnails = {}
+        for size in sorted(sizes, reverse=True):
+            # Each size is reduced from the previous, larger one
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+            thumbnails[size] = output.getvalue()
+        return thumbnails
+
+
+def get_photo_store():
+    """Get the process-wide photo store"""
+    global _store
+    with _lock:
+        if _store is None:
+            _store = LocalObjectStore(PHOTO_DIR)
+        return _store
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn keeps workers independent of the server's threads
+            _pool = ProcessPoolExecutor(max(1, min(4, os.cpu_count() or 1)),
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _check_image(data):
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"Photos are limited to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width * image.height > MAX_PIXELS:
+                raise ValueError("The photo has too many pixels")
+            image.verify()
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError, SyntaxError, OSError) as e:
+        raise ValueError(f"Not a supported image: {e}")
+
+
+def _resize(data):
+    """Make the thumbnails of a photo in the pool; raises ValueError if it cannot be decoded"""
+    global _pool
+    try:
+        return _get_pool().submit(make_thumbnails, data).result()
+    except BrokenProcessPool as e:
+        # A worker died (e.g. out of memory on a huge image); start a new pool next time
+        with _lock:
+            _pool = None
+        raise ValueError(f"The photo could not be processed: {e}")
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError, SyntaxError, OSError, ValueError) as e:
+        raise ValueError(f"Not a supported image: {e}")
+
+
+def store_photo(data):
+    """Store uploaded photo bytes and their thumbnails; returns the photo id.
+
+    A photo already stored (same bytes) is not stored or resized again.
+    Raises ValueError for bytes that are not a supported image.
+    """
+    photo_id = hashlib.sha256(data).hexdigest()
+    store = get_photo_store()
+    if store.exists(thumbnail_key(photo_id, THUMBNAIL_SIZES[0])):
+        return photo_id
+
+    _check_image(data)
+    # Nothing is stored for a photo that cannot be resized
+    thumbnails = _resize(data)
+    store.put(original_key(photo_id), data)
+    # Smallest last: its presence marks the photo as complete
+    for size in sorted(thumbnails, reverse=True):
+        store.put(thumbnail_key(photo_id, size), thumbnails[size])
+    return photo_id
+
+
+def get_thumbnail(photo_id, size=THUMBNAIL_SIZES[0]):
+    """Get the WebP thumbnail bytes of a photo, or None if it has none"""
+    global _cache_bytes
+    key = thumbnail_key(photo_id, size)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    data = get_photo_store().get(key)
+    if data is None:
+        return None
+
+    with _lock:
+        if key not in _cache:
+            _cache[key] = data
+            _cache_bytes += len(data)
+            while _cache_bytes > THUMBNAIL_CACHE_BYTES and len(_cache) > 1:
+                _cache_bytes -= len(_cache.popitem(last=False)[1])
+    return data
@@ -0,0 +1,199 @@
+import streamlit as st
+from firebase_config import (
+    get_db,
+    get_active_location,
+    location_label,
+    get_data_version,
+    get_active_tenant,
+    write_key,
+    rotate_write_key,
+    bulk_update_items
+)
+from snapshot import get_inventory_records, patch_local_item
+from analytics import scenario_prices, compare_price_scenarios
+from models import items_frame
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+MAX_SCENARIOS = 6
+TOP_ITEMS = 10
+RULE_SCOPES = ["All", "Category", "Supplier"]
+
+def catalog_columns(items):
+    """Get the arrays the simulator works on from item records"""
+    df = items_frame(items, ('id', 'name', 'quantity', 'price', 'category', 'supplier'))
+    category_codes, categories = pd.factorize(df['category'])
+    supplier_codes, suppliers = pd.factorize(df['supplier'].replace('', '(none)'))
+    return {
+        'ids': df['id'].to_numpy(),
+        'names': df['name'].to_numpy(),
+        'quantity': df['quantity'].to_numpy(dtype=np.float64),
+        'price': df['price'].to_numpy(),
+        'category': category_codes,
+        'categories': pd.Index(categories),
+        'supplier': supplier_codes,
+        'suppliers': pd.Index(suppliers)
+    }
+
+def get_catalog(location):
+    """Get the catalog columns, rebuilt only when the location's data changes"""
+    key = (get_active_tenant(), location, get_data_version(location))
+    cached = st.session_state.get('pricing_catalog')
+    if not cached or cached[0] != key or key[2] is None:
+        cached = st.session_state.pricing_catalog = (key, catalog_columns(get_inventory_records(location)))
+    return cached[1]
+
+def to_scenario(rules, catalog):
+    """Convert edited rule rows to category and supplier codes"""
+    scenario = {'all': 0.0, 'category': {}, 'supplier': {}}
+    for rule in rules.dropna(subset=['scope', 'change_pct']).to_dict('records'):
+        percent = float(rule['change_pct'])
+        if rule['scope'] == "All":
+            scenario['all'] = (1 + scenario['all'] / 100) * (1 + percent / 100) * 100 - 100
+            continue
+        scope, labels = ('category', 'categories') if rule['scope'] == "Category" else ('supplier', 'suppliers')
+        code = catalog[labels].get_indexer([rule.get('target')])[0]
+        if code >= 0:
+            current = scenario[scope].get(code, 0.0)
+            scenario[scope][code] = (1 + current / 100) * (1 + percent / 100) * 100 - 100
+    return scenario
+
+def edit_scenarios(catalog):
+    """Edit the scenarios' names and rules; returns [(name, rules)]"""
+    if 'pricing_scenarios' not in st.session_state:
+        st.session_state.pricing_scenarios = [1]
+        st.session_state.pricing_next = 2
+    
+    targets = [""] + list(catalog['categories']) + [s for s in catalog['suppliers'] if s not in catalog['categories']]
+    scenarios = []
+    columns = st.columns(min(3, len(st.session_state.pricing_scenarios)))
+    for index, number in enumerate(st.session_state.pricing_scenarios):
+        with columns[index % len(columns)]:
+            name = st.text_input("Scenario", f"Scenario {number}", key=f"pricing_name_{number}")
+            rules = st.data_editor(
+                pd.DataFrame({'scope': ["Category"], 'target': [catalog['categories'][0] if len(catalog['categories']) else ""],
+                              'change_pct': [0.0]}),
+                num_rows="dynamic",
+                hide_index=True,
+                use_container_width=True,
+                key=f"pricing_rules_{number}",
+                column_config={
+                    'scope': st.column_config.SelectboxColumn("Applies to", options=RULE_SCOPES, required=True),
+                    'target': st.column_config.SelectboxColumn("Category / Supplier", options=targets),
+                    'change_pct': st.column_config.NumberColumn("Change (%)", min_value=-100.0, step=0.5, format="%.1f%%")
+                }
+            )
+            if len(st.session_state.pricing_scenarios) > 1 and st.button("🗑️ Remove", key=f"pricing_remove_{number}"):
+                st.session_state.pricing_scenarios.remove(number)
+                st.rerun()
+            scenarios.append((name, rules))
+    
+    if len(st.session_state.pricing_scenarios) < MAX_SCENARIOS and st.button("➕ Add Scenario"):
+        st.session_state.pricing_scenarios.append(st.session_state.pricing_next)
+        st.session_state.pricing_next += 1
+        st.rerun()
+    return scenarios
+
+def show_comparison(catalog, scenarios, results):
+    """Show every scenario's totals, category values and top items next to the current prices"""
+    names = ["Current"] + [name for name, _ in scenarios]
+    current_total = results[0]['total_value']
+    
+    st.subheader("📊 Comparison")
+    st.dataframe(pd.DataFrame({
+        'Scenario': names,
+        'Total Value': [result['total_value'] for result in results],
+        'Change': [result['total_value'] - current_total for result in results],
+        'Change (%)': [(result['total_value'] / current_total - 1) * 100 if current_total else 0.0 for result in results],
+        'Items Repriced': [result['repriced'] for result in results]
+    }), hide_index=True, use_container_width=True, column_config={
+        'Total Value': st.column_config.NumberColumn(format="$%.2f"),
+        'Change': st.column_config.NumberColumn(format="$%.2f"),
+        'Change (%)': st.column_config.NumberColumn(format="%.2f%%")
+    })
+    
+    by_category = pd.DataFrame({
+        name: result['category_value'] for name, result in zip(names, results)
+    }, index=catalog['categories']).rename_axis('category').reset_index()
+    fig_category = px.bar(by_category.melt(id_vars='category', var_name='scenario', value_name='value'),
+                          x='category', y='value', color='scenario', barmode='group',
+                          title="Value by Category")
+    st.plotly_chart(fig_category, use_container_width=True)
+    
+    st.subheader(f"🏆 Top {TOP_ITEMS} Valuable Items")
+    current_rank = {item: rank for rank, item in enumerate(results[0]['top'], 1)}
+    columns = st.columns(min(3, len(results)))
+    for index, (name, result) in enumerate(zip(names, results)):
+        with columns[index % len(columns)]:
+            st.caption(name)
+            st.dataframe(pd.DataFrame({
+                'name': catalog['names'][result['top']],
+                'total_value': result['top_value'],
+                'was': [str(current_rank.get(item, "—")) for item in result['top']]
+            }, index=pd.RangeIndex(1, len(result['top']) + 1, name='rank')), use_container_width=True)
+
+def commit_scenario(location, scenarios):
+    """Write an approved scenario's prices to the repriced items"""
+    st.subheader("✅ Apply a Scenario")
+    names = [name for name, _ in scenarios]
+    choice = st.selectbox("Scenario to apply", range(len(scenarios)), format_func=lambda index: names[index],
+                          key="pricing_commit_choice")
+    # A new submission key after each commit also clears the approval
+    confirmed = st.checkbox(f"I approve the new prices of {names[choice]}",
+                            key=f"pricing_commit_confirm_{write_key('pricing_commit')}")
+    
+    if st.button("💾 Apply Prices", type="primary", disabled=not confirmed):
+        # Recomputed against the current inventory, not the simulated copy
+        items = get_inventory_records(location)
+        catalog = catalog_columns(items)
+        _, rules = scenarios[choice]
+        new_price = scenario_prices(catalog['price'], catalog['category'], catalog['supplier'], to_scenario(rules, catalog),
+                                    len(catalog['categories']), len(catalog['suppliers']))
+        changes = [(items[i].to_dict(), {'price': float(new_price[i])}) for i in np.flatnonzero(new_price != catalog['price'])]
+        if not changes:
+            st.info("This scenario doesn't change any price.")
+            return
+        
+        written = bulk_update_items(changes, st.session_state.user['username'], key=write_key('pricing_commit'))
+        if written:
+            rotate_write_key('pricing_commit')
+            for item, fields in changes[:written]:
+                new_item = dict(item, **fields)
+                patch_local_item(dict(new_item, total_value=new_item.get('quantity', 0) * new_item['price']))
+            st.success(f"Repriced {written:,} items")
+
+def app():
+    st.title("💲 Pricing Simulator")
+    st.caption("Try percentage price changes per category or supplier and compare their effect on stock value.")
+    
+    db = get_db()
+    if not db:
+        st.error("Database connection failed")
+        return
+    
+    location = get_active_location()
+    st.caption(location_label(location))
+    
+    try:
+        catalog = get_catalog(location)
+        if not len(catalog['ids']):
+            st.info("No inventory data available to simulate.")
+            return
+        
+        scenarios = edit_scenarios(catalog)
+        results = compare_price_scenarios(
+            catalog['quantity'], catalog['price'], catalog['category'], catalog['supplier'],
+            [to_scenario(rules, catalog) for _, rules in scenarios],
+            len(catalog['categories']), len(catalog['suppliers']), TOP_ITEMS
+        )
+        
+        st.markdown("---")
+        show_comparison(catalog, scenarios, results)
+        
+        if st.session_state.user.get('role') == 'admin':
+            st.markdown("---")
+            commit_scenario(location, scenarios)
+    
+    except Exception as e:
+        st.error(f"Error running pricing simulation: {e}")
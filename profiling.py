@@ -0,0 +1,136 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import streamlit as st
+
+from firebase_config import LOCAL_DATA_DIR
+
+# Per-session profiling of whole reruns. Enabled for a signed-in admin by
+# the sidebar toggle or by opening the app with ?profile=1; when off, a
+# rerun only pays for the flag check. Each profiled rerun writes to
+# PROFILE_DIR, which keeps the newest MAX_PROFILES reruns:
+#   <time>-<user>.folded  sampled stacks, for flamegraph.pl or speedscope
+#   <time>-<user>.txt     per-function summary (cumulative time)
+#   <time>-<user>.prof    raw cProfile stats, for snakeviz or pstats
+
+PROFILE_DIR = os.path.join(LOCAL_DATA_DIR, 'profiles')
+SAMPLE_INTERVAL_SECONDS = 0.005
+SUMMARY_LINES = 60
+MAX_PROFILES = 50
+
+
+class StackSampler:
+    """Samples one thread's call stack into folded-stack counts"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                # Folded format lists the root first; ';' separates frames
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+def profiling_enabled():
+    """Check whether this session's reruns are profiled"""
+    if (st.session_state.get('user') or {}).get('role') != 'admin':
+        return False
+    return st.session_state.get('profiling', False) or st.query_params.get('profile') == '1'
+
+
+def _profile_names():
+    """Get the names of saved profiles, newest first"""
+    try:
+        return sorted((name[:-4] for name in os.listdir(PROFILE_DIR) if name.endswith('.txt')), reverse=True)
+    except FileNotFoundError:
+        return []
+
+
+def _prune(keep=MAX_PROFILES):
+    """Delete all but the newest keep profiles"""
+    for name in _profile_names()[keep:]:
+        for extension in ('.txt', '.folded', '.prof'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f"{name}{extension}"))
+            except FileNotFoundError:
+                pass
+
+
+def _save(profiler, sampler, elapsed):
+    user = (st.session_state.get('user') or {}).get('username', 'anonymous')
+    base = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{re.sub(r'[^A-Za-z0-9_-]', '_', user)}")
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    profiler.dump_stats(f"{base}.prof")
+    with open(f"{base}.folded", 'w') as folded:
+        folded.write(sampler.folded())
+
+    summary = io.StringIO()
+    summary.write(f"rerun: {elapsed * 1000:.1f} ms, {sum(sampler.counts.values())} samples\n\n")
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    with open(f"{base}.txt", 'w') as text:
+        text.write(summary.getvalue())
+    _prune()
+
+
+@contextmanager
+def profile_run():
+    """Profile the enclosed rerun if profiling is enabled for this session"""
+    if not profiling_enabled():
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    started = time.perf_counter()
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        # Also reached when st.rerun() or st.stop() ends the run early
+        profiler.disable()
+        sampler.stop()
+        try:
+            _save(profiler, sampler, time.perf_counter() - started)
+        except OSError as e:
+            st.warning(f"Could not save profile: {e}")
+
+
+def list_profiles(limit=10):
+    """Get the newest saved profiles as (name, summary path, folded path)"""
+    names = _profile_names()
+    return [
+        (name, os.path.join(PROFILE_DIR, f"{name}.txt"), os.path.join(PROFILE_DIR, f"{name}.folded"))
+        for name in names[:limit]
+    ]
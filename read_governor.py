@@ -0,0 +1,314 @@
+import copy
+import json
+import os
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Admission control for Firestore reads. Each session and each tenant (per
+# server process) has a token bucket of reads that refills at a steady rate
+# and allows short bursts. A governed read is admitted only when both
+# buckets cover what it cost last time; otherwise the last result of the
+# same read is served instead, with the time it was read, and nothing is
+# read. A read with no earlier result is always admitted.
+#
+# Reads also run against a deadline and a circuit breaker. A read that
+# fails or misses its deadline serves the last result too; a late read
+# keeps running and refreshes that result when it lands. After
+# BREAKER_FAILURES failures in a row no reads are tried for
+# BREAKER_OPEN_SECONDS, then a single probe decides whether to resume.
+# Each process writes its counters to a JSON file for `cli.py serve`'s
+# /metrics endpoint.
+
+SESSION_READS_PER_MINUTE = 600
+SESSION_BURST_READS = 3_000
+TENANT_READS_PER_MINUTE = 20_000
+TENANT_BURST_READS = 60_000
+CACHED_RESULTS = 512
+READ_DEADLINE_SECONDS = 3.0
+# How long a read may take when there is no earlier result to fall back to
+FIRST_READ_DEADLINE_SECONDS = 30.0
+READ_THREADS = 32
+BREAKER_FAILURES = 5
+BREAKER_OPEN_SECONDS = 30
+METRICS_INTERVAL_SECONDS = 10
+
+
+class ReadUnavailable(Exception):
+    """Raised when a read cannot be tried and there is no earlier result to serve"""
+
+
+class TokenBucket:
+    """Refilling read allowance; may go into debt when a read costs more than estimated"""
+
+    def __init__(self, per_minute, capacity):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+    def allows(self, cost):
+        # A read bigger than the bucket is admitted once the bucket is full
+        return self.available() >= min(cost, self.capacity)
+
+    def consume(self, count):
+        with self._lock:
+            self._refill()
+            self.tokens -= count
+
+
+class CircuitBreaker:
+    """Stops reads after consecutive failures and lets one probe through after a pause"""
+
+    def __init__(self, failures=BREAKER_FAILURES, open_seconds=BREAKER_OPEN_SECONDS):
+        self.failure_threshold = failures
+        self.open_seconds = open_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.opened_total = 0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.open_seconds:
+            return 'open'
+        return 'half_open'
+
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def allow(self):
+        """Check whether a read may be tried; in half-open state only one probe at a time"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._state() == 'half_open' or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.opened_total += 1
+            self.probing = False
+
+    def record_late(self, succeeded):
+        """Count a read that landed after its deadline, which only decides a probe in progress"""
+        with self._lock:
+            probing = self.probing
+        if not probing:
+            return
+        if succeeded:
+            self.record_success()
+        else:
+            self.record_failure()
+
+    def release_probe(self):
+        """Let another caller probe when the one allowed didn't start a read"""
+        with self._lock:
+            self.probing = False
+
+
+class PeerWait:
+    """Whether a read is waiting for another process's refresh; pass set as a shared cache on_wait"""
+
+    def __init__(self):
+        self.waiting = False
+
+    def set(self, waiting):
+        self.waiting = waiting
+
+
+class CachedRead:
+    def __init__(self, result, cost):
+        self.result = result
+        self.cost = cost
+        self.as_of = datetime.now(timezone.utc)
+
+
+class ReadGovernor:
+    """Per-tenant read buckets, the read circuit breaker and the last result of every governed read"""
+
+    def __init__(self, metrics_dir=None):
+        self.metrics_dir = metrics_dir
+        self.breaker = CircuitBreaker()
+        self._buckets = {}
+        self._results = OrderedDict()
+        self._running = {}
+        self._pool = ThreadPoolExecutor(READ_THREADS, thread_name_prefix='governed-read')
+        self._lock = threading.Lock()
+        self._exported_at = 0.0
+        self.stale_served = Counter()
+        self.events = Counter()
+
+    def tenant_bucket(self, tenant):
+        with self._lock:
+            if tenant not in self._buckets:
+                self._buckets[tenant] = TokenBucket(TENANT_READS_PER_MINUTE, TENANT_BURST_READS)
+            return self._buckets[tenant]
+
+    def admits(self, tenant, session_bucket, cost):
+        """Check whether the tenant's (and session's) bucket covers a read of cost"""
+        if not self.tenant_bucket(tenant).allows(cost):
+            return False
+        return session_bucket is None or session_bucket.allows(cost)
+
+    def cached(self, key):
+        """Get the last result of a read as (result copy, cost, as_of), or None"""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return None
+            self._results.move_to_end(key)
+        # Callers may modify what they are given
+        return copy.deepcopy(entry.result), entry.cost, entry.as_of
+
+    def remember(self, key, result, cost):
+        with self._lock:
+            self._results[key] = CachedRead(copy.deepcopy(result), cost)
+            self._results.move_to_end(key)
+            while len(self._results) > CACHED_RESULTS:
+                self._results.popitem(last=False)
+
+    def served_stale(self, tenant, reason):
+        with self._lock:
+            self.stale_served[tenant] += 1
+            self.events[f"stale_{reason}"] += 1
+
+    def count(self, event):
+        with self._lock:
+            self.events[event] += 1
+
+    def missed_deadline(self, future):
+        """Count a read that missed its deadline as a breaker failure (once per read).
+
+        A read still waiting for another process's refresh of the same data
+        (see PeerWait) is late but not a database failure.
+        """
+        with self._lock:
+            if getattr(future, 'timed_out', False) or future.done():
+                return
+            future.timed_out = True
+            peer_wait = getattr(future, 'peer_wait', None)
+            if peer_wait is not None and peer_wait.waiting:
+                self.events['peer_wait_deadline'] += 1
+                return
+            self.events['deadline_exceeded'] += 1
+        self.breaker.record_failure()
+
+    def run(self, read, peer_wait=None):
+        """Run read() in the read pool; peer_wait is the PeerWait read reports to, if any"""
+        future = self._pool.submit(read)
+        future.peer_wait = peer_wait
+        return future
+
+    def submit(self, key, read, peer_wait=None):
+        """Start read() for key in the read pool, or join the one already running.
+
+        read returns (result, cost). The result is remembered when the read
+        lands, even after the caller stopped waiting.
+        """
+        with self._lock:
+            future = self._running.get(key)
+            if future is not None:
+                return future
+            future = self._pool.submit(read)
+            future.peer_wait = peer_wait
+            self._running[key] = future
+
+        def landed(future):
+            with self._lock:
+                self._running.pop(key, None)
+                timed_out = getattr(future, 'timed_out', False)
+            if future.exception() is not None:
+                self.count('read_errors')
+                if timed_out:
+                    self.breaker.record_late(False)
+                else:
+                    self.breaker.record_failure()
+                return
+            result, cost = future.result()
+            self.remember(key, result, cost)
+            if timed_out:
+                self.count('late_reads')
+                self.breaker.record_late(True)
+            else:
+                self.breaker.record_success()
+
+        future.add_done_callback(landed)
+        return future
+
+    def metrics(self):
+        """Get the counters of this process"""
+        with self._lock:
+            events = dict(self.events)
+            stale_served = dict(self.stale_served)
+        return {
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'updated': time.time(),
+            'breaker_state': self.breaker.state(),
+            'breaker_failures': self.breaker.failures,
+            'breaker_opened_total': self.breaker.opened_total,
+            'events': events,
+            'stale_served': stale_served
+        }
+
+    def export_metrics(self, force=False):
+        """Write this process's counters to metrics_dir, at most every METRICS_INTERVAL_SECONDS"""
+        now = time.monotonic()
+        with self._lock:
+            if self.metrics_dir is None or (not force and now - self._exported_at < METRICS_INTERVAL_SECONDS):
+                return
+            self._exported_at = now
+
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        path = os.path.join(self.metrics_dir, f"reads-{socket.gethostname()}-{os.getpid()}.json")
+        with open(f"{path}.tmp", 'w') as target:
+            json.dump(self.metrics(), target)
+        os.replace(f"{path}.tmp", path)
+
+
+def read_exported_metrics(metrics_dir, max_age=300):
+    """Get the counters recently exported by every process"""
+    exported = []
+    try:
+        names = [name for name in os.listdir(metrics_dir) if name.startswith('reads-') and name.endswith('.json')]
+    except FileNotFoundError:
+        return exported
+    for name in names:
+        try:
+            with open(os.path.join(metrics_dir, name)) as source:
+                metrics = json.load(source)
+        except (OSError, ValueError):
+            continue
+        if time.time() - metrics.get('updated', 0) <= max_age:
+            exported.append(metrics)
+    return exported
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from firebase_config import (
+    get_db,
+    ALL_LOCATIONS,
+    LOCAL_DATA_DIR,
+    LOW_STOCK_THRESHOLD,
+    locations_collection,
+    resolve_sharded_records,
+    tenant_scope
+)
+from models import item_columns, items_frame
+from snapshot import get_location_snapshot
+
+# Reports (CSV exports, summaries) are queued in a SQLite file and built by
+# background worker threads; every server process on the host shares the
+# queue. A job's key is a hash of its kind, tenant, location, data version
+# and parameters, so identical requests over unchanged data share one job
+# and one stored artifact:
+#   report_jobs.db            queue and job status
+#   reports/<key>.csv|.txt    finished artifacts, kept ARTIFACT_TTL_SECONDS
+
+REPORT_WORKERS = 2
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 2.0
+ARTIFACT_TTL_SECONDS = 7 * 24 * 3600
+CSV_CHUNK_ROWS = 50_000
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def _load_items(location):
+    """Get the item records of a location (or all) of the active tenant from the local snapshots"""
+    db = get_db()
+    if not db:
+        raise ConnectionError("Database connection failed")
+
+    if location == ALL_LOCATIONS:
+        locations = [ref.id for ref in locations_collection(db).list_documents()]
+    else:
+        locations = [location]
+    items = [item for loc in locations for item in get_location_snapshot(loc).sync(db)]
+    return resolve_sharded_records(items)
+
+
+def build_inventory_csv(items, params, output, progress):
+    """Write every item as CSV, in chunks so progress can be reported"""
+    df = items_frame(items, item_columns(items))
+    for start in range(0, max(len(df), 1), CSV_CHUNK_ROWS):
+        chunk = df.iloc[start:start + CSV_CHUNK_ROWS]
+        output.write(chunk.to_csv(index=False, header=start == 0).encode('utf-8'))
+        progress(min(start + CSV_CHUNK_ROWS, len(df)) / max(len(df), 1))
+
+
+def build_summary(items, params, output, progress):
+    """Write the plain-text inventory summary"""
+    df = items_frame(items, ('quantity', 'price', 'category'))
+    quantity = df['quantity']
+    value = quantity * df['price']
+    category_counts = df['category'].value_counts()
+    progress(0.5)
+
+    output.write(f"""INVENTORY SUMMARY REPORT
+Generated: {time.strftime('%Y-%m-%d %H:%M:%S')}
+Location: {params.get('location_label', '')}
+
+Total Items: {len(df)}
+Total Quantity: {int(quantity.sum())}
+Total Value: ${value.sum():,.2f}
+Low Stock Items: {int((quantity < LOW_STOCK_THRESHOLD).sum())}
+
+Categories:
+{category_counts.to_string()}
+""".encode('utf-8'))
+
+
+REPORT_KINDS = {
+    # kind: (builder, file extension, MIME type)
+    'inventory_csv': (build_inventory_csv, 'csv', 'text/csv'),
+    'summary': (build_summary, 'txt', 'text/plain'),
+}
+
+
+class ReportQueue:
+    """Durable queue of report jobs with deduplicated, stored artifacts.
+
+    Workers claim a queued job with a lease they renew while reporting
+    progress; a job whose worker died is claimed again once the lease
+    expires, up to MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, path, artifact_dir, workers=REPORT_WORKERS):
+        self.path = path
+        self.artifact_dir = artifact_dir
+        self.workers = workers
+        self.owner = uuid.uuid4().hex
+        self._wake = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+
+        os.makedirs(artifact_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    tenant TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    progress REAL NOT NULL DEFAULT 0,
+                    error TEXT,
+                    artifact TEXT,
+                    requested_by TEXT,
+                    requests INTEGER NOT NULL DEFAULT 1,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    lease_expires REAL,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def submit(self, kind, tenant, location, version, params=None, requested_by=None):
+        """Request a report; returns its job key, shared with identical requests"""
+        if kind not in REPORT_KINDS:
+            raise ValueError(f"Unknown report: {kind}")
+        params = json.dumps(params or {}, sort_keys=True)
+        key = hashlib.sha256(json.dumps([kind, tenant, location, version, params]).encode('utf-8')).hexdigest()[:32]
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            inserted = conn.execute(
+                """INSERT OR IGNORE INTO jobs (key, kind, tenant, location, version, params, requested_by, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (key, kind, tenant, location, version, params, requested_by, time.time())
+            ).rowcount
+            if not inserted:
+                # Asking again retries a failed job; a finished one is reused as is
+                conn.execute(
+                    """UPDATE jobs SET requests = requests + 1,
+                           status = CASE status WHEN 'failed' THEN 'queued' ELSE status END,
+                           attempts = CASE status WHEN 'failed' THEN 0 ELSE attempts END
+                       WHERE key = ?""",
+                    (key,)
+                )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        self.start()
+        self._wake.set()
+        return key
+
+    def get(self, key):
+        """Get a job's status row as a dict, or None"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE key = ?", (key,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def read_artifact(self, key):
+        """Get the bytes of a finished report, or None"""
+        job = self.get(key)
+        if not job or job['status'] != 'done':
+            return None
+        try:
+            with open(job['artifact'], 'rb') as artifact:
+                return artifact.read()
+        except FileNotFoundError:
+            return None
+
+    def counts(self):
+        """Get the number of jobs by status"""
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        finally:
+            conn.close()
+
+    def start(self):
+        """Start the worker threads that are not running"""
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"report-worker-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                self._prune()
+                # Jobs queued by other processes are found by polling
+                self._wake.wait(POLL_SECONDS)
+                self._wake.clear()
+                continue
+            self._build(job)
+
+    def _claim(self):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # A running job with an expired lease lost its worker; give it up after MAX_ATTEMPTS
+            conn.execute(
+                """UPDATE jobs SET status = 'failed', error = 'Report worker stopped repeatedly'
+                   WHERE status = 'running' AND lease_expires < ? AND attempts >= ?""",
+                (now, MAX_ATTEMPTS)
+            )
+            row = conn.execute(
+                """SELECT * FROM jobs
+                   WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?)
+                   ORDER BY created_at LIMIT 1""",
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                """UPDATE jobs SET status = 'running', progress = 0, owner = ?, lease_expires = ?, attempts = attempts + 1
+                   WHERE key = ?""",
+                (self.owner, now + LEASE_SECONDS, row['key'])
+            )
+            conn.execute("COMMIT")
+            return dict(row)
+        finally:
+            conn.close()
+
+    def _update(self, key, **fields):
+        conn = self._connect()
+        try:
+            assignments = ', '.join(f"{field} = ?" for field in fields)
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE key = ? AND owner = ?",
+                         (*fields.values(), key, self.owner))
+        finally:
+            conn.close()
+
+    def _build(self, job):
+        builder, extension, _ = REPORT_KINDS[job['kind']]
+        path = os.path.join(self.artifact_dir, f"{job['key']}.{extension}")
+        temp_path = f"{path}.{self.owner}.tmp"
+
+        def progress(fraction):
+            self._update(job['key'], progress=fraction, lease_expires=time.time() + LEASE_SECONDS)
+
+        try:
+            with tenant_scope(job['tenant']):
+                items = _load_items(job['location'])
+            progress(0.1)
+            with open(temp_path, 'wb') as output:
+                builder(items, json.loads(job['params']), output, lambda fraction: progress(0.1 + 0.9 * fraction))
+            os.replace(temp_path, path)
+            self._update(job['key'], status='done', progress=1.0, artifact=path, error=None, finished_at=time.time())
+        except Exception as e:
+            self._update(job['key'], status='failed', error=str(e), finished_at=time.time())
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _prune(self):
+        """Drop finished jobs and their artifacts after ARTIFACT_TTL_SECONDS"""
+        now = time.time()
+        with self._lock:
+            if now - self._pruned_at < 3600:
+                return
+            self._pruned_at = now
+
+        conn = self._connect()
+        try:
+            expired = conn.execute(
+                "SELECT key, artifact FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (now - ARTIFACT_TTL_SECONDS,)
+            ).fetchall()
+            for key, artifact in expired:
+                if artifact and os.path.exists(artifact):
+                    os.remove(artifact)
+                conn.execute("DELETE FROM jobs WHERE key = ?", (key,))
+        finally:
+            conn.close()
+
+
+def get_report_queue():
+    """Get the process-wide report queue"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ReportQueue(os.path.join(LOCAL_DATA_DIR, 'report_jobs.db'), os.path.join(LOCAL_DATA_DIR, 'reports'))
+        return _queue
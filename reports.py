@@ -1,9 +1,168 @@
 import streamlit as st
-from firebase_config import get_db
+from firebase_config import (
+    get_db,
+    ALL_LOCATIONS,
+    get_active_location,
+    location_label,
+    LOW_STOCK_THRESHOLD,
+    get_top_valuable_items,
+    get_data_version,
+    get_active_tenant,
+    get_shared_cache,
+    update_item_fields
+)
+from snapshot import get_inventory_records
+from models import items_frame
+from analytics import get_analytics_engine, job_key, inventory_columns, abc_classify
+from forecasting import run_forecast
+from valuation import get_valuation_series
+from report_jobs import REPORT_KINDS, get_report_queue
+import numpy as np
 import pandas as pd
 import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import datetime
+
+# How long a rerun waits for a report job before showing progress instead
+REPORT_WAIT_SECONDS = 2.0
+TREND_RANGES = {"3 months": 92, "1 year": 366, "2 years": 731}
+# Report jobs listed per session
+MAX_SESSION_REPORTS = 5
+REPORT_COLUMNS = ('id', 'name', 'category', 'quantity', 'price', 'location', 'daily_demand', 'reorder_point',
+                  'suggested_order_qty', 'abc_class', 'abc_class_category')
+
+@st.fragment(run_every=1)
+def show_job_progress(job):
+    """Poll a running analytics job without blocking the rest of the page"""
+    if job.done():
+        st.rerun()
+    
+    st.progress(job.progress(), text="⏳ Crunching inventory numbers...")
+    if st.button("✖️ Cancel", key="cancel_report_job"):
+        job.cancel()
+        st.session_state.report_cancelled = job.key
+        st.rerun()
+
+def run_rollup(df, location, version):
+    """Get the inventory rollup for the current data version, computing it if needed"""
+    # Another server process may have computed this version already
+    shared_key = f"rollup/{get_active_tenant()}/{location}"
+    shared = get_shared_cache().get(shared_key, version)
+    if shared is not None:
+        return shared.value
+    
+    job_version = f"{get_active_tenant()}/{location}:{version}"
+    params = {'low_stock_threshold': LOW_STOCK_THRESHOLD}
+    # Checked before submitting: a cancelled job is no longer running, so submitting would start it over
+    if st.session_state.get('report_cancelled') == job_key('inventory_rollup', job_version, params):
+        st.info("Report cancelled.")
+        if st.button("🔄 Run Again"):
+            del st.session_state.report_cancelled
+            st.rerun()
+        return None
+    
+    job = get_analytics_engine().submit('inventory_rollup', job_version, lambda: inventory_columns(df), params)
+    
+    try:
+        rollup = job.result(timeout=REPORT_WAIT_SECONDS)
+    except TimeoutError:
+        show_job_progress(job)
+        return None
+    if rollup is not None:
+        get_shared_cache().put(shared_key, rollup, version)
+    return rollup
+
+def request_report(kind, location, version):
+    """Queue a report (or join an identical one) and list it in this session"""
+    key = get_report_queue().submit(
+        kind, get_active_tenant(), location, version,
+        {'location_label': location_label(location)},
+        st.session_state.user.get('username')
+    )
+    keys = [key] + [k for k in st.session_state.get('report_jobs', []) if k != key]
+    st.session_state.report_jobs = keys[:MAX_SESSION_REPORTS]
+
+@st.fragment(run_every=1)
+def show_pending_reports(keys):
+    """Poll queued and running reports without rerunning the page"""
+    queue = get_report_queue()
+    jobs = [queue.get(key) for key in keys]
+    if all(job is None or job['status'] in ('done', 'failed') for job in jobs):
+        st.rerun()
+    
+    for job in jobs:
+        if job and job['status'] in ('queued', 'running'):
+            label = "Waiting for a worker..." if job['status'] == 'queued' else f"Building {job['kind']} report..."
+            st.progress(job['progress'], text=f"⏳ {label}")
+
+def show_reports():
+    """List this session's reports with downloads for the finished ones"""
+    keys = st.session_state.get('report_jobs', [])
+    if not keys:
+        return
+    
+    queue = get_report_queue()
+    jobs = [job for job in (queue.get(key) for key in keys) if job]
+    if any(job['status'] in ('queued', 'running') for job in jobs):
+        show_pending_reports(keys)
+    
+    for job in jobs:
+        _, extension, mime = REPORT_KINDS[job['kind']]
+        requested = datetime.fromtimestamp(job['created_at']).strftime('%Y-%m-%d %H:%M')
+        if job['status'] == 'failed':
+            st.error(f"Report {job['kind']} ({requested}) failed: {job['error']}")
+        elif job['status'] == 'done':
+            data = queue.read_artifact(job['key'])
+            if data is None:
+                continue
+            if extension == 'txt':
+                st.text_area("Summary Report", data.decode('utf-8'), height=200, key=f"report_{job['key']}")
+            st.download_button(
+                label=f"⬇️ {job['kind']} ({requested}, {len(data) / 1024:,.1f} KB)",
+                data=data,
+                file_name=f"{job['kind']}_{job['location']}_{datetime.fromtimestamp(job['created_at']):%Y%m%d_%H%M%S}.{extension}",
+                mime=mime,
+                key=f"download_{job['key']}"
+            )
+
+def get_trend(location, days):
+    """Get the valuation series, read once a day for every session on this host"""
+    return get_shared_cache().get_or_refresh(
+        f"valuation_trend/{get_active_tenant()}/{location}/{days}",
+        lambda: get_valuation_series(location, days),
+        version=datetime.now().date().isoformat()
+    )
+
+def show_trends(location):
+    """Chart stored valuation snapshots; never reads inventory items"""
+    st.subheader("Value Over Time")
+    days = TREND_RANGES[st.radio("Range", list(TREND_RANGES), index=1, horizontal=True, key="trend_range")]
+    
+    try:
+        series = get_trend(location, days)
+    except Exception as e:
+        st.error(f"Error loading valuation history: {e}")
+        return
+    
+    if series.empty:
+        st.info("No valuation snapshots yet. They are stored daily by `python cli.py valuation`.")
+        return
+    
+    fig_value = px.line(series, x='date', y='total_value', markers=len(series) < 60,
+                        hover_data=['granularity', 'total_quantity', 'item_count'],
+                        title="Total Inventory Value")
+    st.plotly_chart(fig_value, use_container_width=True)
+    
+    category_columns = [column for column in series.columns if column.startswith('category:')]
+    if category_columns:
+        by_category = series.melt(id_vars='date', value_vars=category_columns, var_name='category', value_name='value')
+        by_category['category'] = by_category['category'].str.slice(len('category:'))
+        fig_category = px.area(by_category.fillna({'value': 0.0}), x='date', y='value', color='category',
+                               title="Value by Category")
+        st.plotly_chart(fig_category, use_container_width=True)
+    
+    fig_quantity = px.line(series, x='date', y='total_quantity', title="Total Quantity")
+    st.plotly_chart(fig_quantity, use_container_width=True)
+    st.caption(f"{len(series):,} snapshots: daily for the last 3 months, then weekly, then monthly.")
 
 def app():
     st.title("📊 Inventory Reports & Analytics")
@@ -13,58 +172,60 @@ def app():
         st.error("Database connection failed")
         return
     
+    location = get_active_location()
+    st.caption(location_label(location))
+    
     try:
-        # Get all inventory items
-        items = []
-        docs = db.collection('inventory').stream()
-        
-        for doc in docs:
-            item = doc.to_dict()
-            item['id'] = doc.id
-            items.append(item)
+        # Get all inventory items of the active location
+        items = get_inventory_records(location)
         
         if not items:
             st.info("No inventory data available for reports.")
             return
         
-        df = pd.DataFrame(items)
+        df = items_frame(items, REPORT_COLUMNS)
+        version = get_data_version(location) or datetime.now().isoformat()
+        
+        rollup = run_rollup(df, location, version)
+        if rollup is None:
+            return
         
         # Summary metrics
         st.subheader("📈 Summary Metrics")
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            total_items = len(df)
+            total_items = rollup['item_count']
             st.metric("Total Items", total_items)
         
         with col2:
-            total_quantity = df['quantity'].sum()
+            total_quantity = int(rollup['total_quantity'])
             st.metric("Total Quantity", total_quantity)
         
         with col3:
-            total_value = (df['quantity'] * df['price']).sum()
+            total_value = rollup['total_value']
             st.metric("Total Value", f"${total_value:,.2f}")
         
         with col4:
-            low_stock_items = len(df[df['quantity'] < 10])  # Assuming 10 is low stock threshold
+            low_stock_items = rollup['low_stock_count']
             st.metric("Low Stock Items", low_stock_items)
         
         st.markdown("---")
         
         # Charts
-        tab1, tab2, tab3 = st.tabs(["Category Analysis", "Stock Levels", "Value Analysis"])
+        tab1, tab2, tab3, tab4, tab5 = st.tabs(["Category Analysis", "Stock Levels", "Value Analysis", "ABC Analysis", "Trends"])
         
         with tab1:
             st.subheader("Items by Category")
             
             # Category distribution
-            category_counts = df['category'].value_counts()
+            category_counts = rollup['by_category'].set_index('category')['count']
             fig_pie = px.pie(values=category_counts.values, names=category_counts.index, 
                            title="Distribution of Items by Category")
             st.plotly_chart(fig_pie, use_container_width=True)
             
             # Category quantity
-            category_qty = df.groupby('category')['quantity'].sum().reset_index()
+            category_qty = rollup['by_category'][['category', 'quantity']]
             fig_bar = px.bar(category_qty, x='category', y='quantity', 
                            title="Total Quantity by Category")
             st.plotly_chart(fig_bar, use_container_width=True)
@@ -75,7 +236,7 @@ def app():
             # Stock levels
             fig_stock = px.bar(df, x='name', y='quantity', color='category',
                              title="Stock Levels by Item")
-            fig_stock.update_xaxis(tickangle=45)
+            fig_stock.update_xaxes(tickangle=45)
             st.plotly_chart(fig_stock, use_container_width=True)
             
             # Low stock alert
@@ -88,6 +249,38 @@ def app():
                 st.dataframe(low_stock_df[['name', 'category', 'quantity', 'price']], use_container_width=True)
             else:
                 st.success("All items are well stocked!")
+            
+            # Reorder points stored by the last forecast run
+            st.subheader("🛒 Reorder Points")
+            if df['reorder_point'].notna().any():
+                reorder_df = df[df['reorder_point'].notna()].copy()
+                reorder_df['reorder_now'] = (reorder_df['reorder_point'] > 0) & (reorder_df['quantity'] <= reorder_df['reorder_point'])
+                reorder_df = reorder_df[reorder_df['reorder_now']].sort_values('suggested_order_qty', ascending=False)
+                
+                if not reorder_df.empty:
+                    st.warning(f"{len(reorder_df)} items are at or below their reorder point")
+                    st.dataframe(
+                        reorder_df[['name', 'category', 'quantity', 'daily_demand', 'reorder_point', 'suggested_order_qty']],
+                        use_container_width=True,
+                        hide_index=True
+                    )
+                else:
+                    st.success("No items need reordering")
+            else:
+                st.info("No forecast has been run yet")
+            
+            if st.session_state.user.get('role') == 'admin':
+                if st.button("🔮 Run Forecast"):
+                    try:
+                        with st.spinner("Forecasting demand..."):
+                            alerts, status = run_forecast(location)
+                        if status == 'done':
+                            st.success(f"Forecast updated: {alerts} items to reorder")
+                            st.rerun()
+                        else:
+                            st.warning(f"Forecast found {alerts} items to reorder, but its reorder points are not all written yet ({status})")
+                    except Exception as e:
+                        st.error(f"Error running forecast: {e}")
         
         with tab3:
             st.subheader("Value Analysis")
@@ -96,49 +289,112 @@ def app():
             df['total_value'] = df['quantity'] * df['price']
             
             # Top valuable items
-            top_valuable = df.nlargest(10, 'total_value')
+            top_valuable = pd.DataFrame(get_top_valuable_items(location, 10))
             fig_value = px.bar(top_valuable, x='name', y='total_value', 
                              title="Top 10 Most Valuable Items")
-            fig_value.update_xaxis(tickangle=45)
+            fig_value.update_xaxes(tickangle=45)
             st.plotly_chart(fig_value, use_container_width=True)
             
             # Value by category
-            category_value = df.groupby('category')['total_value'].sum().reset_index()
+            category_value = rollup['by_category'][['category', 'total_value']]
             fig_cat_value = px.pie(category_value, values='total_value', names='category',
                                  title="Total Value by Category")
             st.plotly_chart(fig_cat_value, use_container_width=True)
+            
+            # Value by location for cross-site views
+            if location == ALL_LOCATIONS:
+                location_value = rollup['by_location']
+                fig_loc_value = px.bar(location_value, x='location', y='total_value',
+                                     title="Total Value by Location")
+                st.plotly_chart(fig_loc_value, use_container_width=True)
+        
+        with tab4:
+            st.subheader("ABC (Pareto) Analysis")
+            st.caption("A items hold the first 80% of stock value, B the next 15%, C the last 5%.")
+            
+            item_values = (df['quantity'] * df['price']).to_numpy(dtype=np.float64)
+            category_codes, _ = pd.factorize(df['category'])
+            overall_classes, overall_share = abc_classify(item_values)
+            category_classes, _ = abc_classify(item_values, category_codes)
+            
+            scope = st.radio("Rank within", ["Whole catalog", "Each category"], horizontal=True)
+            classes = overall_classes if scope == "Whole catalog" else category_classes
+            
+            abc_df = pd.DataFrame({
+                'name': df['name'],
+                'category': df['category'],
+                'total_value': item_values,
+                'abc_class': classes
+            })
+            class_summary = abc_df.groupby('abc_class').agg(
+                items=('total_value', 'size'),
+                total_value=('total_value', 'sum')
+            ).reindex(['A', 'B', 'C'], fill_value=0)
+            total_abc_value = class_summary['total_value'].sum()
+            
+            col1, col2, col3 = st.columns(3)
+            for col, abc_class in zip((col1, col2, col3), ['A', 'B', 'C']):
+                with col:
+                    row = class_summary.loc[abc_class]
+                    share = row['total_value'] / total_abc_value if total_abc_value else 0
+                    st.metric(f"Class {abc_class}", f"{int(row['items']):,} items", f"{share:.0%} of value",
+                              delta_color="off")
+            
+            # Pareto curve, sampled so huge catalogs still chart quickly
+            ranked_share = np.sort(overall_share)
+            sample = np.unique(np.linspace(0, len(ranked_share) - 1, min(len(ranked_share), 500)).astype(int))
+            fig_pareto = px.line(
+                x=(sample + 1) / len(ranked_share) * 100,
+                y=ranked_share[sample] * 100,
+                labels={'x': '% of items (by value rank)', 'y': '% of total value'},
+                title="Pareto Curve"
+            )
+            st.plotly_chart(fig_pareto, use_container_width=True)
+            
+            if scope == "Each category":
+                st.dataframe(
+                    abc_df.groupby(['category', 'abc_class']).size().unstack(fill_value=0),
+                    use_container_width=True
+                )
+            
+            abc_filter = st.multiselect("Show classes", ['A', 'B', 'C'], default=['A'])
+            st.dataframe(
+                abc_df[abc_df['abc_class'].isin(abc_filter)].sort_values('total_value', ascending=False),
+                use_container_width=True,
+                hide_index=True
+            )
+            
+            # Persist the classes so other pages can filter on them server-side
+            if st.session_state.user.get('role') == 'admin':
+                changed = (df['abc_class'].to_numpy() != overall_classes) | (df['abc_class_category'].to_numpy() != category_classes)
+                
+                if st.button(f"💾 Save Classes ({int(changed.sum()):,} changed)", disabled=not changed.any()):
+                    updates = [
+                        (items[i].to_dict(), {'abc_class': overall_classes[i], 'abc_class_category': category_classes[i]})
+                        for i in np.flatnonzero(changed)
+                    ]
+                    written, _ = update_item_fields(updates)
+                    st.success(f"Saved ABC classes on {written:,} items")
+        
+        with tab5:
+            show_trends(location)
         
         st.markdown("---")
         
         # Export functionality
         st.subheader("📥 Export Data")
+        st.caption("Reports are built in the background; identical requests over unchanged data share one build.")
         col1, col2 = st.columns(2)
         
         with col1:
-            if st.button("📊 Download Inventory Report (CSV)"):
-                csv = df.to_csv(index=False)
-                st.download_button(
-                    label="Download CSV",
-                    data=csv,
-                    file_name=f"inventory_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
-                )
+            if st.button("📊 Inventory Report (CSV)"):
+                request_report('inventory_csv', location, version)
         
         with col2:
             if st.button("📋 Generate Summary Report"):
-                st.text_area("Summary Report", 
-                           f"""
-INVENTORY SUMMARY REPORT
-Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-
-Total Items: {total_items}
-Total Quantity: {total_quantity}
-Total Value: ${total_value:,.2f}
-Low Stock Items: {low_stock_items}
-
-Categories:
-{category_counts.to_string()}
-                           """, height=200)
+                request_report('summary', location, version)
+        
+        show_reports()
         
     except Exception as e:
         st.error(f"Error generating reports: {e}")
@@ -0,0 +1,198 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+# Cache shared by every server process on a host, in one SQLite file. Each
+# entry is a pickled value stored under a key with a version; a reader asks
+# for a key at a version (data version, watermark, ...) or no older than a
+# maximum age. A missing or outdated entry is refreshed by one process at a
+# time: the others wait for it under a lease and then read its result, so N
+# processes make one Firestore read per change instead of N.
+#   entries   key, version, value, stored_at
+#   leases    key, owner, expires (a refresh in progress)
+# The file is local to the host and written only by the app itself.
+
+LEASE_SECONDS = 30
+POLL_SECONDS = 0.05
+ENTRY_TTL_SECONDS = 24 * 3600
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+PRUNE_INTERVAL_SECONDS = 600
+
+CacheEntry = namedtuple('CacheEntry', ['value', 'version', 'stored_at'])
+
+
+class SharedCache:
+    """Versioned cross-process cache with single-flight refresh"""
+
+    def __init__(self, path, on_event=None):
+        self.path = path
+        self.owner = uuid.uuid4().hex
+        self.on_event = on_event
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    version TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    stored_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_stored_at ON entries (stored_at);
+                CREATE TABLE IF NOT EXISTS leases (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires REAL NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _event(self, name):
+        if self.on_event:
+            self.on_event(f"shared_{name}")
+
+    def get(self, key, version='', max_age=None):
+        """Get key's entry if it is at version and no older than max_age seconds, or None"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value, version, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or row[1] != version or (max_age is not None and time.time() - row[2] > max_age):
+            return None
+        try:
+            return CacheEntry(pickle.loads(row[0]), row[1], row[2])
+        except Exception:
+            # Written by an older version of the app
+            return None
+
+    def put(self, key, value, version=''):
+        """Store value under key at version, replacing what was there"""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO entries (key, version, value, stored_at) VALUES (?, ?, ?, ?)",
+                         (key, version, data, time.time()))
+        finally:
+            conn.close()
+        self._prune()
+
+    def _acquire(self, key):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # A refresh whose process died gives its lease up when it expires
+            conn.execute("DELETE FROM leases WHERE key = ? AND expires < ?", (key, now))
+            acquired = conn.execute("INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+                                    (key, self.owner, now + LEASE_SECONDS)).rowcount
+            conn.execute("COMMIT")
+            return bool(acquired)
+        finally:
+            conn.close()
+
+    def _release(self, key):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner))
+        finally:
+            conn.close()
+
+    def get_or_refresh(self, key, refresh, version='', max_age=None, wait=LEASE_SECONDS, on_wait=None):
+        """Get key's value at version (no older than max_age), or refresh() it once across processes.
+
+        While another process refreshes the key this waits up to wait
+        seconds for its result, then refreshes itself; on_wait, if given, is
+        called with True when that wait starts and False when it ends. A
+        cache file that can't be used only costs the sharing; refresh()
+        still runs.
+        """
+        try:
+            entry = self.get(key, version, max_age)
+            if entry is not None:
+                self._event('hits')
+                return entry.value
+
+            acquired = waiting = False
+            give_up = time.monotonic() + wait
+            try:
+                while time.monotonic() < give_up:
+                    if self._acquire(key):
+                        acquired = True
+                        break
+                    if not waiting:
+                        self._event('waits')
+                        waiting = True
+                        if on_wait:
+                            on_wait(True)
+                    time.sleep(POLL_SECONDS)
+                    entry = self.get(key, version, max_age)
+                    if entry is not None:
+                        self._event('hits')
+                        return entry.value
+            finally:
+                if waiting and on_wait:
+                    on_wait(False)
+            if acquired:
+                return self._refresh(key, refresh, version, max_age)
+            self._event('wait_timeouts')
+        except sqlite3.Error:
+            self._event('errors')
+        return refresh()
+
+    def _refresh(self, key, refresh, version, max_age):
+        try:
+            # The refresh we waited for may have stored it meanwhile
+            entry = self.get(key, version, max_age)
+            if entry is not None:
+                self._event('hits')
+                return entry.value
+            self._event('refreshes')
+            value = refresh()
+            try:
+                self.put(key, value, version)
+            except (sqlite3.Error, pickle.PicklingError, TypeError, AttributeError):
+                self._event('errors')
+            return value
+        finally:
+            self._release(key)
+
+    def stats(self):
+        """Get the number of entries, their total size and the refreshes in progress"""
+        conn = self._connect()
+        try:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM entries").fetchone()
+            leases = conn.execute("SELECT COUNT(*) FROM leases WHERE expires >= ?", (time.time(),)).fetchone()[0]
+            return {'entries': entries, 'bytes': size, 'refreshing': leases}
+        finally:
+            conn.close()
+
+    def _prune(self):
+        """Drop entries after ENTRY_TTL_SECONDS, and the oldest ones past MAX_CACHE_BYTES"""
+        now = time.time()
+        with self._lock:
+            if now - self._pruned_at < PRUNE_INTERVAL_SECONDS:
+                return
+            self._pruned_at = now
+
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM entries WHERE stored_at < ?", (now - ENTRY_TTL_SECONDS,))
+            total = 0
+            for key, size in conn.execute("SELECT key, LENGTH(value) FROM entries ORDER BY stored_at DESC").fetchall():
+                total += size
+                if total > MAX_CACHE_BYTES:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        finally:
+            conn.close()
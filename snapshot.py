@@ -0,0 +1,497 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+import streamlit as st
+
+from firebase_config import (
+    get_db,
+    ALL_LOCATIONS,
+    DEFAULT_TENANT,
+    LOCAL_DATA_DIR,
+    TOMBSTONE_RETENTION_DAYS,
+    get_active_tenant,
+    locations_collection,
+    inventory_collection,
+    charge_reads,
+    charge_session_reads,
+    counting_reads,
+    note_reads,
+    reads_admitted,
+    read_breaker_allows,
+    record_read_outcome,
+    release_read_probe,
+    submit_read,
+    new_peer_wait,
+    missed_read_deadline,
+    READ_DEADLINE_SECONDS,
+    record_stale_served,
+    note_stale_data,
+    record_from_doc,
+    get_legacy_inventory_records,
+    ReadUnavailable,
+    find_item_by_sku,
+    resolve_sharded_quantities,
+    resolve_sharded_records,
+    get_shared_cache,
+    get_write_version,
+    local_write_keys,
+    write_commit_time
+)
+from models import ITEM_FIELDS, decode_item
+
+# Each location's inventory is kept in memory as InventoryItem records and on disk as an uncompressed Arrow IPC file
+# (memory-mapped on load) tagged with a last_updated watermark. A warm start
+# reads the file and only fetches items changed, and tombstones written,
+# since the watermark; the file is rewritten after a sync brings changes.
+# Snapshots are kept per tenant; when reads are not admitted (daily budget
+# or read buckets, see read_governor.py), the read circuit breaker is open
+# or a sync fails, the last synced copy is served. Server processes on the
+# same host share syncs through the shared cache (see shared_cache.py): one
+# process reads a location's changes and the others use its result, and a
+# location with no file is loaded by one process while the others wait to
+# read the file it saves.
+
+SNAPSHOT_DIR = os.path.join(LOCAL_DATA_DIR, 'snapshots')
+SNAPSHOT_FORMAT = b'1'
+# Re-read a little before the watermark in case of commits landing out of order
+WATERMARK_OVERLAP = timedelta(seconds=60)
+# Don't rewrite the file more often than this while changes keep arriving
+SAVE_INTERVAL_SECONDS = 30
+# Calls within this window reuse the last sync (several widgets render per run)
+MIN_SYNC_SECONDS = 2
+# Changes another process fetched from the same watermark this recently, with
+# no write to the tenant committed since, are used as is
+SHARED_SYNC_SECONDS = 5
+# Local patches from this process's writes show until Firestore returns the
+# change, or are dropped after this long if it never does (rejected write)
+PATCH_TTL_SECONDS = 120
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def _column(values):
+    """Build an Arrow column, falling back to strings for mixed-type fields"""
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values])
+
+
+def _to_table(items, watermark):
+    extra = []
+    for item in items:
+        for name in item.extra or ():
+            if name not in extra:
+                extra.append(name)
+
+    columns = {name: _column([getattr(item, name) for item in items]) for name in ITEM_FIELDS}
+    columns.update({name: _column([item.extra.get(name) if item.extra else None for item in items]) for name in extra})
+    table = pa.table(columns)
+    return table.replace_schema_metadata({
+        b'format': SNAPSHOT_FORMAT,
+        b'watermark': watermark.isoformat().encode() if watermark else b''
+    })
+
+
+def _from_table(table):
+    # Extra fields an item doesn't have come back as nulls, which decoding drops
+    items = {}
+    for row in table.to_pylist():
+        item = decode_item(row)
+        items[item.id] = item
+    return items
+
+
+class LocationSnapshot:
+    """In-memory and on-disk copy of one location's inventory"""
+
+    def __init__(self, tenant, location):
+        self.tenant = tenant
+        self.location = location
+        # The default tenant keeps the files written before tenants existed
+        directory = SNAPSHOT_DIR if tenant == DEFAULT_TENANT else os.path.join(SNAPSHOT_DIR, 'tenants', tenant)
+        self.path = os.path.join(directory, f"{location}.arrow")
+        self.items = None
+        self.skus = {}
+        self.watermark = None
+        self.dirty = False
+        self.saved_at = 0.0
+        self.synced_at = None
+        # Wall time of the last sync that read Firestore, and whether the last sync skipped reading
+        self.fresh_at = None
+        self.stale = False
+        self.fetching = None
+        self.patches = {}
+        # item id -> (record, its dict), so dict callers don't convert every record on every rerun
+        self.views = {}
+        # Reentrant: a fetch that is already done lands in the thread that started it
+        self.lock = threading.RLock()
+
+    def _load_file(self):
+        try:
+            with pa.memory_map(self.path, 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (FileNotFoundError, pa.ArrowInvalid, OSError):
+            return False
+
+        metadata = table.schema.metadata or {}
+        if metadata.get(b'format') != SNAPSHOT_FORMAT or not metadata.get(b'watermark'):
+            return False
+
+        watermark = datetime.fromisoformat(metadata[b'watermark'].decode())
+        # Tombstones older than the retention may be gone, so deletes could be missed
+        if watermark < datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+            return False
+
+        self.items = _from_table(table)
+        self.views = {}
+        self.skus = {item.sku: item_id for item_id, item in self.items.items() if item.sku}
+        self.watermark = watermark
+        self.fresh_at = datetime.fromtimestamp(os.path.getmtime(self.path), timezone.utc)
+        return True
+
+    def _save_file(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        table = _to_table(list(self.items.values()), self.watermark)
+
+        # Write then rename so other processes never map a partial file
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with pa.OSFile(temp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, self.path)
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+    def _shared_full_load(self, db):
+        """Full-load the location in one process at a time; the others load the file it saves"""
+        loaded = []
+
+        def load():
+            self._full_load(db)
+            self._save_file()
+            loaded.append(True)
+            return True
+
+        get_shared_cache().get_or_refresh(f"full-load/{self.tenant}/{self.location}", load,
+                                          max_age=SHARED_SYNC_SECONDS)
+        if not loaded and not self._load_file():
+            # Nothing usable saved (e.g. items without last_updated)
+            self._full_load(db)
+
+    def _full_load(self, db):
+        self.items = {}
+        self.skus = {}
+        self.views = {}
+        self.watermark = None
+        for doc in inventory_collection(db, self.location, self.tenant).stream():
+            self._apply(record_from_doc(doc))
+        charge_reads(len(self.items), self.tenant)
+        self.dirty = True
+
+    def _apply(self, item):
+        old = self.items.get(item.id)
+        if old and old.sku and self.skus.get(old.sku) == item.id:
+            del self.skus[old.sku]
+        if item.sku:
+            self.skus[item.sku] = item.id
+        self.items[item.id] = item
+        updated = item.last_updated
+        if updated is not None and (self.watermark is None or updated > self.watermark):
+            self.watermark = updated
+
+    def _fetch_changes(self, db, since):
+        """Read the items changed and deleted since a time (runs in the read pool, without the lock)"""
+        location_ref = locations_collection(db, self.tenant).document(self.location)
+
+        changed = [
+            record_from_doc(doc)
+            for doc in inventory_collection(db, self.location, self.tenant).where('last_updated', '>=', since).stream()
+        ]
+        deleted = [
+            (doc.id, doc.get('deleted_at'))
+            for doc in location_ref.collection('tombstones').where('deleted_at', '>=', since).stream()
+        ]
+        charge_reads(max(1, len(changed)) + max(1, len(deleted)), self.tenant)
+        return changed, deleted
+
+    def _start_fetch(self, db):
+        # Called with the lock held; one fetch per snapshot at a time
+        if self.fetching is None:
+            since = self.watermark - WATERMARK_OVERLAP
+            key = f"changes/{self.tenant}/{self.location}/{since.isoformat()}"
+            peer_wait = new_peer_wait()
+
+            def fetch():
+                # Returns the changes and the reads they cost, for the session that started the fetch.
+                # Waiting for another process's fetch never outlasts the read deadline
+                with counting_reads() as counter:
+                    changes = get_shared_cache().get_or_refresh(
+                        key, lambda: self._fetch_changes(db, since), version=get_write_version(self.tenant),
+                        max_age=SHARED_SYNC_SECONDS, wait=READ_DEADLINE_SECONDS, on_wait=peer_wait.set
+                    )
+                return changes, counter.reads
+
+            future = self.fetching = submit_read(fetch, peer_wait)
+            future.started_by = threading.get_ident()
+            # A fetch that is already done lands here and clears self.fetching
+            future.add_done_callback(self._land)
+            return future
+        return self.fetching
+
+    def _land(self, future):
+        """Apply a finished fetch once, whether or not anyone still waits for it"""
+        with self.lock:
+            if self.fetching is not future:
+                return
+            self.fetching = None
+            timed_out = getattr(future, 'timed_out', False)
+            if future.exception() is not None:
+                record_read_outcome(False, late=timed_out)
+                return
+            record_read_outcome(True, late=timed_out)
+            changes, _ = future.result()
+            self._apply_changes(*changes)
+            self.fresh_at = datetime.now(timezone.utc)
+
+    def _apply_changes(self, changed, deleted):
+        for item in changed:
+            self._settle_patch(item.id, item.last_updated)
+            if self.items.get(item.id) != item:
+                self._apply(item)
+                self.dirty = True
+
+        for item_id, deleted_at in deleted:
+            self._settle_patch(item_id, deleted_at)
+            item = self.items.get(item_id)
+            # An item re-created after its deletion keeps its newer copy
+            if item and not (item.last_updated is not None and item.last_updated > deleted_at):
+                if self.skus.get(item.sku) == item_id:
+                    del self.skus[item.sku]
+                del self.items[item_id]
+                self.views.pop(item_id, None)
+                self.dirty = True
+            if deleted_at > self.watermark:
+                self.watermark = deleted_at
+
+    def _settle_patch(self, item_id, changed_at):
+        # Firestore now has our write, or a later one, of the item: both are server times
+        patch = self.patches.get(item_id)
+        if patch and isinstance(changed_at, datetime):
+            committed_at = write_commit_time(patch[1])
+            if committed_at is not None and changed_at >= committed_at:
+                del self.patches[item_id]
+
+    def patch(self, item_id, item, keys):
+        """Show a locally written item (None for a delete) until the version its write groups committed is synced"""
+        with self.lock:
+            self.patches[item_id] = (item, keys, datetime.now(timezone.utc))
+
+    def view(self, item):
+        """Get one of this snapshot's records as a dict, built once per version of the record"""
+        view = self.views.get(item.id)
+        if view is None or view[0] is not item:
+            view = (item, item.to_dict())
+            # Patched and sharded copies are not the snapshot's to keep
+            if self.items is not None and self.items.get(item.id) is item:
+                self.views[item.id] = view
+        return view[1]
+
+    def find_sku(self, sku):
+        """Look up an item by SKU in memory; None if unknown here"""
+        with self.lock:
+            for item, _, _ in self.patches.values():
+                if item is not None and item.sku == sku:
+                    return item
+            item_id = self.skus.get(sku)
+            if item_id in self.patches:
+                # Deleted or recoded since the last sync
+                return None
+            return self.items.get(item_id)
+
+    def _view(self):
+        expired = datetime.now(timezone.utc) - timedelta(seconds=PATCH_TTL_SECONDS)
+        self.patches = {item_id: patch for item_id, patch in self.patches.items() if patch[2] > expired}
+        if not self.patches:
+            return list(self.items.values())
+
+        items = dict(self.items)
+        for item_id, (item, _, _) in self.patches.items():
+            if item is None:
+                items.pop(item_id, None)
+            else:
+                items[item_id] = item
+        return list(items.values())
+
+    def sync(self, db):
+        """Bring the snapshot up to date and return its items.
+
+        Changes are fetched in the read pool. If that misses the read
+        deadline or fails, the current copy is returned; a late fetch is
+        still applied when it lands.
+        """
+        with self.lock:
+            if self.synced_at is not None and time.monotonic() - self.synced_at < MIN_SYNC_SECONDS:
+                return self._view()
+
+            self.stale = False
+            future = None
+            if self.items is None and not self._load_file():
+                # Nothing to fall back to
+                self._shared_full_load(db)
+                self.fresh_at = datetime.now(timezone.utc)
+            elif not reads_admitted(1, self.tenant):
+                # Serve the copy we have rather than read past the budget
+                self.stale = True
+                record_stale_served('budget', self.tenant)
+            elif not read_breaker_allows():
+                self.stale = True
+                record_stale_served('breaker', self.tenant)
+            elif self.watermark is None:
+                # A location whose items predate last_updated has no watermark
+                try:
+                    self._shared_full_load(db)
+                except Exception:
+                    record_read_outcome(False)
+                    raise
+                record_read_outcome(True)
+                self.fresh_at = datetime.now(timezone.utc)
+            else:
+                future = self._start_fetch(db)
+
+        if future is not None and getattr(future, 'timed_out', False):
+            # Already late for another caller; don't wait for it again. A probe
+            # that joined it didn't start a read, so the next caller may probe
+            release_read_probe()
+            self.stale = True
+            record_stale_served('deadline', self.tenant)
+        elif future is not None:
+            try:
+                _, reads = future.result(READ_DEADLINE_SECONDS)
+                self._land(future)
+                if getattr(future, 'started_by', None) == threading.get_ident():
+                    note_reads(reads)
+            except FuturesTimeoutError:
+                missed_read_deadline(future)
+                self.stale = True
+                record_stale_served('deadline', self.tenant)
+            except Exception:
+                self.stale = True
+                record_stale_served('error', self.tenant)
+
+        with self.lock:
+            self.synced_at = time.monotonic()
+
+            if self.dirty and time.monotonic() - self.saved_at >= SAVE_INTERVAL_SECONDS:
+                self._save_file()
+            return self._view()
+
+
+def get_location_snapshot(location, tenant=None):
+    """Get the process-wide snapshot of a location of a tenant (the active one by default)"""
+    key = (tenant or get_active_tenant(), location)
+    with _snapshots_lock:
+        if key not in _snapshots:
+            _snapshots[key] = LocationSnapshot(*key)
+        return _snapshots[key]
+
+
+def patch_local_item(item, removed=False):
+    """Reflect a write this session just queued without re-reading the location"""
+    if item.get('location'):
+        # Settled by the commit time of the groups just submitted
+        get_location_snapshot(item['location']).patch(item['id'], None if removed else decode_item(item),
+                                                      local_write_keys())
+
+
+def get_item_by_sku(location, sku):
+    """Resolve a scanned SKU from the in-memory index, reading Firestore only on a miss"""
+    db = get_db()
+    if not db:
+        return None
+
+    snapshot = get_location_snapshot(location)
+    if snapshot.items is None:
+        snapshot.sync(db)
+    item = snapshot.find_sku(sku)
+    if item is None:
+        # Added or recoded since the last sync, possibly by another process
+        return find_item_by_sku(location, sku)
+    return resolve_sharded_quantities([item.to_dict()])[0]
+
+
+def get_inventory_records(location, abc_classes=None):
+    """Get every item of a location, or of all locations, as InventoryItem records.
+
+    Only items changed since the last sync are read from Firestore; the
+    default tenant's un-migrated root collection is read whole. The records
+    are the snapshot's own; use dataclasses.replace to change one.
+    """
+    db = get_db()
+    if not db:
+        return []
+
+    try:
+        # Worker threads have no session, so the tenant is resolved here
+        tenant = get_active_tenant()
+
+        def sync(snapshot):
+            with counting_reads() as counter:
+                items = snapshot.sync(db)
+            return items, counter.reads
+
+        # The session pays for the reads its own syncs made, not for other sessions' reads meanwhile
+        with counting_reads() as counter:
+            if location == ALL_LOCATIONS:
+                locations = [ref.id for ref in locations_collection(db, tenant).list_documents()]
+                snapshots = [get_location_snapshot(loc, tenant) for loc in locations]
+                with ThreadPoolExecutor(max_workers=min(16, max(1, len(locations)))) as pool:
+                    synced = list(pool.map(sync, snapshots))
+                note_reads(sum(reads for _, reads in synced))
+                items = [item for snapshot_items, _ in synced for item in snapshot_items]
+                if tenant == DEFAULT_TENANT:
+                    # Items from before locations, until they are migrated (as in inventory_queries)
+                    try:
+                        items += get_legacy_inventory_records()
+                    except ReadUnavailable:
+                        pass  # Nothing read yet to fall back to; the locations are still shown
+            else:
+                snapshots = [get_location_snapshot(location, tenant)]
+                items = snapshots[0].sync(db)
+        charge_session_reads(counter.reads)
+
+        stale = [snapshot.fresh_at for snapshot in snapshots if snapshot.stale and snapshot.fresh_at]
+        if stale:
+            note_stale_data(min(stale))
+        if abc_classes:
+            items = [item for item in items if item.abc_class in abc_classes]
+        return resolve_sharded_records(items)
+    except Exception as e:
+        st.error(f"Error loading inventory: {e}")
+        return []
+
+
+def get_inventory_items(location, abc_classes=None):
+    """Get every item of a location, or of all locations, from the local snapshot.
+
+    Same result as firebase_config.get_inventory_items, but only items
+    changed since the last sync are read from Firestore.
+    """
+    tenant = get_active_tenant()
+    snapshots = {}
+    items = []
+    for item in get_inventory_records(location, abc_classes):
+        if not item.location:
+            items.append(item.to_dict())
+            continue
+        snapshot = snapshots.get(item.location)
+        if snapshot is None:
+            snapshot = snapshots[item.location] = get_location_snapshot(item.location, tenant)
+        # Callers may modify the items; the snapshot keeps its views
+        items.append(dict(snapshot.view(item)))
+    return items
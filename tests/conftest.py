@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+import threading
+
+# The app reads its data directory at import time
+os.environ.setdefault('INVENTORY_DATA_DIR', tempfile.mkdtemp(prefix='inventory-tests-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import firebase_config
+import snapshot
+from fake_firestore import FakeFirestore
+from load_test import install
+from read_governor import ReadGovernor
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh in-memory Firestore, with the app's local state in tmp_path"""
+    fake = FakeFirestore()
+    install(fake)
+    monkeypatch.setattr(firebase_config, 'LOCAL_DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(firebase_config, '_write_queue', None)
+    monkeypatch.setattr(firebase_config, '_shared_cache', None)
+    monkeypatch.setattr(firebase_config, '_change_feed', None)
+    monkeypatch.setattr(firebase_config, '_local_writes', threading.local())
+    monkeypatch.setattr(firebase_config, '_tenant_reads', {})
+    monkeypatch.setattr(firebase_config, '_tenant_budgets', {})
+    monkeypatch.setattr(firebase_config, '_read_governor', ReadGovernor(str(tmp_path / 'metrics')))
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(snapshot, '_snapshots', {})
+    return fake
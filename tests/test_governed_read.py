@@ -0,0 +1,38 @@
+import firebase_config
+
+
+def probe(db, tenant=None):
+    ref = firebase_config.tenant_root(db, tenant).collection('probes').document('p')
+    ref.set({'value': 1})
+
+    def read():
+        return ref.get().to_dict()['value']
+
+    return ref, read
+
+
+def test_recent_read_is_shared(db):
+    ref, read = probe(db)
+    assert firebase_config.governed_read('probe', read) == 1
+
+    # Changed outside the app: served from the shared read until it ages out
+    ref.set({'value': 2})
+    assert firebase_config.governed_read('probe', read) == 1
+
+
+def test_committed_write_invalidates_shared_reads(db):
+    ref, read = probe(db)
+    assert firebase_config.governed_read('probe', read) == 1
+
+    assert firebase_config.commit_writes([('set', ref, {'value': 3}, False)]) == 'done'
+    assert firebase_config.governed_read('probe', read) == 3
+
+
+def test_writes_to_another_tenant_keep_sharing(db):
+    ref, read = probe(db)
+    assert firebase_config.governed_read('probe', read) == 1
+    ref.set({'value': 2})
+
+    other = firebase_config.tenant_root(db, 'acme').collection('probes').document('p')
+    assert firebase_config.commit_writes([('set', other, {'value': 9}, False)]) == 'done'
+    assert firebase_config.governed_read('probe', read) == 1
@@ -0,0 +1,36 @@
+import firebase_config
+from firebase_config import DEFAULT_LOCATION, DEFAULT_TENANT, inventory_collection, locations_collection, tenant_scope
+
+
+def add_item(db, tenant, location, item_id, **fields):
+    locations_collection(db, tenant).document(location).set({'item_count': 1})
+    inventory_collection(db, location, tenant).document(item_id).set(dict(fields, location=location))
+
+
+def test_backfill_only_touches_the_active_tenant(db):
+    add_item(db, 'acme', 'main', 'a1', quantity=2, price=3.0)
+    add_item(db, DEFAULT_TENANT, 'main', 'd1', quantity=4, price=5.0)
+    db.collection('inventory').document('legacy').set({'quantity': 1, 'price': 7.0})
+
+    with tenant_scope('acme'):
+        assert firebase_config.backfill_total_value() == 1
+
+    assert inventory_collection(db, 'main', 'acme').document('a1').get().to_dict()['total_value'] == 6.0
+    assert 'total_value' not in inventory_collection(db, 'main', DEFAULT_TENANT).document('d1').get().to_dict()
+    assert 'total_value' not in db.collection('inventory').document('legacy').get().to_dict()
+
+    # The default tenant's pass covers its locations and the root collection
+    assert firebase_config.backfill_total_value() == 2
+    assert db.collection('inventory').document('legacy').get().to_dict()['total_value'] == 7.0
+
+
+def test_legacy_migration_is_only_for_the_default_tenant(db):
+    db.collection('inventory').document('legacy').set({'name': 'Old', 'quantity': 1, 'price': 7.0})
+
+    with tenant_scope('acme'):
+        assert firebase_config.migrate_legacy_inventory() == 0
+    assert db.collection('inventory').document('legacy').get().exists
+
+    assert firebase_config.migrate_legacy_inventory() == 1
+    assert not db.collection('inventory').document('legacy').get().exists
+    assert inventory_collection(db, DEFAULT_LOCATION, DEFAULT_TENANT).document('legacy').get().exists
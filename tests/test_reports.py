@@ -0,0 +1,46 @@
+import pandas as pd
+import streamlit as st
+
+import reports
+from analytics import AnalyticsEngine, job_key, inventory_columns
+
+
+class RecordingEngine:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, job_name, version, load_columns, params=None):
+        self.submitted.append((job_name, version))
+        raise AssertionError("a cancelled report must not be submitted again")
+
+
+def frame():
+    return pd.DataFrame({
+        'name': ['Bolt', 'Nut'], 'category': ['Hardware', 'Hardware'], 'location': ['main', 'main'],
+        'supplier': ['', ''], 'quantity': [5, 20], 'price': [2.0, 0.5]
+    })
+
+
+def test_job_key_matches_the_engine(db):
+    engine = AnalyticsEngine()
+    df = frame()
+    params = {'low_stock_threshold': 10}
+    try:
+        job = engine.submit('inventory_rollup', 'main:1', lambda: inventory_columns(df), params)
+        assert job.key == job_key('inventory_rollup', 'main:1', params)
+    finally:
+        engine.shutdown()
+
+
+def test_cancelled_rollup_is_not_started_again(db, monkeypatch):
+    engine = RecordingEngine()
+    monkeypatch.setattr(reports, 'get_analytics_engine', lambda: engine)
+    version = f"{reports.get_active_tenant()}/main:1"
+    st.session_state['report_cancelled'] = job_key(
+        'inventory_rollup', version, {'low_stock_threshold': reports.LOW_STOCK_THRESHOLD}
+    )
+    try:
+        assert reports.run_rollup(frame(), 'main', '1') is None
+    finally:
+        del st.session_state['report_cancelled']
+    assert engine.submitted == []
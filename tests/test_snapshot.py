@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import firebase_config
+import snapshot
+from load_test import seed
+
+
+@pytest.fixture
+def location(db, monkeypatch):
+    # Every call syncs rather than reusing the last sync
+    monkeypatch.setattr(snapshot, 'MIN_SYNC_SECONDS', 0)
+    seed(db, 0, 5)
+    return 'main'
+
+
+def items_of(location):
+    return {item['id']: item for item in snapshot.get_inventory_items(location)}
+
+
+def test_sync_applies_changes_and_deletes_since_the_watermark(db, location):
+    assert len(items_of(location)) == 5
+    snap = snapshot.get_location_snapshot(location)
+    watermark = snap.watermark
+
+    later = watermark + timedelta(seconds=5)
+    inventory = firebase_config.inventory_collection(db, location)
+    inventory.document('item000001').set({'name': 'Renamed', 'quantity': 7, 'price': 1.0, 'last_updated': later})
+    inventory.document('item000002').delete()
+    firebase_config.locations_collection(db).document(location).collection('tombstones').document('item000002') \
+        .set({'deleted_at': later})
+
+    items = items_of(location)
+    assert items['item000001']['name'] == 'Renamed'
+    assert 'item000002' not in items
+    assert snap.watermark == later
+
+
+def test_warm_start_reads_only_changes(db, location):
+    # Only the newest item is within the overlap re-read before the watermark
+    newest = datetime.now(timezone.utc) - timedelta(hours=1)
+    for doc in firebase_config.inventory_collection(db, location).stream():
+        doc.reference.update({'last_updated': newest if doc.id == 'item000000' else newest - timedelta(hours=1)})
+    items_of(location)
+    snapshot.get_location_snapshot(location)._save_file()
+    snapshot._snapshots.clear()
+
+    reads = db.counts['reads']
+    assert len(items_of(location)) == 5
+    # The file holds the items; the change and tombstone queries cost a read each
+    assert db.counts['reads'] - reads == 2
+
+
+def test_local_patch_shows_until_its_write_is_synced(db, location):
+    items_of(location)
+    snap = snapshot.get_location_snapshot(location)
+    item = items_of(location)['item000003']
+
+    assert firebase_config.update_inventory_item(item, {'name': 'Patched'})
+    snapshot.patch_local_item(dict(item, name='Patched'))
+    assert 'item000003' in snap.patches
+    assert items_of(location)['item000003']['name'] == 'Patched'
+    # The sync above read the committed write back, which settles the patch
+    assert 'item000003' not in snap.patches
+
+
+def test_patch_is_not_settled_by_an_older_server_version(db, location):
+    items_of(location)
+    snap = snapshot.get_location_snapshot(location)
+    item = items_of(location)['item000003']
+
+    assert firebase_config.update_inventory_item(item, {'name': 'Patched'})
+    snapshot.patch_local_item(dict(item, name='Patched'))
+    committed_at = firebase_config.write_commit_time(snap.patches['item000003'][1])
+
+    with snap.lock:
+        snap._settle_patch('item000003', committed_at - timedelta(microseconds=1))
+    assert 'item000003' in snap.patches
+    with snap.lock:
+        snap._settle_patch('item000003', committed_at)
+    assert 'item000003' not in snap.patches
+
+
+def test_all_locations_include_unmigrated_root_items(db, location):
+    db.collection('inventory').document('legacy').set({'name': 'Old', 'quantity': 1, 'price': 2.0})
+
+    from_snapshot = snapshot.get_inventory_items(firebase_config.ALL_LOCATIONS)
+    from_firestore = firebase_config.get_inventory_items(firebase_config.ALL_LOCATIONS)
+
+    assert sorted(item['id'] for item in from_snapshot) == sorted(item['id'] for item in from_firestore)
+    assert 'legacy' in {item['id'] for item in from_snapshot}
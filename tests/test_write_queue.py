@@ -0,0 +1,113 @@
+import pytest
+from firebase_admin import firestore
+from google.api_core import exceptions as api_exceptions
+
+import firebase_config
+from write_queue import WriteQueue
+
+
+@pytest.fixture
+def queue(db, tmp_path):
+    """A queue flushed by hand rather than by its background thread"""
+    queue = WriteQueue(str(tmp_path / 'queue.db'), lambda: db)
+    queue.start = lambda: None
+    return queue
+
+
+def flush_all(queue, attempts=10):
+    for _ in range(attempts):
+        try:
+            if not queue.flush():
+                return
+        except api_exceptions.ServiceUnavailable:
+            pass
+
+
+def fail_once_after_commit(queue, flush_ids):
+    """Make the first commit of a matching flush land but look like a transient failure"""
+    commit = queue._commit
+    failed = set()
+
+    def flaky_commit(db, flush_id, rows):
+        commit_time = commit(db, flush_id, rows)
+        if flush_ids(flush_id) and flush_id not in failed:
+            failed.add(flush_id)
+            raise api_exceptions.ServiceUnavailable("connection reset")
+        return commit_time
+
+    queue._commit = flaky_commit
+
+
+def test_submitting_a_key_twice_is_a_no_op(queue):
+    assert queue.submit([('set', 'items/a', {'n': 1}, False)], 'k') == 'k'
+    assert queue.submit([('set', 'items/a', {'n': 2}, False)], 'k') is None
+    flush_all(queue)
+    assert queue.status('k') == 'done'
+    assert queue.submit([('set', 'items/a', {'n': 3}, False)], 'k') is None
+
+
+def test_commit_writes_reports_duplicates(db):
+    ref = db.collection('items').document('a')
+    assert firebase_config.commit_writes([('set', ref, {'n': 1}, False)], 'key-1') == 'done'
+    assert firebase_config.commit_writes([('set', ref, {'n': 2}, False)], 'key-1') == 'duplicate'
+    assert ref.get().to_dict() == {'n': 1}
+
+
+def test_retried_batch_that_landed_is_applied_once(db, queue):
+    ref = db.collection('items').document('a')
+    ref.set({'n': 0})
+    queue.submit([('set', ref.path, {'n': firestore.Increment(1)}, True)], 'k')
+    fail_once_after_commit(queue, lambda flush_id: True)
+
+    flush_all(queue)
+
+    assert queue.status('k') == 'done'
+    assert ref.get().to_dict() == {'n': 1}
+    assert queue.commit_time('k') is not None
+
+
+def test_rejected_group_is_isolated_from_the_batch(db, queue):
+    ref = db.collection('items').document('a')
+    ref.set({'n': 0})
+    queue.submit([('set', ref.path, {'n': firestore.Increment(1)}, True)], 'good')
+    queue.submit([('update', 'items/missing', {'n': 1}, False)], 'bad')
+
+    flush_all(queue)
+
+    assert queue.status('good') == 'done'
+    assert queue.status('bad') == 'failed'
+    assert ref.get().to_dict() == {'n': 1}
+
+
+def test_isolated_group_keeps_its_receipt_across_retries(db, queue):
+    ref = db.collection('items').document('a')
+    ref.set({'n': 0})
+    queue.submit([('set', ref.path, {'n': firestore.Increment(1)}, True)], 'good')
+    queue.submit([('update', 'items/missing', {'n': 1}, False)], 'bad')
+    fail_once_after_commit(queue, lambda flush_id: flush_id.endswith('-good'))
+
+    flush_all(queue)
+
+    assert queue.status('good') == 'done'
+    assert ref.get().to_dict() == {'n': 1}
+
+
+def test_failed_key_is_retried_when_submitted_again(db, queue):
+    ref = db.collection('items').document('a')
+    queue.submit([('update', ref.path, {'n': 1}, False)], 'k')
+    flush_all(queue)
+    assert queue.status('k') == 'failed'
+
+    ref.set({'n': 0})
+    assert queue.submit([('update', ref.path, {'n': 1}, False)], 'k') == 'k'
+    flush_all(queue)
+
+    assert queue.status('k') == 'done'
+    assert ref.get().to_dict() == {'n': 1}
+
+
+def test_drain_waits_for_pending_groups(db):
+    ref = db.collection('items').document('a')
+    firebase_config.commit_writes([('set', ref, {'n': 1}, False)], 'k', wait=0)
+    assert firebase_config.drain_writes(5) == 0
+    assert ref.get().to_dict() == {'n': 1}
@@ -0,0 +1,176 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+from firebase_admin import firestore
+
+from firebase_config import (
+    get_db,
+    ALL_LOCATIONS,
+    tenant_root,
+    commit_writes,
+    wait_for_writes
+)
+from models import items_frame
+from snapshot import get_inventory_records
+
+# One small document per day holds the tenant's total value, quantity and
+# item count, per location and per category. Old days are rolled up into
+# weeks and old weeks into months, so a two-year trend is ~150 reads:
+#   valuations/daily-2026-10-19
+#   valuations/weekly-2025-W42
+#   valuations/monthly-2024-11
+# under tenants/{tenant}/, except for the default tenant's root collection.
+# Rolled-up documents carry the period's last values plus its average.
+# Run once a day, e.g. python cli.py valuation
+
+DAILY_RETENTION_DAYS = 92
+WEEKLY_RETENTION_DAYS = 366
+ROLLUPS = [
+    # (granularity rolled up, into, kept for days, period of a date)
+    ('daily', 'weekly', DAILY_RETENTION_DAYS, lambda day: f"{day.isocalendar()[0]}-W{day.isocalendar()[1]:02d}"),
+    ('weekly', 'monthly', WEEKLY_RETENTION_DAYS, lambda day: f"{day:%Y-%m}"),
+]
+
+
+def valuations_collection(db, tenant=None):
+    return tenant_root(db, tenant).collection('valuations')
+
+
+def summarize_items(items):
+    """Roll item records up into valuation totals per location and per category"""
+    df = items_frame(items, ('location', 'category', 'quantity', 'price'))
+    df['value'] = df['quantity'] * df['price']
+    df['location'] = df['location'].fillna('')
+
+    locations = {}
+    for location, group in df.groupby('location'):
+        by_category = group.groupby('category')['value'].sum()
+        locations[location] = {
+            'total_value': round(float(group['value'].sum()), 2),
+            'total_quantity': int(group['quantity'].sum()),
+            'item_count': len(group),
+            'category_values': {category: round(float(value), 2) for category, value in by_category.items()}
+        }
+
+    return {
+        'total_value': round(float(df['value'].sum()), 2),
+        'total_quantity': int(df['quantity'].sum()),
+        'item_count': len(df),
+        'locations': locations
+    }
+
+
+def take_valuation_snapshot(day=None):
+    """Store today's (or day's) valuation of every location; returns the stored totals"""
+    db = get_db()
+    if not db:
+        raise ConnectionError("Database connection failed")
+
+    day = day or datetime.now(timezone.utc).date()
+    valuation = summarize_items(get_inventory_records(ALL_LOCATIONS))
+    valuation.update({
+        'granularity': 'daily',
+        'period': day.isoformat(),
+        'date': day.isoformat(),
+        'samples': 1,
+        'avg_total_value': valuation['total_value'],
+        'created_at': firestore.SERVER_TIMESTAMP
+    })
+    commit_writes([('set', valuations_collection(db).document(f"daily-{day.isoformat()}"), valuation, False)])
+    return valuation
+
+
+def _roll_up(members, granularity, period):
+    """Combine consecutive valuations into one for a longer period"""
+    members = sorted(members, key=lambda member: member['date'])
+    samples = sum(member.get('samples', 1) for member in members)
+    latest = members[-1]
+    return {
+        'total_value': latest['total_value'],
+        'total_quantity': latest['total_quantity'],
+        'item_count': latest['item_count'],
+        'locations': latest.get('locations', {}),
+        'granularity': granularity,
+        'period': period,
+        'date': latest['date'],
+        'samples': samples,
+        'avg_total_value': round(sum(member.get('avg_total_value', member['total_value']) * member.get('samples', 1)
+                                     for member in members) / samples, 2),
+        'created_at': firestore.SERVER_TIMESTAMP
+    }
+
+
+def roll_up_valuations(today=None):
+    """Replace valuations past their retention with weekly and monthly ones.
+
+    Returns (documents rolled up, status): status is 'done' once every
+    rollup is written, else the first other write status.
+    """
+    db = get_db()
+    if not db:
+        raise ConnectionError("Database connection failed")
+
+    today = today or datetime.now(timezone.utc).date()
+    collection = valuations_collection(db)
+    rolled = 0
+    keys = []
+
+    for granularity, into, keep_days, period_of in ROLLUPS:
+        cutoff = today - timedelta(days=keep_days)
+        old = [
+            (doc.reference, doc.to_dict())
+            for doc in collection.where('granularity', '==', granularity).where('date', '<', cutoff.isoformat()).stream()
+        ]
+        periods = {}
+        for ref, valuation in old:
+            periods.setdefault(period_of(date.fromisoformat(valuation['date'])), []).append((ref, valuation))
+
+        for period, members in periods.items():
+            # A period that straddles the cutoff may already have a rollup; fold into it
+            target = collection.document(f"{into}-{period}")
+            existing = target.get()
+            valuations = [valuation for _, valuation in members]
+            if existing.exists:
+                valuations.append(existing.to_dict())
+
+            writes = [('set', target, _roll_up(valuations, into, period), False)]
+            writes.extend(('delete', ref, None, False) for ref, _ in members)
+            key = f"rollup-{target.path}-{len(members)}-{members[-1][1]['date']}"
+            if commit_writes(writes, key, wait=0) != 'duplicate':
+                keys.append(key)
+            rolled += len(members)
+
+    return rolled, wait_for_writes(keys)
+
+
+def get_valuation_series(location=ALL_LOCATIONS, days=365):
+    """Get the valuation trend of a location (or all) over the last days, oldest first"""
+    db = get_db()
+    if not db:
+        return pd.DataFrame()
+
+    since = (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
+    rows = []
+    for doc in valuations_collection(db).where('date', '>=', since).order_by('date').stream():
+        valuation = doc.to_dict()
+        if location == ALL_LOCATIONS:
+            totals = valuation
+            category_values = {}
+            for location_totals in valuation.get('locations', {}).values():
+                for category, value in location_totals.get('category_values', {}).items():
+                    category_values[category] = category_values.get(category, 0.0) + value
+        else:
+            totals = valuation.get('locations', {}).get(location)
+            if totals is None:
+                continue
+            category_values = totals.get('category_values', {})
+
+        rows.append({
+            'date': pd.Timestamp(valuation['date']),
+            'granularity': valuation['granularity'],
+            'total_value': totals['total_value'],
+            'total_quantity': totals['total_quantity'],
+            'item_count': totals['item_count'],
+            **{f"category:{category}": value for category, value in category_values.items()}
+        })
+    return pd.DataFrame(rows)
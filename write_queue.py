@@ -0,0 +1,438 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+from google.api_core import exceptions as api_exceptions
+
+# Firestore rejects these outright; retrying the same write will never succeed
+PERMANENT_ERRORS = (
+    api_exceptions.NotFound,
+    api_exceptions.InvalidArgument,
+    api_exceptions.PermissionDenied,
+    api_exceptions.FailedPrecondition,
+)
+
+MAX_BATCH_WRITES = 500
+LEASE_SECONDS = 30
+RECEIPT_TTL_DAYS = 7
+
+
+def _encode(value):
+    """Convert a Firestore write value to JSON-safe form"""
+    if value is firestore.SERVER_TIMESTAMP:
+        return {'__sentinel__': 'server_timestamp'}
+    if value is firestore.DELETE_FIELD:
+        return {'__sentinel__': 'delete_field'}
+    if isinstance(value, firestore.Increment):
+        return {'__increment__': value.value}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, dict):
+        return {key: _encode(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(val) for val in value]
+    if hasattr(value, 'item'):
+        # numpy scalars coming from DataFrames and editors
+        return value.item()
+    return value
+
+
+def _decode(value):
+    """Convert a JSON-safe value back to a Firestore write value"""
+    if isinstance(value, dict):
+        if value.keys() == {'__sentinel__'}:
+            return firestore.SERVER_TIMESTAMP if value['__sentinel__'] == 'server_timestamp' else firestore.DELETE_FIELD
+        if value.keys() == {'__increment__'}:
+            return firestore.Increment(value['__increment__'])
+        if value.keys() == {'__datetime__'}:
+            return datetime.fromisoformat(value['__datetime__'])
+        return {key: _decode(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [_decode(val) for val in value]
+    return value
+
+
+def _merge_fields(target, source, deep):
+    """Merge encoded write fields, summing increments to the same field"""
+    for key, value in source.items():
+        current = target.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            if current.keys() == {'__increment__'} and value.keys() == {'__increment__'}:
+                target[key] = {'__increment__': current['__increment__'] + value['__increment__']}
+                continue
+            if deep and '__sentinel__' not in current and '__sentinel__' not in value:
+                _merge_fields(current, value, deep)
+                continue
+        target[key] = value
+
+
+def coalesce_writes(writes):
+    """Collapse consecutive compatible writes to the same document.
+
+    Writes are (op, path, data, merge) tuples. Merge-sets fold into
+    merge-sets and updates into updates, a delete supersedes everything
+    before it, and per-document order is otherwise preserved.
+    """
+    by_path = {}
+    for op, path, data, merge in writes:
+        doc_writes = by_path.setdefault(path, [])
+        if op == 'delete':
+            doc_writes[:] = [(op, path, None, False)]
+            continue
+
+        if doc_writes:
+            last_op, _, last_data, last_merge = doc_writes[-1]
+            if (op == 'update' and last_op == 'update') or (op == 'set' and merge and last_op == 'set' and last_merge):
+                merged = json.loads(json.dumps(last_data))
+                _merge_fields(merged, data, deep=(op == 'set'))
+                doc_writes[-1] = (op, path, merged, merge)
+                continue
+        doc_writes.append((op, path, data, merge))
+
+    return [write for doc_writes in by_path.values() for write in doc_writes]
+
+
+class WriteQueue:
+    """Durable local queue of Firestore writes, flushed in the background.
+
+    Writes are accepted into a SQLite (WAL) file and committed to Firestore
+    in coalesced batches by a flusher thread. Each logical write is a group
+    with an idempotency key; submitting the same key twice is a no-op. Each
+    Firestore batch creates a receipt document named after the flush, so a
+    retry of a batch that already landed fails as a whole with AlreadyExists
+    and is treated as done. Receipts carry an expires_at field for a
+    Firestore TTL policy on the _write_receipts collection.
+    
+    on_commit, if given, is called with (flush_id, commit_time, writes)
+    after every committed batch, with writes in their stored JSON form.
+    """
+
+    def __init__(self, path, get_db, on_commit=None):
+        self.path = path
+        self.get_db = get_db
+        self.on_commit = on_commit
+        self.owner = uuid.uuid4().hex
+        self._wake = threading.Event()
+        self._flushed = threading.Condition()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS groups (
+                    key TEXT PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    done_at REAL,
+                    committed_at TEXT
+                );
+                CREATE TABLE IF NOT EXISTS writes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    group_key TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    data TEXT,
+                    merge INTEGER NOT NULL DEFAULT 0,
+                    flush_id TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS writes_group ON writes (group_key);
+                CREATE TABLE IF NOT EXISTS lease (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    owner TEXT,
+                    expires_at REAL
+                );
+                INSERT OR IGNORE INTO lease (id, owner, expires_at) VALUES (1, NULL, 0);
+            """)
+            # Queue files created before commit times were kept
+            if 'committed_at' not in {row[1] for row in conn.execute("PRAGMA table_info(groups)")}:
+                conn.execute("ALTER TABLE groups ADD COLUMN committed_at TEXT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def submit(self, writes, key=None):
+        """Durably accept a group of writes; returns its key, or None if the key was already submitted.
+
+        A key whose group Firestore rejected is accepted again, so a retry
+        of a failed submission is written rather than dropped.
+        """
+        key = key or uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO groups (key, created_at) VALUES (?, ?)", (key, time.time())
+            ).rowcount
+            if not inserted:
+                # A failed group's writes were never committed (see flush)
+                inserted = conn.execute(
+                    "UPDATE groups SET status = 'pending', error = NULL, created_at = ?, done_at = NULL "
+                    "WHERE key = ? AND status = 'failed'",
+                    (time.time(), key)
+                ).rowcount
+            if not inserted:
+                conn.execute("ROLLBACK")
+                return None
+
+            conn.executemany(
+                "INSERT INTO writes (group_key, op, path, data, merge) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (key, op, path, json.dumps(_encode(data)) if data is not None else None, int(merge))
+                    for op, path, data, merge in writes
+                ]
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        self.start()
+        self._wake.set()
+        return key
+
+    def wait(self, key, timeout):
+        """Wait up to timeout seconds for a group to be flushed; returns its status"""
+        deadline = time.time() + timeout
+        with self._flushed:
+            while True:
+                status = self.status(key)
+                remaining = deadline - time.time()
+                if status != 'pending' or remaining <= 0:
+                    return status
+                # Another process may hold the flusher lease, so poll as well
+                self._flushed.wait(min(remaining, 0.2))
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds for every pending group to be flushed; returns how many are left"""
+        deadline = time.time() + timeout
+        self.start()
+        self._wake.set()
+        with self._flushed:
+            while True:
+                pending = self.counts()['pending']
+                remaining = deadline - time.time()
+                if not pending or remaining <= 0:
+                    return pending
+                self._flushed.wait(min(remaining, 0.2))
+
+    def status(self, key):
+        """Get the status of a submitted group: pending, done or failed"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT status FROM groups WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def commit_time(self, key):
+        """Get the Firestore commit time of a group that is done, or None"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT committed_at FROM groups WHERE key = ? AND status = 'done'", (key,)).fetchone()
+            return datetime.fromisoformat(row[0]) if row and row[0] else None
+        finally:
+            conn.close()
+
+    def counts(self):
+        """Get the number of pending and failed groups"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM groups WHERE status IN ('pending', 'failed') GROUP BY status"
+            ).fetchall()
+            return {'pending': 0, 'failed': 0, **dict(rows)}
+        finally:
+            conn.close()
+
+    def failed_groups(self):
+        """Get the key, error and age of groups Firestore rejected"""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT key, error, created_at FROM groups WHERE status = 'failed' ORDER BY created_at"
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def discard_failed(self):
+        """Drop groups Firestore rejected"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM writes WHERE group_key IN (SELECT key FROM groups WHERE status = 'failed')")
+            conn.execute("DELETE FROM groups WHERE status = 'failed'")
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def start(self):
+        """Start the background flusher thread if it is not running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-queue-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        backoff = 0.5
+        while True:
+            try:
+                flushed = self.flush()
+                backoff = 0.5
+            except Exception:
+                # Firestore is slow or unreachable; keep the writes and retry later
+                flushed = False
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+            if not flushed:
+                self._wake.wait(timeout=1.0)
+                self._wake.clear()
+
+    def _acquire_lease(self, conn):
+        """Make this process the only flusher of the queue file for a while"""
+        now = time.time()
+        return conn.execute(
+            "UPDATE lease SET owner = ?, expires_at = ? WHERE id = 1 AND (owner = ? OR expires_at < ?)",
+            (self.owner, now + LEASE_SECONDS, self.owner, now)
+        ).rowcount == 1
+
+    def _claim(self, conn):
+        """Pick the next batch of groups in submission order; returns (flush_id, rows)"""
+        # A batch that failed transiently is retried exactly as it was,
+        # so its receipt id keeps matching what may already have landed
+        row = conn.execute("SELECT flush_id FROM writes WHERE flush_id IS NOT NULL ORDER BY seq LIMIT 1").fetchone()
+        if row:
+            flush_id = row[0]
+        else:
+            flush_id = uuid.uuid4().hex
+            rows = conn.execute("""
+                SELECT w.group_key, w.path FROM writes w JOIN groups g ON g.key = w.group_key
+                WHERE g.status = 'pending' ORDER BY w.seq LIMIT 5000
+            """).fetchall()
+            group_paths = {}
+            for group_key, path in rows:
+                group_paths.setdefault(group_key, set()).add(path)
+
+            # Coalescing never adds documents, so distinct paths (plus the
+            # receipt) bound the number of writes in the batch
+            paths = set()
+            keys = []
+            for group_key, new_paths in group_paths.items():
+                if keys and len(paths | new_paths) + 1 > MAX_BATCH_WRITES:
+                    break
+                keys.append(group_key)
+                paths |= new_paths
+
+            if not keys:
+                return None, []
+            conn.executemany("UPDATE writes SET flush_id = ? WHERE group_key = ?", [(flush_id, k) for k in keys])
+
+        rows = conn.execute(
+            "SELECT seq, group_key, op, path, data, merge FROM writes WHERE flush_id = ? ORDER BY seq", (flush_id,)
+        ).fetchall()
+        return flush_id, rows
+
+    def _commit(self, db, flush_id, rows):
+        """Commit rows as one coalesced batch guarded by a receipt document; returns the commit time"""
+        writes = [(op, path, json.loads(data) if data else None, bool(merge)) for _, _, op, path, data, merge in rows]
+        batch = db.batch()
+        batch.create(db.collection('_write_receipts').document(flush_id), {
+            'groups': len({row[1] for row in rows}),
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'expires_at': datetime.now() + timedelta(days=RECEIPT_TTL_DAYS)
+        })
+
+        writes = coalesce_writes(writes)
+        for op, path, data, merge in writes:
+            ref = db.document(path)
+            if op == 'delete':
+                batch.delete(ref)
+            elif op == 'update':
+                batch.update(ref, _decode(data))
+            else:
+                batch.set(ref, _decode(data), merge=merge)
+
+        try:
+            results = batch.commit()
+            commit_time = results[0].update_time
+        except api_exceptions.AlreadyExists:
+            # A previous attempt of this exact batch already landed, with its receipt
+            receipt = db.collection('_write_receipts').document(flush_id).get()
+            commit_time = receipt.create_time or datetime.now(timezone.utc)
+
+        if self.on_commit:
+            try:
+                self.on_commit(flush_id, commit_time, writes)
+            except Exception:
+                pass  # Observers must never make a landed batch look failed
+        return commit_time
+
+    def _finish(self, conn, keys, status, error=None, commit_time=None):
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("DELETE FROM writes WHERE group_key = ?", [(k,) for k in keys])
+        committed_at = commit_time.isoformat() if commit_time else None
+        conn.executemany(
+            "UPDATE groups SET status = ?, error = ?, done_at = ?, committed_at = ? WHERE key = ?",
+            [(status, error, time.time(), committed_at, k) for k in keys]
+        )
+        # Remember finished keys for a day to reject duplicate submissions
+        conn.execute("DELETE FROM groups WHERE status = 'done' AND done_at < ?", (time.time() - 86400,))
+        conn.execute("COMMIT")
+
+    def _isolate(self, conn, db, flush_id, keys, rows):
+        """Commit each group of a rejected batch on its own, failing only the rejected ones"""
+        # Each group's receipt id is stored before committing, so a retry after a
+        # transient error reuses it and a group that already landed is not applied twice
+        conn.executemany("UPDATE writes SET flush_id = ? WHERE group_key = ?", [(f"{flush_id}-{key}", key) for key in keys])
+        for key in keys:
+            group_rows = [row for row in rows if row[1] == key]
+            try:
+                self._finish(conn, [key], 'done', commit_time=self._commit(db, f"{flush_id}-{key}", group_rows))
+            except PERMANENT_ERRORS as e:
+                self._finish(conn, [key], 'failed', str(e))
+
+    def flush(self):
+        """Commit the next batch of pending writes; returns False when there was nothing to do"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if not self._acquire_lease(conn):
+                conn.execute("COMMIT")
+                return False
+            flush_id, rows = self._claim(conn)
+            conn.execute("COMMIT")
+            if not rows:
+                return False
+
+            db = self.get_db()
+            if not db:
+                raise ConnectionError("Firestore is not available")
+
+            keys = list(dict.fromkeys(row[1] for row in rows))
+            try:
+                self._finish(conn, keys, 'done', commit_time=self._commit(db, flush_id, rows))
+            except PERMANENT_ERRORS as e:
+                if len(keys) == 1:
+                    # Nothing to isolate: this group is the rejected one
+                    self._finish(conn, keys, 'failed', str(e))
+                else:
+                    self._isolate(conn, db, flush_id, keys, rows)
+            except Exception:
+                conn.execute("UPDATE writes SET attempts = attempts + 1 WHERE flush_id = ?", (flush_id,))
+                raise
+
+            with self._flushed:
+                self._flushed.notify_all()
+            return True
+        finally:
+            conn.close()